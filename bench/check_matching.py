@@ -0,0 +1,49 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from matching import AnswerMatcher  # noqa: E402
+
+# Проверка сравнения ответов: (ответ загадки, догадка, должна ли засчитаться).
+# Код выхода 1 — хотя бы одна проверка не прошла
+CASES = [
+    ("Москва", "москва", True),
+    ("Москва", "Москва!", True),
+    ("Ёлка", "елка", True),
+    ("«Кот»", "кот", True),
+    ("Санкт-Петербург", "санкт петербург", True),
+    ("Санкт-Петербург", "Санкт-Питербург", True),
+    ("кот", "кит", False),
+    ("C++", "c++", True),
+    ("C++", "C#", False),
+    ("C++", "c", False),
+    ("C#", "c#", True),
+    ("C#", "c", False),
+    ("c", "C++", False),
+    ("🍎", "🍎", True),
+    ("🍎", "🍐", False),
+    ("+", "+", True),
+    ("+", "-", False),
+    ("?", "?", True),
+    ("?", "!", False),
+    ("...", "...", True),
+    ("кот | ?", "?", True),
+    ("кот | ?", "Кот.", True),
+]
+
+
+def main():
+    failed = 0
+    for answer, guess, expected in CASES:
+        matcher = AnswerMatcher(answer)
+        ok = matcher.matches(guess) == expected
+        failed += not ok
+        print(f"  {'ok  ' if ok else 'FAIL'} {answer!r} {'<-' if expected else '</-'} {guess!r}  {matcher!r}")
+    print(f"Проверок {len(CASES)}, не прошло {failed}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
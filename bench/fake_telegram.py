@@ -0,0 +1,165 @@
+import asyncio
+import itertools
+import json
+import random
+import socket
+import threading
+import time
+from collections import Counter, deque
+
+from aiohttp import web
+
+# Заглушка Bot API для локальных прогонов: отвечает на методы, которые вызывает бот,
+# правдоподобными объектами, считает и журналирует вызовы. Умеет задерживать ответы
+# (latency ± jitter, сек) и отвечать 429 с retry_after на долю rate_429 запросов.
+# Бота направляют сюда через TELEGRAM_API_URL=http://127.0.0.1:<port>
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "RiddleBot", "username": "riddle_bot"}
+ADMIN_RIGHTS = ("can_manage_chat", "can_delete_messages", "can_manage_video_chats", "can_restrict_members",
+                "can_promote_members", "can_change_info", "can_invite_users", "can_post_stories", "can_edit_stories",
+                "can_delete_stories")
+
+
+# Свободный локальный порт для заглушки и серверов бота в прогонах
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class FakeTelegram:
+    def __init__(self, host="127.0.0.1", port=8081, admin_status="administrator", members_count=100,
+                 latency=0.0, jitter=0.0, rate_429=0.0, retry_after=1, log_size=10000):
+        self.host = host
+        self.port = port
+        self.admin_status = admin_status
+        self.members_count = members_count
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.limited = Counter()  # ответы 429 по методам
+        self.log = deque(maxlen=log_size)  # последние вызовы: (время, метод, chat_id)
+        self._message_ids = itertools.count(1000)
+        self._lock = threading.Lock()
+        self._loop = None
+        self._runner = None
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        app.router.add_get("/calls", self.handle_calls)
+        app.router.add_post("/reset", self.handle_reset)
+        return app
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        params = dict(request.query)
+        if request.can_read_body:
+            if request.content_type == "application/json":
+                params.update(await request.json())
+            else:
+                params.update(await request.post())
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        limited = self.rate_429 and method != "getUpdates" and random.random() < self.rate_429
+        with self._lock:
+            self.log.append((time.time(), method, params.get("chat_id")))
+            if limited:
+                self.limited[method] += 1
+            else:
+                self.calls[method] += 1
+        if limited:
+            return web.json_response({"ok": False, "error_code": 429,
+                                      "description": f"Too Many Requests: retry after {self.retry_after}",
+                                      "parameters": {"retry_after": self.retry_after}}, status=429)
+        return web.json_response({"ok": True, "result": self.result(method, params)})
+
+    async def handle_calls(self, request):
+        return web.json_response(self.snapshot())
+
+    async def handle_reset(self, request):
+        self.reset()
+        return web.json_response({"ok": True})
+
+    def snapshot(self):
+        with self._lock:
+            return {"calls": dict(self.calls), "limited": dict(self.limited)}
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.limited.clear()
+            self.log.clear()
+
+    def _chat(self, chat_id):
+        chat_id = int(chat_id)
+        if chat_id > 0:
+            return {"id": chat_id, "type": "private", "first_name": f"user{chat_id}"}
+        return {"id": chat_id, "type": "supergroup", "title": f"Чат {-chat_id}"}
+
+    def _message(self, params, **extra):
+        with self._lock:
+            message_id = next(self._message_ids)
+        return dict({"message_id": message_id, "date": int(time.time()), "chat": self._chat(params.get("chat_id", 1)),
+                     "from": BOT_USER}, **extra)
+
+    def result(self, method, params):
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "editMessageText"):
+            return self._message(params, text=params.get("text", ""))
+        if method in ("sendPhoto", "editMessageCaption"):
+            return self._message(params, caption=params.get("caption", ""),
+                                 photo=[{"file_id": "photo", "file_unique_id": "photo", "width": 1, "height": 1}])
+        if method == "getChat":
+            return self._chat(params["chat_id"])
+        if method == "getChatMemberCount":
+            return self.members_count
+        if method == "getChatMember":
+            user_id = int(params["user_id"])
+            member = {"status": self.admin_status, "user": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}}
+            if self.admin_status in ("creator", "administrator"):
+                member["is_anonymous"] = False
+            if self.admin_status == "administrator":
+                member.update(dict.fromkeys(ADMIN_RIGHTS, True), can_be_edited=False)
+            return member
+        if method == "getUpdates":
+            return []
+        return True  # deleteMessage(s), setWebhook, deleteWebhook, answerCallbackQuery и прочее
+
+    async def serve(self, ready=None):
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        if ready is not None:
+            ready.set()
+        await asyncio.Event().wait()
+
+    # Запуск в фоновом потоке для скриптов нагрузки
+    def start(self):
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.serve(ready))
+
+        threading.Thread(target=run, name="fake-telegram", daemon=True).start()
+        ready.wait(10)
+        return f"http://{self.host}:{self.port}"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Заглушка Telegram Bot API")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, сек")
+    parser.add_argument("--jitter", type=float, default=0.0, help="разброс задержки, сек")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля запросов, получающих 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args()
+    print(json.dumps({"url": f"http://127.0.0.1:{args.port}"}), flush=True)
+    asyncio.run(FakeTelegram(port=args.port, latency=args.latency, jitter=args.jitter, rate_429=args.rate_429,
+                             retry_after=args.retry_after).serve())
@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+from fake_telegram import free_port  # noqa: E402
+from scenarios import SCENARIOS  # noqa: E402
+
+# Нагрузочный прогон bot.py без настоящего Telegram. Родительский процесс поднимает
+# заглушку Bot API (fake_telegram.py) и запускает каждый сценарий в отдельном
+# процессе: там импортируется bot.py как есть, база засевается сценарием,
+# обновления подаются в bot.process_new_updates из пула потоков — так же,
+# как это делают воркеры вебхука. Снаружи оборачиваются только db.execute
+# (счётчик запросов) и таймерные колбэки (время выполнения)
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def fetch_json(url, data=None):
+    with urllib.request.urlopen(urllib.request.Request(url, data=data, method="POST" if data is not None else "GET")) as response:
+        return json.loads(response.read())
+
+
+def make_scenario(name, scale, workers):
+    streams = {"streams": workers}
+    return {
+        "groups": lambda: SCENARIOS["groups"](chats=int(200 * scale), **streams),
+        "flood": lambda: SCENARIOS["flood"](guesses=int(5000 * scale), **streams),
+        "wizard": lambda: SCENARIOS["wizard"](users=int(100 * scale), **streams),
+        "expiry": lambda: SCENARIOS["expiry"](riddles=int(500 * scale)),
+    }[name]()
+
+
+# Выполняется в процессе сценария
+def run_scenario(name, args):
+    tmp = tempfile.mkdtemp(prefix=f"riddle-bench-{name}-")
+    os.environ.update(TOKEN="1:bench", RUN_MODE="webhook", SHARDS="1", DB_PATH=os.path.join(tmp, "bench.db"),
+                      TELEGRAM_API_URL=args.api_url)
+    sys.path.insert(0, ROOT)
+    import bot
+    import stats
+    from telebot import types
+
+    scenario = make_scenario(name, args.scale, args.workers)
+    with bot.db.transaction():
+        scenario.seed(bot.db)
+
+    queries = Counter()
+    execute, executemany = bot.db.execute, bot.db.executemany
+
+    def counted_execute(sql, params=()):
+        queries[sql.split(None, 1)[0].upper()] += 1
+        return execute(sql, params)
+
+    def counted_executemany(sql, seq_of_params):
+        queries[sql.split(None, 1)[0].upper()] += 1
+        return executemany(sql, seq_of_params)
+
+    bot.db.execute, bot.db.executemany = counted_execute, counted_executemany
+
+    timer_latency = []
+    expire_riddle = bot.expire_riddle
+
+    def timed_expire(*expire_args):
+        started = time.perf_counter()
+        try:
+            return expire_riddle(*expire_args)
+        finally:
+            timer_latency.append(time.perf_counter() - started)
+
+    bot.expire_riddle = timed_expire
+
+    fetch_json(f"{args.api_url}/reset", data=b"")
+    before = stats.snapshot(bot.db)
+    max_threads = threading.active_count()
+    sampling = threading.Event()
+
+    def sample_threads():
+        nonlocal max_threads
+        while not sampling.wait(0.05):
+            max_threads = max(max_threads, threading.active_count())
+
+    threading.Thread(target=sample_threads, daemon=True).start()
+
+    streams = scenario.build()
+    latency = []
+    errors = Counter()
+    lock = threading.Lock()
+
+    def feed(stream):
+        local = []
+        for item in stream:
+            started = time.perf_counter()
+            try:
+                raw = item(bot) if callable(item) else item
+                bot.bot.process_new_updates([types.Update.de_json(raw)])
+            except Exception as e:
+                with lock:
+                    errors[type(e).__name__] += 1
+            local.append(time.perf_counter() - started)
+        with lock:
+            latency.extend(local)
+
+    started = time.perf_counter()
+    bot.restore_timers()
+    bot.scheduler.start()
+    threads = [threading.Thread(target=feed, args=(stream,)) for stream in streams]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    deadline = time.monotonic() + args.timeout
+    while not scenario.done(bot.db) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    # Для таймерных сценариев — сколько прошло от назначенного срока до завершения всех загадок
+    lag = time.time() - scenario.end_time if getattr(scenario, "end_time", None) else None
+    # Ждём, пока очередь исходящих опустеет (или выйдет время), чтобы посчитать вызовы API
+    drain_deadline = time.monotonic() + args.drain
+    while bot.outbox.depth() and time.monotonic() < drain_deadline:
+        time.sleep(0.05)
+    time.sleep(0.2)
+    sampling.set()
+
+    after = stats.snapshot(bot.db)
+    api = fetch_json(f"{args.api_url}/calls")
+    api_calls = sum(api["calls"].values()) + sum(api["limited"].values())
+    solved = after["riddles_solved"] - before["riddles_solved"]
+    updates = sum(len(stream) for stream in streams)
+    handled = latency or timer_latency
+    events = updates or (after["riddles_expired"] - before["riddles_expired"])
+    return {
+        "scenario": name,
+        "updates": updates,
+        "events": events,
+        "elapsed": elapsed,
+        "throughput": events / elapsed if elapsed else 0.0,
+        "timer_lag": lag,
+        "p50_ms": percentile(handled, 0.5) * 1000,
+        "p99_ms": percentile(handled, 0.99) * 1000,
+        "solved": solved,
+        "expired": after["riddles_expired"] - before["riddles_expired"],
+        "sent": after["riddles_sent"] - before["riddles_sent"],
+        "api_calls": api_calls,
+        "api_per_solved": api_calls / solved if solved else None,
+        "api_by_method": api["calls"],
+        "api_429": sum(api["limited"].values()),
+        "outbox_backlog": bot.outbox.depth(),
+        "max_threads": max_threads,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "db_queries": sum(queries.values()),
+        "db_by_kind": dict(queries),
+        "errors": dict(errors),
+    }
+
+
+def report(result):
+    per_solved = f"{result['api_per_solved']:.1f}" if result["api_per_solved"] is not None else "—"
+    print(f"{result['scenario']:>7}: {result['events']:>6} событий за {result['elapsed']:.2f} с = {result['throughput']:8.0f}/с, "
+          f"p50 {result['p50_ms']:.2f} мс, p99 {result['p99_ms']:.2f} мс, отгадано {result['solved']}, "
+          f"истекло {result['expired']}, опубликовано {result['sent']}")
+    print(f"{'':>9}API: {result['api_calls']} вызовов ({per_solved} на отгаданную), 429: {result['api_429']}, "
+          f"в очереди осталось {result['outbox_backlog']}; потоков до {result['max_threads']}, "
+          f"память до {result['max_rss_mb']:.0f} МБ; "
+          f"запросов к БД {result['db_queries']} {result['db_by_kind']}")
+    print(f"{'':>9}по методам: {result['api_by_method']}")
+    if result["timer_lag"] is not None:
+        print(f"{'':>9}все таймеры отработали через {result['timer_lag']:.2f} с после срока")
+    if result["errors"]:
+        print(f"{'':>9}ошибки: {result['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочные сценарии bot.py против заглушки Bot API")
+    parser.add_argument("scenarios", nargs="*", default=list(SCENARIOS), help=f"из {', '.join(SCENARIOS)}")
+    parser.add_argument("--scale", type=float, default=1.0, help="множитель размеров сценариев")
+    parser.add_argument("--workers", type=int, default=8, help="потоков-обработчиков, как WEBHOOK_WORKERS")
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка ответа заглушки, сек")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--timeout", type=float, default=60, help="ожидание завершения сценария, сек")
+    parser.add_argument("--drain", type=float, default=10, help="ожидание опустошения очереди исходящих, сек")
+    parser.add_argument("--json", action="store_true", help="вывести результаты одной строкой JSON")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    parser.add_argument("--api-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_scenario(args.run, args)), flush=True)
+        os._exit(0)  # не ждём фоновых потоков бота
+
+    port = free_port()
+    fake = subprocess.Popen([sys.executable, os.path.join(HERE, "fake_telegram.py"), "--port", str(port),
+                             "--latency", str(args.latency), "--jitter", str(args.jitter),
+                             "--rate-429", str(args.rate_429)], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    api_url = json.loads(fake.stdout.readline())["url"]
+    time.sleep(0.5)
+    results = []
+    try:
+        for name in args.scenarios:
+            command = [sys.executable, os.path.abspath(__file__), "--run", name, "--api-url", api_url,
+                       "--scale", str(args.scale), "--workers", str(args.workers),
+                       "--timeout", str(args.timeout), "--drain", str(args.drain)]
+            with tempfile.TemporaryFile("w+") as log:
+                finished = subprocess.run(command, stdout=subprocess.PIPE, stderr=log, text=True, cwd=ROOT)
+                if finished.returncode != 0 or not finished.stdout.strip():
+                    log.seek(0)
+                    print(f"Сценарий {name} упал:\n{log.read()[-3000:]}", file=sys.stderr)
+                    continue
+            result = json.loads(finished.stdout.strip().splitlines()[-1])
+            results.append(result)
+            if not args.json:
+                report(result)
+    finally:
+        fake.terminate()
+    if args.json:
+        print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import itertools
+import random
+import time
+
+# Генераторы нагрузки для load_test.py. Сценарий засевает базу до запуска бота
+# и строит потоки обновлений: внутри потока обновления идут строго по порядку
+# (шаги мастера одного пользователя), разные потоки обрабатываются параллельно.
+# Элемент потока — сырой словарь обновления или функция bot -> словарь, если
+# обновление зависит от состояния бота (например, draft_id в кнопке)
+
+CHAT_BASE = -1000000000
+USER_BASE = 100000
+RIDDLE_MESSAGE_ID = 1
+ANSWER = "ответ"
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(100)
+
+
+def chat_ids(count):
+    return [CHAT_BASE - i for i in range(count)]
+
+
+def _user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"Игрок{user_id}", "username": f"player{user_id}"}
+
+
+def group_message(chat_id, user_id, text, reply_to=None):
+    chat = {"id": chat_id, "type": "supergroup", "title": f"Чат {-chat_id}"}
+    message = {"message_id": next(_message_ids), "date": int(time.time()), "chat": chat, "from": _user(user_id), "text": text}
+    if reply_to is not None:
+        message["reply_to_message"] = {"message_id": reply_to, "date": 0, "chat": chat}
+    return {"update_id": next(_update_ids), "message": message}
+
+
+def private_message(user_id, text):
+    return {"update_id": next(_update_ids),
+            "message": {"message_id": next(_message_ids), "date": int(time.time()), "text": text, "from": _user(user_id),
+                        "chat": {"id": user_id, "type": "private", "first_name": f"Игрок{user_id}"}}}
+
+
+def callback(user_id, data):
+    return {"update_id": next(_update_ids),
+            "callback_query": {"id": str(next(_update_ids)), "chat_instance": str(user_id), "data": data, "from": _user(user_id),
+                               "message": {"message_id": next(_message_ids), "date": int(time.time()),
+                                           "chat": {"id": user_id, "type": "private", "first_name": f"Игрок{user_id}"}}}}
+
+
+def seed_chats(db, chats):
+    now = int(time.time())
+    ids = chat_ids(chats)
+    db.executemany("INSERT INTO chats (chat_id, title, members_count, updated_at) VALUES (?, ?, 100, ?)",
+                   [(chat_id, f"Чат {-chat_id}", now) for chat_id in ids])
+    return ids
+
+
+def seed_riddles(db, ids, end_time=None):
+    now = int(time.time())
+    db.executemany("INSERT INTO riddles (chat_id, user_id, riddle_text, answer, prize, message_id, active, start_time, end_time) "
+                   "VALUES (?, ?, 'Загадка', ?, 'приз', ?, 1, ?, ?)",
+                   [(chat_id, USER_BASE, ANSWER, RIDDLE_MESSAGE_ID, now, end_time) for chat_id in ids])
+
+
+def _split(updates, streams):
+    return [updates[i::streams] for i in range(streams)]
+
+
+# Много групп с живыми загадками: неверные догадки вперемешку с обычной болтовнёй,
+# в конце каждую загадку отгадывают
+class ManyGroups:
+    name = "groups"
+
+    def __init__(self, chats=200, guesses=20, chatter=3.0, streams=8):
+        self.chats, self.guesses, self.chatter, self.streams = chats, guesses, chatter, streams
+
+    def seed(self, db):
+        seed_riddles(db, seed_chats(db, self.chats))
+
+    def build(self):
+        ids = chat_ids(self.chats)
+        updates = []
+        for i in range(self.chats * self.guesses):
+            chat_id = ids[i % self.chats]
+            updates.append(group_message(chat_id, USER_BASE + 1 + i % 1000, f"догадка {i}", RIDDLE_MESSAGE_ID))
+        for i in range(int(len(updates) * self.chatter)):
+            updates.append(group_message(random.choice(ids), USER_BASE + 1 + i % 1000, "просто болтаем"))
+        random.shuffle(updates)
+        updates += [group_message(chat_id, USER_BASE + 5000 + n, ANSWER, RIDDLE_MESSAGE_ID) for n, chat_id in enumerate(ids)]
+        return _split(updates, self.streams)
+
+    def done(self, db):
+        return True
+
+
+# Лавина догадок на одну загадку; ближе к концу несколько игроков почти одновременно
+# присылают правильный ответ, после чего догадки ещё продолжают идти
+class GuessFlood:
+    name = "flood"
+
+    def __init__(self, guesses=5000, solvers=3, streams=8):
+        self.guesses, self.solvers, self.streams = guesses, solvers, streams
+
+    def seed(self, db):
+        seed_riddles(db, seed_chats(db, 1))
+
+    def build(self):
+        chat_id = chat_ids(1)[0]
+        updates = [group_message(chat_id, USER_BASE + 1 + i, f"догадка {i}", RIDDLE_MESSAGE_ID) for i in range(self.guesses)]
+        position = int(len(updates) * 0.9)
+        updates[position:position] = [group_message(chat_id, USER_BASE + 90000 + n, ANSWER, RIDDLE_MESSAGE_ID)
+                                       for n in range(self.solvers)]
+        return _split(updates, self.streams)
+
+    def done(self, db):
+        return True
+
+
+# Массовое создание загадок через мастер в ЛС: у каждого автора свой поток шагов
+class WizardCreation:
+    name = "wizard"
+
+    def __init__(self, users=100, chats=50, streams=8):
+        self.users, self.chats, self.streams = users, chats, streams
+
+    def seed(self, db):
+        seed_chats(db, self.chats)
+
+    def steps(self, user_id, chat_id):
+        def draft(prefix):
+            return lambda bot: callback(user_id, f"{prefix}{bot.drafts.get(user_id)['draft_id']}")
+
+        return [
+            private_message(user_id, "/start"),
+            callback(user_id, f"chat_{chat_id}"),
+            private_message(user_id, f"Загадка автора {user_id}"),
+            draft("photo_skip_"),
+            private_message(user_id, ANSWER),
+            private_message(user_id, "приз"),
+            draft("time_none_"),
+            draft("hint_skip_"),
+            draft("send_"),
+        ]
+
+    def build(self):
+        ids = chat_ids(self.chats)
+        streams = [[] for _ in range(self.streams)]
+        for n in range(self.users):
+            streams[n % self.streams].extend(self.steps(USER_BASE + 1 + n, ids[n % self.chats]))
+        return streams
+
+    def done(self, db):
+        return True
+
+
+# Много таймеров, истекающих одновременно: загадки с end_time через delay секунд
+# поднимаются restore_timers() и завершаются планировщиком
+class MassExpiry:
+    name = "expiry"
+
+    def __init__(self, riddles=500, delay=3):
+        self.riddles, self.delay = riddles, delay
+        self.end_time = None
+
+    def seed(self, db):
+        self.end_time = int(time.time()) + self.delay
+        seed_riddles(db, seed_chats(db, self.riddles), end_time=self.end_time)
+
+    def build(self):
+        return []
+
+    def done(self, db):
+        return db.execute("SELECT COUNT(*) FROM riddles WHERE active = 1").fetchone()[0] == 0
+
+
+SCENARIOS = {scenario.name: scenario for scenario in (ManyGroups, GuessFlood, WizardCreation, MassExpiry)}
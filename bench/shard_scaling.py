@@ -0,0 +1,140 @@
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import schema  # noqa: E402
+from storage import Database  # noqa: E402
+from fake_telegram import FakeTelegram, free_port  # noqa: E402
+
+# Пропускная способность многопроцессного режима: бот запускается как есть
+# (python bot.py, RUN_MODE=webhook, SHARDS=N) против заглушки Bot API, и в него
+# льются неверные догадки по загадкам во многих чатах. Меряем время до момента,
+# когда все шарды обработали все обновления
+
+
+# База с чатами и живыми загадками без таймера; message_id загадки = 1
+def seed_database(path, chats):
+    db = Database(path)
+    schema.migrate(db)
+    now = int(time.time())
+    chat_ids = [-1000000000 - i for i in range(chats)]
+    with db.transaction():
+        db.executemany("INSERT INTO chats (chat_id, title, members_count, updated_at) VALUES (?, ?, 100, ?)",
+                       [(chat_id, f"Чат {i}", now) for i, chat_id in enumerate(chat_ids)])
+        db.executemany("INSERT INTO riddles (chat_id, user_id, riddle_text, answer, prize, message_id, active, start_time) "
+                       "VALUES (?, 1, 'Загадка', 'ответ', 'приз', 1, 1, ?)", [(chat_id, now) for chat_id in chat_ids])
+    db.close()
+    return chat_ids
+
+
+def guess_update(update_id, chat_id, user_id):
+    chat = {"id": chat_id, "type": "supergroup", "title": "Чат"}
+    return {"update_id": update_id,
+            "message": {"message_id": 10 + update_id, "date": int(time.time()), "chat": chat, "text": "не знаю",
+                        "from": {"id": user_id, "is_bot": False, "first_name": "Игрок"},
+                        "reply_to_message": {"message_id": 1, "date": 0, "chat": chat}}}
+
+
+# Обработано обновлений: SHARDS=1 — обычный однопроцессный вебхук, он и есть база сравнения
+def processed_total(metrics):
+    if "shards" in metrics:
+        return sum(shard["processed"] for shard in metrics["shards"])
+    return metrics["processed"] + metrics["failed"] + metrics["filtered"]
+
+
+async def wait_ready(session, url, shards, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(url) as response:
+                metrics = await response.json()
+                if shards == 1 or all(shard["alive"] for shard in metrics.get("shards", [])):
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Бот не поднялся")
+
+
+async def drive(port, shards, chat_ids, total, batch, warmup):
+    base = f"http://127.0.0.1:{port}"
+    async with aiohttp.ClientSession() as session:
+        await wait_ready(session, f"{base}/metrics", shards)
+        await asyncio.sleep(warmup)  # шарды восстанавливают загадки из базы
+        updates = [guess_update(i, chat_ids[i % len(chat_ids)], 100 + i % 5000) for i in range(total)]
+        started = time.monotonic()
+        for i in range(0, total, batch):
+            chunk = updates[i:i + batch]
+            while True:
+                async with session.post(f"{base}/webhook", json=chunk) as response:
+                    if response.status == 200:
+                        break
+                    accepted = (await response.json()).get("accepted", 0)
+                    chunk = chunk[accepted:]  # Повторяем только непринятый хвост
+                await asyncio.sleep(0.05)
+        sent_in = time.monotonic() - started
+        while True:
+            async with session.get(f"{base}/metrics") as response:
+                metrics = await response.json()
+            if processed_total(metrics) >= total:
+                break
+            await asyncio.sleep(0.05)
+        elapsed = time.monotonic() - started
+        return elapsed, sent_in, [shard["processed"] for shard in metrics.get("shards", [metrics])]
+
+
+def run(shards, args, api_url):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        chat_ids = seed_database(db_path, args.chats)
+        port = free_port()
+        env = dict(os.environ, TOKEN="1:bench", RUN_MODE="webhook", SHARDS=str(shards), WEBHOOK_PORT=str(port),
+                   TELEGRAM_API_URL=api_url, DB_PATH=db_path, WEBHOOK_QUEUE_SIZE=str(args.queue_size))
+        env.pop("WEBHOOK_URL", None)
+        log = open(os.path.join(tmp, "bot.log"), "w")
+        process = subprocess.Popen([sys.executable, "bot.py"], cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            return asyncio.run(drive(port, shards, chat_ids, args.updates, args.batch, args.warmup))
+        finally:
+            process.send_signal(signal.SIGINT)
+            try:
+                process.wait(30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            log.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Масштабирование бота по числу шардов")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--chats", type=int, default=500)
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--queue-size", type=int, default=5000)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    args = parser.parse_args()
+
+    fake = FakeTelegram(port=free_port())
+    api_url = fake.start()
+    print(f"Ядер CPU: {os.cpu_count()}, обновлений: {args.updates}, чатов: {args.chats}")
+    baseline = None
+    for shards in args.shards:
+        elapsed, sent_in, per_shard = run(shards, args, api_url)
+        rate = args.updates / elapsed
+        baseline = baseline or rate / shards
+        print(f"шардов {shards}: {rate:8.0f} обн/с, приём {sent_in:.2f} с, всего {elapsed:.2f} с, "
+              f"по шардам {per_shard}, эффективность {rate / (baseline * shards):.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_telegram import FakeTelegram, free_port  # noqa: E402
+from scenarios import ANSWER, RIDDLE_MESSAGE_ID, USER_BASE, group_message, seed_chats, seed_riddles  # noqa: E402
+
+# Гонка за первую отгадку: на каждую загадку одновременно (через Barrier) приходят
+# --solvers верных ответов от разных игроков и, с --expire, срабатывает таймер.
+# Обновления идут через bot.process_new_updates, как из пула вебхука. После прогона
+# проверяется, что у каждой загадки ровно один исход: один победитель с одним
+# очком или истечение, и счётчики stats и рейтинг в памяти с этим согласны
+# (первые победы приходят в ещё не загруженный рейтинг, а между записью победы
+# и record_win рейтинг перечитывается, как по max_age в шардах). Код выхода 1 — нарушение
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Гонка одновременных верных ответов и таймера")
+    parser.add_argument("--riddles", type=int, default=200)
+    parser.add_argument("--solvers", type=int, default=8, help="одновременных верных ответов на загадку")
+    parser.add_argument("--expire", action="store_true", help="одновременно завершать загадку таймером")
+    args = parser.parse_args()
+
+    fake = FakeTelegram(port=free_port())
+    api_url = fake.start()
+    tmp = tempfile.mkdtemp(prefix="riddle-race-")
+    os.environ.update(TOKEN="1:bench", RUN_MODE="webhook", SHARDS="1", DB_PATH=os.path.join(tmp, "race.db"),
+                      TELEGRAM_API_URL=api_url)
+    import bot
+    import stats
+    from telebot import types
+
+    with bot.db.transaction():
+        seed_riddles(bot.db, seed_chats(bot.db, args.riddles), end_time=int(time.time()) + 3600)
+    bot.restore_timers()
+    riddles = bot.db.execute("SELECT id, chat_id FROM riddles WHERE active = 1 ORDER BY id").fetchall()
+    before = stats.snapshot(bot.db)
+
+    outcomes = Counter()
+    lock = threading.Lock()
+    award_win = bot.award_win
+
+    def counted_award_win(message, riddle):
+        won = award_win(message, riddle)
+        with lock:
+            outcomes["won" if won else "late"] += 1
+        return won
+
+    bot.award_win = counted_award_win
+
+    clock = [0]
+    bot.leaderboard.max_age = 60
+    bot.leaderboard._clock = lambda: clock[0]
+    solve_riddle = bot.solve_riddle
+
+    def reloading_solve_riddle(*args):
+        points = solve_riddle(*args)
+        clock[0] += 60
+        bot.leaderboard.top_all()
+        return points
+
+    bot.solve_riddle = reloading_solve_riddle
+    barrier = threading.Barrier(args.solvers + (1 if args.expire else 0))
+
+    def solver(index):
+        for _, chat_id in riddles:
+            update = types.Update.de_json(group_message(chat_id, USER_BASE + 1 + index, ANSWER, reply_to=RIDDLE_MESSAGE_ID))
+            barrier.wait()
+            bot.bot.process_new_updates([update])
+
+    def timer():
+        for riddle_id, chat_id in riddles:
+            barrier.wait()
+            bot.expire_riddle(riddle_id, chat_id, RIDDLE_MESSAGE_ID, "Загадка")
+
+    threads = [threading.Thread(target=solver, args=(i,)) for i in range(args.solvers)]
+    if args.expire:
+        threads.append(threading.Thread(target=timer))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    states = dict(bot.db.execute("SELECT state, COUNT(*) FROM riddles GROUP BY state").fetchall())
+    points = bot.db.execute("SELECT COALESCE(SUM(points), 0) FROM scores").fetchone()[0]
+    after = stats.snapshot(bot.db)
+    solved, expired = states.get("solved", 0), states.get("expired", 0)
+    checks = {
+        "у каждой загадки один исход": solved + expired == len(riddles) and states.get("live", 0) == 0,
+        "победителей столько же, сколько отгаданных": outcomes["won"] == solved,
+        "очков столько же, сколько отгаданных": points == solved,
+        "очки рейтинга в памяти совпадают с базой": bot.leaderboard.total_points() == points,
+        "stats.riddles_solved": after["riddles_solved"] - before["riddles_solved"] == solved,
+        "stats.riddles_expired": after["riddles_expired"] - before["riddles_expired"] == expired,
+    }
+    print(f"Загадок {len(riddles)}, ответов на загадку {args.solvers}{', с таймером' if args.expire else ''}: "
+          f"{elapsed:.2f} с; отгадано {solved}, истекло {expired}, победных ответов {outcomes['won']}, "
+          f"опоздавших {outcomes['late']}, очков {points}")
+    for name, ok in checks.items():
+        print(f"  {'ok  ' if ok else 'FAIL'} {name}")
+    os._exit(0 if all(checks.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
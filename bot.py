@@ -1,112 +1,208 @@
 import telebot
+import io
 import os
 from telebot import types
-import sqlite3
 from datetime import datetime, timedelta
 import logging
+import random
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot.apihelper import ApiTelegramException
+
+import rendering
+import schema
+import stats
+from cache import TTLCache
+from drafts import DraftStore
+from guesses import GuessLimiter
+from leaderboard import Leaderboard
+from matching import ANSWER_SEPARATOR, AnswerMatcher
+from metrics import Metrics, MetricsServer
+from outbox import HIGH, LOW, NORMAL, Outbox
+from packs import PackError, RiddleQueue, detect_format, import_pack
+from profiler import SamplingProfiler
+from replies import ReplyStore
+from retention import Retention, enable_incremental_vacuum
+from scheduler import TimerScheduler
+from sharding import ShardDispatcher, serve_shard, shard_for
+from storage import Database
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Токен бота
+# Токен бота и режим запуска: polling (по умолчанию) или webhook
 TOKEN = os.getenv("TOKEN")
-bot = telebot.TeleBot(TOKEN)
+RUN_MODE = os.getenv("RUN_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Публичный адрес; без него вебхук не регистрируется (локальный запуск)
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", 8080)))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 8))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+# Многопроцессный режим: SHARDS процессов, каждый владеет загадками и таймерами
+# своей части чатов; фронт (polling или webhook) только раскладывает обновления
+SHARDS = int(os.getenv("SHARDS", 1))
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", 8))  # Потоков-обработчиков в каждом шарде
+SHARD_INDEX = 0  # Номер шарда текущего процесса, задаётся в run_shard
+# Адрес Bot API, например локальной заглушки для нагрузочных тестов
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+if TELEGRAM_API_URL:
+    telebot.apihelper.API_URL = TELEGRAM_API_URL.rstrip("/") + "/bot{0}/{1}"
+# В режиме вебхука и в шардах обработчики выполняют свои пулы потоков, а не внутренний пул telebot
+bot = telebot.TeleBot(TOKEN, threaded=RUN_MODE != "webhook" and SHARDS == 1)
+# Исходящие сообщения в группы идут через очередь с лимитами Telegram;
+# общий лимит бота делится между шардами
+outbox = Outbox(bot, global_rate=25 / SHARDS)
 
 # Подключение к базе данных SQLite
-conn = sqlite3.connect('riddle_bot.db', check_same_thread=False)
-cursor = conn.cursor()
-
-# Создание таблиц
-cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT)''')
-cursor.execute('''CREATE TABLE IF NOT EXISTS chats (
-                    chat_id INTEGER PRIMARY KEY,
-                    title TEXT,
-                    members_count INTEGER)''')
-cursor.execute('''CREATE TABLE IF NOT EXISTS riddles (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    chat_id INTEGER,
-                    user_id INTEGER,
-                    riddle_text TEXT,
-                    answer TEXT,
-                    prize TEXT,
-                    time_limit INTEGER,
-                    message_id INTEGER,
-                    active INTEGER DEFAULT 1,
-                    end_time INTEGER,
-                    hint TEXT,
-                    hint_delay INTEGER,
-                    start_time INTEGER,
-                    photo_id TEXT)''')
-cursor.execute('''CREATE TABLE IF NOT EXISTS scores (
-                    user_id INTEGER,
-                    chat_id INTEGER,
-                    points INTEGER DEFAULT 0,
-                    PRIMARY KEY (user_id, chat_id))''')
-
-# Добавление столбцов, если они отсутствуют
-try:
-    cursor.execute("ALTER TABLE riddles ADD COLUMN end_time INTEGER")
-    logger.info("Столбец end_time добавлен в таблицу riddles")
-except sqlite3.OperationalError:
-    logger.info("Столбец end_time уже существует")
-try:
-    cursor.execute("ALTER TABLE riddles ADD COLUMN hint TEXT")
-    logger.info("Столбец hint добавлен в таблицу riddles")
-except sqlite3.OperationalError:
-    logger.info("Столбец hint уже существует")
-try:
-    cursor.execute("ALTER TABLE riddles ADD COLUMN hint_delay INTEGER")
-    logger.info("Столбец hint_delay добавлен в таблицу riddles")
-except sqlite3.OperationalError:
-    logger.info("Столбец hint_delay уже существует")
-try:
-    cursor.execute("ALTER TABLE riddles ADD COLUMN start_time INTEGER")
-    logger.info("Столбец start_time добавлен в таблицу riddles")
-except sqlite3.OperationalError:
-    logger.info("Столбец start_time уже существует")
-try:
-    cursor.execute("ALTER TABLE riddles ADD COLUMN photo_id TEXT")
-    logger.info("Столбец photo_id добавлен в таблицу riddles")
-except sqlite3.OperationalError:
-    logger.info("Столбец photo_id уже существует")
-
-conn.commit()
-
-# Обновление данных о чатах
+DB_PATH = os.getenv("DB_PATH", "riddle_bot.db")
+db = Database(DB_PATH)
+
+# Создание и обновление схемы базы
+schema.migrate(db)
+
+# Рейтинги отгадчиков; в шардах общий топ перечитывается, так как победы пишут все процессы
+leaderboard = Leaderboard(db, max_age=60 if SHARDS > 1 else None)
+
+# Ответы бота на неверные догадки, удаляемые после завершения загадки
+replies = ReplyStore(db, outbox)
+
+# Лимит догадок игрока по загадке и сводка неверных ответов вместо ответа на каждый
+GUESS_USER_LIMIT = int(os.getenv("GUESS_USER_LIMIT", 6))  # Догадок игрока за окно; 0 — без лимита
+GUESS_USER_WINDOW = int(os.getenv("GUESS_USER_WINDOW", 30))
+GUESS_FEEDBACK_INTERVAL = int(os.getenv("GUESS_FEEDBACK_INTERVAL", 10))  # Не чаще одной правки сводки загадки, сек
+GUESS_CHAT_LIMIT = int(os.getenv("GUESS_CHAT_LIMIT", 6))  # Правок сводок на чат за окно
+GUESS_CHAT_WINDOW = int(os.getenv("GUESS_CHAT_WINDOW", 60))
+guess_limiter = GuessLimiter(user_limit=GUESS_USER_LIMIT, user_window=GUESS_USER_WINDOW, feedback_interval=GUESS_FEEDBACK_INTERVAL,
+                             chat_limit=GUESS_CHAT_LIMIT, chat_window=GUESS_CHAT_WINDOW)
+
+# Черновики мастера создания загадок
+drafts = DraftStore(db)
+
+# Очередь запланированных публикаций из паков загадок
+riddle_queue = RiddleQueue(db)
+
+# Чат обслуживается этим процессом (в обычном режиме — всегда)
+def owns_chat(chat_id):
+    return shard_for(chat_id, SHARDS) == SHARD_INDEX
+
+# Фоновое обновление данных о чатах
+CHAT_REFRESH_INTERVAL = 300  # Как часто просыпается фоновый обновлятель, сек
+CHAT_REFRESH_TTL = 3600  # Сколько считаются свежими данные чата, сек
+CHAT_REFRESH_WORKERS = 4  # Одновременных запросов к Telegram
+refresh_backoff_until = 0
+
+# Запрос данных одного чата; None в результате означает "повторить позже"
+def fetch_chat_data(chat_id):
+    global refresh_backoff_until
+    if time.time() < refresh_backoff_until:
+        return chat_id, None, None
+    try:
+        chat = bot.get_chat(chat_id)
+        members_count = bot.get_chat_member_count(chat_id)
+        logger.info(f"Обновлены данные чата {chat_id}: {chat.title}, {members_count} участников, тип: {chat.type}")
+        return chat_id, chat.title, members_count
+    except ApiTelegramException as e:
+        if e.error_code == 429:
+            retry_after = (e.result_json.get("parameters") or {}).get("retry_after", 30)
+            refresh_backoff_until = max(refresh_backoff_until, time.time() + retry_after)
+            logger.warning(f"Лимит Telegram при обновлении чатов, пауза {retry_after} сек")
+            return chat_id, None, None
+        # Чат пропал, только если Telegram ответил окончательно (400 — нет чата, 403 — бота выгнали);
+        # 5xx и прочие ошибки временные, чат с его загадками остаётся до следующей попытки
+        if e.error_code not in (400, 403):
+            logger.warning(f"Временная ошибка обновления чата {chat_id}: {e}")
+            return chat_id, None, None
+        logger.error(f"Чат {chat_id} недоступен: {e}. Удаляем из базы.")
+        return chat_id, False, None
+    except Exception as e:
+        logger.error(f"Ошибка обновления чата {chat_id}: {e}")
+        return chat_id, None, None
+
+# Обновление устаревших записей chats с ограниченным параллелизмом и одной транзакцией
 def update_data():
-    logger.info("Обновление данных о чатах")
-    cursor.execute("SELECT chat_id FROM chats")
-    chats = cursor.fetchall()
-    for (chat_id,) in chats:
+    now = int(time.time())
+    stale = [chat_id for (chat_id,) in db.execute("SELECT chat_id FROM chats WHERE updated_at IS NULL OR updated_at < ?",
+                                                  (now - CHAT_REFRESH_TTL,)) if owns_chat(chat_id)]
+    if not stale:
+        return
+    logger.info(f"Обновление данных о чатах: {len(stale)}")
+    with ThreadPoolExecutor(max_workers=CHAT_REFRESH_WORKERS) as pool:
+        results = list(pool.map(fetch_chat_data, stale))
+    updated = [(title, members_count, now, chat_id) for chat_id, title, members_count in results if title]
+    removed = [(chat_id,) for chat_id, title, _ in results if title is False]
+    with db.transaction():
+        db.executemany("UPDATE chats SET title = ?, members_count = ?, updated_at = ? WHERE chat_id = ?", updated)
+        # Загадки недоступного чата не удаляются, а завершаются: их заберёт в архив retention
+        dropped = sum(db.execute("UPDATE riddles SET active = 0, state = 'dropped', end_time = ? WHERE chat_id = ? AND active = 1",
+                                 (now, chat_id)).rowcount for (chat_id,) in removed)
+        db.executemany("DELETE FROM chats WHERE chat_id = ?", removed)
+        chats_total, members_total = db.execute("SELECT COUNT(*), COALESCE(SUM(members_count), 0) FROM chats").fetchone()
+        stats.increment(db, riddles_dropped=dropped)
+        stats.set_values(db, chats_total=chats_total, members_total=members_total)
+    for (chat_id,) in removed:
+        forget_chat_riddles(chat_id)
+
+def chat_refresh_worker():
+    while True:
         try:
-            chat = bot.get_chat(chat_id)
-            members_count = bot.get_chat_member_count(chat_id)
-            cursor.execute("UPDATE chats SET title = ?, members_count = ? WHERE chat_id = ?",
-                           (chat.title, members_count, chat_id))
-            logger.info(f"Обновлены данные чата {chat_id}: {chat.title}, {members_count} участников, тип: {chat.type}")
+            update_data()
         except Exception as e:
-            logger.error(f"Чат {chat_id} недоступен: {e}. Удаляем из базы.")
-            cursor.execute("DELETE FROM chats WHERE chat_id = ?", (chat_id,))
-            cursor.execute("DELETE FROM riddles WHERE chat_id = ?", (chat_id,))
-        conn.commit()
+            logger.error(f"Ошибка фонового обновления чатов: {e}")
+        time.sleep(max(CHAT_REFRESH_INTERVAL, refresh_backoff_until - time.time()))
+
+# Обслуживание базы: завершённые загадки переезжают в архив, свободные страницы
+# возвращаются инкрементальным VACUUM. В многопроцессном режиме работает только шард 0
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", 600))
+ARCHIVE_AFTER = int(os.getenv("ARCHIVE_AFTER", 3600))  # Через сколько после завершения загадка уходит в архив, сек
+ARCHIVE_KEEP_DAYS = int(os.getenv("ARCHIVE_KEEP_DAYS", 365))  # Срок хранения архива; 0 — бессрочно
+retention = Retention(db, archive_after=ARCHIVE_AFTER, keep_archive_days=ARCHIVE_KEEP_DAYS)
+
+def retention_worker():
+    while True:
+        try:
+            retention.run()
+        except Exception as e:
+            logger.error(f"Ошибка обслуживания базы: {e}")
+        time.sleep(RETENTION_INTERVAL)
 
 # Главное меню
 def main_menu(user_id):
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    markup.add("➕ Добавить в чат", "📜 Список чатов")
-    markup.add("📊 Статистика бота", "ℹ️ Как пользоваться")
-    bot.send_message(user_id, "✨ *Добро пожаловать!* ✨\n\nВыбери действие ниже 👇", reply_markup=markup)
+    bot.send_message(user_id, "✨ *Добро пожаловать!* ✨\n\nВыбери действие ниже 👇", reply_markup=rendering.MAIN_MENU)
+
+# Кэш статусов участников: (user_id, chat_id) -> статус или None, если не участник
+MEMBER_CACHE_TTL = int(os.getenv("MEMBER_CACHE_TTL", 300))
+MEMBER_CACHE_SIZE = int(os.getenv("MEMBER_CACHE_SIZE", 10000))
+member_cache = TTLCache(maxsize=MEMBER_CACHE_SIZE, ttl=MEMBER_CACHE_TTL)
+NOT_CACHED = object()  # В кэше статусов None — "не участник", поэтому промах отмечается отдельно
+api_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="api")
+
+def get_member_status(user_id, chat_id):
+    key = (user_id, chat_id)
+    # Одно обращение к кэшу: между проверкой и чтением запись могла истечь
+    status = member_cache.get(key, NOT_CACHED)
+    if status is not NOT_CACHED:
+        return status
+    try:
+        status = bot.get_chat_member(chat_id, user_id).status
+    except ApiTelegramException as e:
+        # Кэшируем только окончательный ответ (400 — нет такого участника, 403 — нет доступа);
+        # 429 и 5xx временные: ошибка уходит вызывающему и в кэш не попадает
+        if e.error_code not in (400, 403):
+            raise
+        logger.info(f"Пользователь {user_id} не состоит в чате {chat_id}: {e}")
+        status = None
+    member_cache.set(key, status)
+    return status
 
 # Проверка администратора
 def is_admin(user_id, chat_id):
     try:
-        member = bot.get_chat_member(chat_id, user_id)
-        return member.status in ['administrator', 'creator']
+        return get_member_status(user_id, chat_id) in ['administrator', 'creator']
     except Exception as e:
         logger.error(f"Ошибка проверки админа для user_id {user_id} в чате {chat_id}: {e}")
         return False
@@ -114,15 +210,50 @@ def is_admin(user_id, chat_id):
 # Проверка, состоит ли пользователь в чате
 def is_member(user_id, chat_id):
     try:
-        bot.get_chat_member(chat_id, user_id)
-        return True
+        return get_member_status(user_id, chat_id) is not None
     except Exception as e:
         logger.info(f"Пользователь {user_id} не состоит в чате {chat_id}: {e}")
         return False
 
-# Таймер для загадки с автоматической подсказкой
-def riddle_timer(riddle_id, chat_id, message_id, time_limit, riddle_text, prize, hint, hint_delay):
-    MAX_TIME_LIMIT = 1440
+# Проверка прав сразу во многих чатах: запросы к Telegram идут параллельно
+def admin_chats(user_id, chat_ids):
+    flags = api_pool.map(lambda chat_id: is_admin(user_id, chat_id), chat_ids)
+    return {chat_id for chat_id, flag in zip(chat_ids, flags) if flag}
+
+# Индекс активных загадок в памяти: (chat_id, message_id) -> данные загадки
+active_riddles = {}
+
+def add_active_riddle(riddle_id, chat_id, message_id, answer, prize, creator_id, start_time):
+    active_riddles[(chat_id, message_id)] = {
+        "id": riddle_id,
+        "matcher": AnswerMatcher(answer),
+        "prize": prize,
+        "creator_id": creator_id,
+        "message_id": message_id,
+        "start_time": start_time,
+    }
+
+def remove_active_riddle(chat_id, message_id):
+    riddle = active_riddles.pop((chat_id, message_id), None)
+    if riddle:
+        guess_limiter.forget(riddle["id"])
+    return riddle
+
+# Удаление из индекса и снятие таймеров всех загадок чата
+def forget_chat_riddles(chat_id):
+    for key in [key for key in active_riddles if key[0] == chat_id]:
+        riddle = active_riddles.pop(key, None)
+        if riddle:
+            scheduler.cancel_group(riddle["id"])
+            guess_limiter.forget(riddle["id"])
+
+# Таймеры всех загадок обслуживает один общий планировщик
+scheduler = TimerScheduler()
+MAX_TIME_LIMIT = 1440
+RIDDLE_DELETE_DELAY = 1800
+
+# Постановка таймеров загадки: подсказка, обратный отсчёт и завершение
+def riddle_timer(riddle_id, chat_id, message_id, time_limit, riddle_text, prize, hint, hint_delay, photo_id=None):
     time_limit = int(time_limit) if time_limit is not None else None
     if time_limit and time_limit > MAX_TIME_LIMIT:
         time_limit = MAX_TIME_LIMIT
@@ -130,73 +261,188 @@ def riddle_timer(riddle_id, chat_id, message_id, time_limit, riddle_text, prize,
 
     start_time = int(time.time())
     end_time = start_time + time_limit * 60 if time_limit else None
-    cursor.execute("UPDATE riddles SET end_time = ? WHERE id = ?", (end_time, riddle_id))
-    conn.commit()
-
-    hint_sent = False
-    hint_time = None
-    if hint:
-        if time_limit:
-            hint_time = start_time + int(time_limit * 60 * 0.8)  # 80% времени в секундах
-        elif hint_delay is not None:
-            hint_time = start_time + hint_delay * 60  # Задержка в секундах
+    db.execute("UPDATE riddles SET end_time = ? WHERE id = ?", (end_time, riddle_id))
+    if not owns_chat(chat_id):
+        return  # Таймеры поставит шард, которому принадлежит чат (adopt_riddles)
 
-    while True:
-        cursor.execute("SELECT active FROM riddles WHERE id = ?", (riddle_id,))
-        active = cursor.fetchone()
-        if not active or active[0] == 0:
-            logger.info(f"Таймер для загадки {riddle_id} остановлен: загадка уже неактивна")
-            break
-
-        current_time = int(time.time())
-
-        # Отправка подсказки
-        if hint and not hint_sent and hint_time and current_time >= hint_time:
-            try:
-                bot.send_message(chat_id, f"💡 *ПОДСКАЗКА!!* 💡\n\n{hint}")
-                logger.info(f"Подсказка для загадки {riddle_id} отправлена в чат {chat_id}")
-                hint_sent = True
-            except Exception as e:
-                logger.error(f"Ошибка отправки подсказки для загадки {riddle_id}: {e}")
-
-        # Проверка окончания времени
-        if time_limit:
-            remaining = end_time - current_time
-            if remaining <= 0:
-                try:
-                    cursor.execute("UPDATE riddles SET active = 0 WHERE id = ?", (riddle_id,))
-                    conn.commit()
-                    bot.edit_message_text(chat_id=chat_id, message_id=message_id, 
-                                        text=f"⏰ *Время вышло!* ⏰\n\n{riddle_text}\n\n*К сожалению, никто не угадал...* 😔\nЗагадка завершена.", 
-                                        parse_mode="Markdown")
-                    logger.info(f"Загадка {riddle_id} в чате {chat_id} завершена по таймеру")
-                    threading.Timer(1800, lambda: bot.delete_message(chat_id, message_id)).start()
-                except Exception as e:
-                    logger.error(f"Ошибка завершения загадки {riddle_id}: {e}")
-                break
-            else:
-                minutes, seconds = divmod(remaining, 60)
-                try:
-                    bot.edit_message_text(chat_id=chat_id, message_id=message_id, 
-                                        text=f"🚨 *ЗАГАДКА!* 🚨\n\n{riddle_text}\n\n🎁 *ПРИЗ:*\n{prize}\n\n⏰ *Осталось:* {minutes} мин {seconds} сек\n\n💬 *Как ответить?* Реплай на это сообщение своим ответом!",
-                                        parse_mode="Markdown")
-                except Exception as e:
-                    logger.error(f"Ошибка обновления таймера для загадки {riddle_id}: {e}")
-                    if "message to edit not found" in str(e):
-                        logger.info(f"Сообщение {message_id} не найдено, остановка таймера для загадки {riddle_id}")
-                        break
-                sleep_time = 60 if minutes > 60 else 5
-                time.sleep(sleep_time)
-        else:
-            time.sleep(5)  # Если нет таймера, проверяем каждые 5 секунд для подсказки
+    hint_time = get_hint_time(start_time, end_time, hint, hint_delay)
+    schedule_riddle(riddle_id, chat_id, message_id, riddle_text, prize, hint, hint_time, end_time, start_time, bool(photo_id))
+
+# Момент показа подсказки: 80% времени при таймере или заданная задержка без него
+def get_hint_time(start_time, end_time, hint, hint_delay):
+    if not hint or start_time is None:
+        return None
+    if end_time:
+        return start_time + int((end_time - start_time) * 0.8)  # 80% времени в секундах
+    if hint_delay is not None:
+        return start_time + hint_delay * 60  # Задержка в секундах
+    return None
+
+# riddle_text и prize уже экранированы для Markdown; шапка сообщения собирается один раз на загадку
+def schedule_riddle(riddle_id, chat_id, message_id, riddle_text, prize, hint, hint_time, end_time, now, has_photo=False):
+    if hint_time is not None:
+        scheduler.schedule(riddle_id, "hint", hint_time, send_hint, riddle_id, chat_id, hint)
+    if end_time:
+        head = rendering.riddle_head(riddle_text, prize)
+        scheduler.schedule(riddle_id, "tick", now, countdown_tick, riddle_id, chat_id, message_id, head, end_time, has_photo)
+        scheduler.schedule(riddle_id, "expire", end_time, expire_riddle, riddle_id, chat_id, message_id, riddle_text, has_photo)
+
+# Восстановление индекса и таймеров активных загадок после перезапуска
+HINT_RECOVERY_GRACE = 600  # Просроченные подсказки старше этого считаем уже отправленными
+
+def restore_timers():
+    restored, expired = adopt_riddles()
+    replies.cleanup_finished(owns_chat)
+    logger.info(f"Восстановлено таймеров загадок: {restored}, завершено просроченных: {expired}")
+
+# Загадки своих чатов с id больше after_id, которых ещё нет в индексе: при старте все,
+# а в шардах ещё и опубликованные другими процессами (мастер работает в шарде автора)
+RIDDLE_ADOPT_INTERVAL = 1  # Как часто шард ищет новые загадки своих чатов, сек
+last_adopted_id = 0
+
+def adopt_riddles(after_id=0):
+    global last_adopted_id
+    now = int(time.time())
+    rows = db.execute("SELECT id, chat_id, user_id, message_id, riddle_text, answer, prize, hint, hint_delay, start_time, end_time, photo_id "
+                      "FROM riddles WHERE active = 1 AND message_id IS NOT NULL AND id > ? ORDER BY id", (after_id,)).fetchall()
+    if rows:
+        last_adopted_id = max(last_adopted_id, rows[-1][0])
+    expired = []
+    restored = 0
+    for riddle_id, chat_id, creator_id, message_id, riddle_text, answer, prize, hint, hint_delay, start_time, end_time, photo_id in rows:
+        if not owns_chat(chat_id) or (chat_id, message_id) in active_riddles:
+            continue
+        shown_text = rendering.escape_markdown(riddle_text)
+        if end_time and end_time <= now:
+            expired.append((riddle_id, chat_id, message_id, shown_text, end_time, bool(photo_id)))
+            continue
+        add_active_riddle(riddle_id, chat_id, message_id, answer, prize, creator_id, start_time)
+        hint_time = get_hint_time(start_time, end_time, hint, hint_delay)
+        if hint_time is not None and hint_time < now - HINT_RECOVERY_GRACE:
+            hint_time = None
+        schedule_riddle(riddle_id, chat_id, message_id, shown_text, rendering.escape_markdown(prize), hint, hint_time,
+                        end_time, now, bool(photo_id))
+        restored += 1
+    expire_riddles_batch(expired)
+    return restored, len(expired)
+
+def adopt_new_riddles():
+    try:
+        restored, expired = adopt_riddles(last_adopted_id)
+        if restored or expired:
+            logger.info(f"Шард {SHARD_INDEX}: принято загадок {restored}, завершено просроченных {expired}")
+    except Exception as e:
+        logger.error(f"Ошибка поиска новых загадок шарда {SHARD_INDEX}: {e}")
+    scheduler.schedule("adopt", "poll", time.time() + RIDDLE_ADOPT_INTERVAL, adopt_new_riddles)
+
+# Пакетное завершение загадок, чьё время вышло, пока бот был выключен
+def expire_riddles_batch(expired, chunk_size=500):
+    # Завершаются только те, что ещё активны: загадку могли отгадать между выборкой и записью
+    finished = set()
+    with db.transaction():
+        for i in range(0, len(expired), chunk_size):
+            chunk = expired[i:i + chunk_size]
+            placeholders = ",".join("?" * len(chunk))
+            finished.update(row[0] for row in db.execute(f"UPDATE riddles SET active = 0, state = 'expired' "
+                                                         f"WHERE active = 1 AND id IN ({placeholders}) RETURNING id",
+                                                         [riddle[0] for riddle in chunk]).fetchall())
+        stats.increment(db, riddles_expired=len(finished))
+    for riddle_id, chat_id, message_id, riddle_text, end_time, has_photo in expired:
+        if riddle_id not in finished:
+            continue
+        replies.cleanup(riddle_id)
+        edit_riddle_message(chat_id, message_id, has_photo, rendering.expired_message(riddle_text))
+        scheduler.schedule(("delete", chat_id, message_id), "delete", end_time + RIDDLE_DELETE_DELAY, delete_riddle_message, chat_id, message_id)
+
+# Отправка подсказки
+def send_hint(riddle_id, chat_id, hint):
+    outbox.send_message(chat_id, f"💡 *ПОДСКАЗКА!!* 💡\n\n{hint}")
+    logger.info(f"Подсказка для загадки {riddle_id} поставлена в очередь в чат {chat_id}")
+
+# Режим обратного отсчёта: adaptive — редкие правки с точностью под оставшееся время,
+# classic — как раньше, каждые 5 секунд в последний час
+COUNTDOWN_MODE = os.getenv("COUNTDOWN_MODE", "adaptive")
+COUNTDOWN_LOAD_STEP = 200  # На каждые столько живых загадок интервал правок растёт на шаг
+COUNTDOWN_MAX_SLOWDOWN = 4
+
+# Правка сообщения загадки: у загадок с фото меняется подпись, а не текст
+def edit_riddle_message(chat_id, message_id, has_photo, text, priority=NORMAL):
+    if has_photo:
+        return outbox.edit_message_caption(chat_id, message_id, text, priority=priority, parse_mode="Markdown")
+    return outbox.edit_message_text(chat_id, message_id, text, priority=priority, parse_mode="Markdown")
+
+# Интервал между правками и отображаемый остаток времени
+def countdown_step(remaining):
+    if COUNTDOWN_MODE == "classic":
+        minutes, seconds = divmod(remaining, 60)
+        return (60 if minutes > 60 else 5), f"{minutes} мин {seconds} сек"
+    if remaining > 3600:
+        interval = 300
+    elif remaining > 600:
+        interval = 60
+    elif remaining > 60:
+        interval = 30
+    else:
+        interval = 10
+    # При большом числе одновременных загадок обновляем реже
+    interval *= min(COUNTDOWN_MAX_SLOWDOWN, 1 + len(active_riddles) // COUNTDOWN_LOAD_STEP)
+    if interval >= 60:
+        hours, minutes = divmod(-(-remaining // 60), 60)  # Округление вверх до минуты
+        label = f"{hours} ч {minutes} мин" if hours else f"{minutes} мин"
+    else:
+        minutes, seconds = divmod(remaining, 60)
+        label = f"{minutes} мин {seconds} сек" if minutes else f"{seconds} сек"
+    return interval, label
+
+# Обновление обратного отсчёта; следующий тик ставится самим обработчиком.
+# Если отображаемый текст не изменился, правка не отправляется
+def countdown_tick(riddle_id, chat_id, message_id, head, end_time, has_photo=False, last_text=None):
+    remaining = end_time - int(time.time())
+    if remaining <= 0:
+        return
+    interval, label = countdown_step(remaining)
+    text = rendering.countdown_message(head, label)
+    if text != last_text:
+        future = edit_riddle_message(chat_id, message_id, has_photo, text, priority=LOW)
+        future.add_done_callback(lambda done: stop_if_message_missing(done, riddle_id, message_id))
+    next_time = int(time.time()) + interval
+    if next_time < end_time:
+        scheduler.schedule(riddle_id, "tick", next_time, countdown_tick, riddle_id, chat_id, message_id, head, end_time, has_photo, text)
+
+# Сообщение загадки удалили вручную: дальше обновлять нечего
+def stop_if_message_missing(future, riddle_id, message_id):
+    error = future.exception()
+    if error is not None and "message to edit not found" in str(error):
+        logger.info(f"Сообщение {message_id} не найдено, остановка таймера для загадки {riddle_id}")
+        scheduler.cancel_group(riddle_id)
+
+# Завершение загадки по истечении времени
+def expire_riddle(riddle_id, chat_id, message_id, riddle_text, has_photo=False):
+    scheduler.cancel_group(riddle_id)
+    remove_active_riddle(chat_id, message_id)
+    try:
+        with db.transaction():
+            if db.execute("UPDATE riddles SET active = 0, state = 'expired' WHERE id = ? AND active = 1", (riddle_id,)).rowcount == 0:
+                logger.info(f"Таймер для загадки {riddle_id} остановлен: загадка уже неактивна")
+                return
+            stats.increment(db, riddles_expired=1)
+        replies.cleanup(riddle_id)
+        edit_riddle_message(chat_id, message_id, has_photo, rendering.expired_message(riddle_text))
+        logger.info(f"Загадка {riddle_id} в чате {chat_id} завершена по таймеру")
+        scheduler.schedule(("delete", chat_id, message_id), "delete", time.time() + RIDDLE_DELETE_DELAY, delete_riddle_message, chat_id, message_id)
+    except Exception as e:
+        logger.error(f"Ошибка завершения загадки {riddle_id}: {e}")
+
+def delete_riddle_message(chat_id, message_id):
+    outbox.delete_message(chat_id, message_id)
 
 # Обработчики команд
 @bot.message_handler(commands=['start'], chat_types=['private'])
 def start(message):
     user_id = message.from_user.id
     username = message.from_user.username or "NoUsername"
-    cursor.execute("INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)", (user_id, username))
-    conn.commit()
+    db.execute("INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)", (user_id, username))
+    leaderboard.set_username(user_id, username)
     logger.info(f"Новый пользователь: {user_id} (@{username})")
     bot.send_message(user_id, "👋 *Привет!* 👋\n\nЯ бот-загадочник! 🎉\nДобавь меня в чат, и давай играть! 🚀\n\n*P.S.* Дай мне права администратора, чтобы всё работало! 😉")
     main_menu(user_id)
@@ -204,36 +450,52 @@ def start(message):
 @bot.message_handler(commands=['zagadka'], chat_types=['group', 'supergroup'])
 def zagadka_command(message):
     user_id = message.from_user.id
-    bot.send_message(message.chat.id, "✨ *Хочешь загадку?* ✨\n\nПерейди в ЛС бота, чтобы её создать! 👇")
-    bot.send_message(user_id, "👋 *Привет!* 👋\n\nДавай создадим крутую загадку! 🎲\nВыбери действие ниже 👇", reply_markup=main_menu(user_id))
+    outbox.send_message(message.chat.id, "✨ *Хочешь загадку?* ✨\n\nПерейди в ЛС бота, чтобы её создать! 👇")
+    bot.send_message(user_id, "👋 *Привет!* 👋\n\nДавай создадим крутую загадку! 🎲\nВыбери действие ниже 👇", reply_markup=rendering.MAIN_MENU)
 
 @bot.message_handler(commands=['top_all'], chat_types=['private'])
 def top_all(message):
     user_id = message.from_user.id
-    cursor.execute("SELECT user_id, SUM(points) as total_points FROM scores GROUP BY user_id ORDER BY total_points DESC LIMIT 10")
-    top_users = cursor.fetchall()
+    top_users = leaderboard.top_all()
     if not top_users:
         bot.send_message(user_id, "🏆 *Общий топ отгадчиков* 🏆\n\nПока никто не отгадал ни одной загадки! 😅\nБудь первым! 🚀")
         return
-    text = "🏆 *Общий топ отгадчиков* 🏆\n\n"
-    for i, (user_id, points) in enumerate(top_users, 1):
-        username = cursor.execute("SELECT username FROM users WHERE user_id = ?", (user_id,)).fetchone()[0]
-        text += f"{i}. @{username} — {points} очков 🌟\n"
+    text = "🏆 *Общий топ отгадчиков* 🏆\n\n" + rendering.top_lines(top_users)
     bot.send_message(user_id, text, parse_mode="Markdown")
 
 @bot.message_handler(commands=['riddlekings'], chat_types=['group', 'supergroup'])
 def top_chat(message):
     chat_id = message.chat.id
-    cursor.execute("SELECT user_id, points FROM scores WHERE chat_id = ? ORDER BY points DESC LIMIT 10", (chat_id,))
-    top_users = cursor.fetchall()
+    row = db.execute("SELECT title FROM chats WHERE chat_id = ?", (chat_id,)).fetchone()
+    title = row[0] if row and row[0] else message.chat.title
+    top_users = leaderboard.top_chat(chat_id)
     if not top_users:
-        bot.send_message(chat_id, f"🏆 *Топ отгадчиков в {bot.get_chat(chat_id).title}* 🏆\n\nПока здесь нет мастеров загадок! 😮\nСтань первым! 💪")
+        outbox.send_message(chat_id, f"🏆 *Топ отгадчиков в {title}* 🏆\n\nПока здесь нет мастеров загадок! 😮\nСтань первым! 💪")
+        return
+    text = f"🏆 *Топ отгадчиков в {rendering.escape_markdown(title)}* 🏆\n\n" + rendering.top_lines(top_users)
+    outbox.send_message(chat_id, text, parse_mode="Markdown")
+
+# Очередь публикаций автора из паков загадок (см. handle_pack)
+@bot.message_handler(commands=['queue'], chat_types=['private'])
+def show_queue(message):
+    user_id = message.from_user.id
+    summary = riddle_queue.summary(user_id)
+    if not summary:
+        bot.send_message(user_id, "📦 *Очередь пуста* 📦\n\nПришли файл с паком загадок, чтобы запланировать публикации.")
         return
-    text = f"🏆 *Топ отгадчиков в {bot.get_chat(chat_id).title}* 🏆\n\n"
-    for i, (user_id, points) in enumerate(top_users, 1):
-        username = cursor.execute("SELECT username FROM users WHERE user_id = ?", (user_id,)).fetchone()[0]
-        text += f"{i}. @{username} — {points} очков 🌟\n"
-    bot.send_message(chat_id, text, parse_mode="Markdown")
+    pending, next_post = summary.get("pending", (0, None))
+    text = f"📦 *Твоя очередь загадок* 📦\n\nЖдут публикации: {pending}"
+    if next_post is not None:
+        text += f" (ближайшая {datetime.fromtimestamp(next_post).strftime('%d.%m %H:%M')})"
+    text += f"\nОпубликовано: {summary.get('posted', (0, None))[0]}\nОшибок: {summary.get('failed', (0, None))[0]}"
+    bot.send_message(user_id, text)
+
+@bot.message_handler(commands=['queue_clear'], chat_types=['private'])
+def clear_queue(message):
+    user_id = message.from_user.id
+    cancelled = riddle_queue.cancel(user_id)
+    logger.info(f"Пользователь {user_id} отменил {cancelled} запланированных загадок")
+    bot.send_message(user_id, f"❌ *Очередь очищена* ❌\n\nОтменено публикаций: {cancelled}")
 
 # Обработчик текстовых сообщений в ЛС
 @bot.message_handler(content_types=['text'], chat_types=['private'])
@@ -241,34 +503,37 @@ def handle_text_private(message):
     user_id = message.from_user.id
     chat_id = message.chat.id
 
-    update_data()
-
-    if bot.get_state(user_id, chat_id) is not None:
-        if message.text in ["➕ Добавить в чат", "📜 Список чатов", "📊 Статистика бота", "ℹ️ Как пользоваться"]:
-            markup = types.InlineKeyboardMarkup()
-            markup.add(types.InlineKeyboardButton("❌ Отменить создание", callback_data="cancel"))
-            bot.send_message(user_id, "⛔ *Ой-ой!* ⛔\n\nТы сейчас создаёшь загадку! Заверши её или нажми 'Отменить' 👇", reply_markup=markup)
+    draft = drafts.get(user_id)
+    if draft is not None:
+        if message.text in rendering.MENU_BUTTONS:
+            bot.send_message(user_id, "⛔ *Ой-ой!* ⛔\n\nТы сейчас создаёшь загадку! Заверши её или нажми 'Отменить' 👇",
+                             reply_markup=rendering.CANCEL_CREATION)
+            return
+        step_handler = draft_step_handler(message, draft)
+        if step_handler is not None:
+            step_handler(message, draft)
+            return
+        if redispatch_draft(message, draft):
             return
 
-    if message.text == "➕ Добавить в чат":
+    if message.text == rendering.MENU_ADD_TO_CHAT:
         logger.info(f"Пользователь {user_id} нажал 'Добавить в чат'")
-        markup = types.InlineKeyboardMarkup()
-        markup.add(types.InlineKeyboardButton("✨ Добавить в группу", url=f"https://t.me/{bot.get_me().username}?startgroup=true"))
-        bot.send_message(user_id, "🎉 *Добавь меня в чат!* 🎉\n\nНажми кнопку ниже и выбери группу! 👇\n*P.S.* Не забудь дать мне права админа! 😉", reply_markup=markup)
+        bot.send_message(user_id, "🎉 *Добавь меня в чат!* 🎉\n\nНажми кнопку ниже и выбери группу! 👇\n*P.S.* Не забудь дать мне права админа! 😉",
+                         reply_markup=rendering.add_to_chat_markup(bot.user.username))
     
-    elif message.text == "📜 Список чатов":
+    elif message.text == rendering.MENU_CHATS:
         logger.info(f"Пользователь {user_id} запросил список> список чатов")
-        cursor.execute("SELECT chat_id, title, members_count FROM chats")
-        chats = cursor.fetchall()
+        chats = db.execute("SELECT chat_id, title, members_count FROM chats").fetchall()
         if not chats:
             bot.send_message(user_id, "😔 *Пусто!* 😔\n\nБот ещё не добавлен ни в один чат. Добавь меня в группу через '➕ Добавить в чат'! 👇")
         else:
+            admin_in = admin_chats(user_id, [chat[0] for chat in chats])
+            active_counts = dict(db.execute("SELECT chat_id, COUNT(*) FROM riddles WHERE active = 1 GROUP BY chat_id"))
             markup = types.InlineKeyboardMarkup()
             for chat in chats:
                 chat_id, title, members_count = chat
-                if is_admin(user_id, chat_id):
-                    cursor.execute("SELECT COUNT(*) FROM riddles WHERE chat_id = ? AND active = 1", (chat_id,))
-                    active_riddles = cursor.fetchone()[0]
+                if chat_id in admin_in:
+                    active_riddles = active_counts.get(chat_id, 0)
                     markup.add(types.InlineKeyboardButton(f"💬 {title}\n👥 {members_count} чел. | 🧩 {active_riddles}", callback_data=f"chat_{chat_id}"))
                 else:
                     logger.info(f"Пользователь {user_id} не админ в чате {chat_id}")
@@ -277,47 +542,38 @@ def handle_text_private(message):
             else:
                 bot.send_message(user_id, "🌟 *Твои чаты (где ты админ):* 🌟\n\nВыбери чат для загадки 👇", reply_markup=markup)
     
-    elif message.text == "📊 Статистика бота":
+    elif message.text == rendering.MENU_STATS:
         logger.info(f"Пользователь {user_id} запросил статистику")
-        markup = types.InlineKeyboardMarkup()
-        markup.add(types.InlineKeyboardButton("📈 Общая статистика", callback_data="stats_global"))
-        markup.add(types.InlineKeyboardButton("👥 Чаты и участники", callback_data="stats_chats_users"))
-        bot.send_message(user_id, "📊 *Статистика бота* 📊\n\nВыбери, что посмотреть 👇", reply_markup=markup)
+        bot.send_message(user_id, "📊 *Статистика бота* 📊\n\nВыбери, что посмотреть 👇", reply_markup=rendering.STATS_MENU)
     
-    elif message.text == "ℹ️ Как пользоваться":
+    elif message.text == rendering.MENU_HELP:
         logger.info(f"Пользователь {user_id} запросил инструкцию")
-        instruction = (
-            "✨ *Как пользоваться ботом-загадочником?* ✨\n\n"
-            "👇 *Простая инструкция:*\n"
-            "  1. *Добавь меня в чат* ➕ Нажми 'Добавить в чат', выбери группу и дай мне права админа.\n"
-            "  2. *Создай загадку* 🧩 В ЛС выбери 'Список чатов', затем чат, введи текст, ответ и приз.\n"
-            "  3. *Настрой время и подсказку* ⏳ Укажи таймер (или пропусти) и добавь подсказку (по желанию).\n"
-            "  4. *Жди отгадок* 🎉 Участники будут отвечать, а ты узнаешь, кто победил!\n\n"
-            "🎯 *Команды в чате:*\n"
-            "  - `/riddlekings` — топ отгадчиков здесь\n\n"
-            "🏆 *Рейтинг и статистика:*\n"
-            "  - В ЛС: `/top_all` — общий топ\n"
-            "  - '📊 Статистика бота' — все успехи!\n\n"
-            "💡 *Подсказки:* появляются через 80% времени (если таймер есть) или через заданную задержку (если таймера нет).\n\n"
-            "🎉 Готово! Загадывай и отгадывай! Если что-то неясно, пиши мне в ЛС! 🚀"
-        )
-        bot.send_message(user_id, instruction, parse_mode="Markdown")
+        bot.send_message(user_id, rendering.INSTRUCTION, parse_mode="Markdown")
+
+# Смена статуса участника: сбрасываем закэшированную роль. В шардах обновление
+# приходит в шард пользователя, где его роли и кэшируются
+@bot.chat_member_handler()
+def chat_member_update(update):
+    member_cache.invalidate((update.new_chat_member.user.id, update.chat.id))
 
 # Новый участник
 @bot.message_handler(content_types=['new_chat_members'])
 def new_chat_member(message):
     for member in message.new_chat_members:
-        if member.id == bot.get_me().id:
+        if member.id == bot.user.id:
             chat_id = message.chat.id
             title = message.chat.title
             members_count = bot.get_chat_member_count(chat_id)
-            cursor.execute("INSERT OR IGNORE INTO chats (chat_id, title, members_count) VALUES (?, ?, ?)",
-                           (chat_id, title, members_count))
-            conn.commit()
+            with db.transaction():
+                if db.execute("INSERT OR IGNORE INTO chats (chat_id, title, members_count, updated_at) VALUES (?, ?, ?, ?)",
+                              (chat_id, title, members_count, int(time.time()))).rowcount:
+                    stats.increment(db, chats_total=1, members_total=members_count)
             logger.info(f"Бот добавлен в чат {chat_id}, тип: {message.chat.type}")
-            bot.send_message(chat_id, "🎉 *Ура! Я здесь!* 🎉\n\nДайте мне права администратора, чтобы я мог творить магию загадок! ✨")
+            outbox.send_message(chat_id, "🎉 *Ура! Я здесь!* 🎉\n\nДайте мне права администратора, чтобы я мог творить магию загадок! ✨")
 
-# Выбор чата и создание загадки
+# Выбор чата и создание загадки.
+# Состояние мастера — черновик в таблице drafts: шаг и уже введённые поля.
+# Текст и фото из ЛС передаются обработчику текущего шага, кнопки несут только draft_id
 @bot.callback_query_handler(func=lambda call: call.data.startswith("chat_"))
 def select_chat(call):
     chat_id = int(call.data.split("_")[1])
@@ -327,179 +583,188 @@ def select_chat(call):
         logger.warning(f"Пользователь {user_id} пытался создать загадку в чате {chat_id}, но не админ")
         return
     logger.info(f"Пользователь {user_id} выбрал чат {chat_id} для загадки")
-    markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("❌ Отменить", callback_data="cancel"))
-    bot.send_message(user_id, "🧩 *Создаём загадку!* 🧩\n\nНапиши текст загадки в ЛС 👇", reply_markup=markup)
-    bot.register_next_step_handler_by_chat_id(user_id, get_riddle, chat_id, user_id)
-
-def get_riddle(message, chat_id, user_id):
-    if message.chat.id != user_id:
-        bot.send_message(user_id, "⛔ *Эй!* ⛔\n\nПиши загадку в ЛС, а не в чате! 😉")
+    drafts.start(user_id, chat_id, "riddle")
+    bot.send_message(user_id, "🧩 *Создаём загадку!* 🧩\n\nНапиши текст загадки в ЛС 👇", reply_markup=rendering.CANCEL)
+
+# Черновик из кнопки вида <prefix><draft_id>, если он стоит на шаге step — том, на котором
+# кнопку показали. Кнопки от отменённых или отправленных черновиков и от пройденных шагов не срабатывают
+def callback_draft(call, prefix, step):
+    user_id = call.from_user.id
+    draft_id = call.data[len(prefix):]
+    if not draft_id.isdigit():
+        draft = None
+    else:
+        draft = drafts.get_by_id(user_id, int(draft_id))
+        if draft is None or draft["step"] != step:
+            # Кэш мог отстать от базы, если прошлый шаг обработал другой процесс
+            draft = drafts.get_by_id(user_id, int(draft_id), fresh=True)
+    if draft is None:
+        logger.warning(f"Устаревшая кнопка {call.data} от пользователя {user_id}")
+        bot.send_message(user_id, "⛔ *Упс!* ⛔\n\nЭтот черновик уже не актуален. Начни заново! 😅")
+        main_menu(user_id)
+        return None
+    if draft["step"] != step:
+        logger.warning(f"Кнопка {call.data} от пользователя {user_id} для шага {step}, черновик на шаге {draft['step']}")
+        if draft["step"] != "sending":
+            bot.send_message(user_id, "⛔ *Упс!* ⛔\n\nЭта кнопка уже не действует. Продолжай с текущего шага! 😅")
+        return None
+    return draft
+
+# Обработчик шага черновика для сообщения в ЛС: фото ждёт только шаг photo
+def draft_step_handler(message, draft):
+    if message.content_type == "photo":
+        return get_photo if draft["step"] == "photo" else None
+    return DRAFT_MESSAGE_STEPS.get(draft["step"])
+
+# Кэш черновика отстал от базы — шаг прошёл в другом процессе за балансировщиком.
+# Черновик перечитывается, и сообщение передаётся его текущему шагу. True — передано
+def redispatch_draft(message, draft):
+    fresh = drafts.get(draft["user_id"], fresh=True)
+    if fresh is None or (fresh["draft_id"], fresh["step"]) == (draft["draft_id"], draft["step"]):
+        return False
+    step_handler = draft_step_handler(message, fresh)
+    if step_handler is None:
+        return False
+    logger.info(f"Черновик {fresh['draft_id']} пользователя {fresh['user_id']} перечитан: шаг {draft['step']} -> {fresh['step']}")
+    step_handler(message, fresh)
+    return True
+
+# Шаг мастера: запись проходит, только если черновик не изменился с момента чтения
+# (второй процесс или параллельное нажатие). Сообщение из ЛС тогда отдаётся шагу
+# из свежего черновика, а если это нажатие кнопки или черновик тот же — просим повторить шаг
+def advance_draft(draft, message=None, **fields):
+    updated = drafts.update(draft, **fields)
+    if updated is None:
+        if message is not None and redispatch_draft(message, draft):
+            return None
+        logger.warning(f"Черновик {draft['draft_id']} пользователя {draft['user_id']} изменился, шаг {fields.get('step')} не применён")
+        bot.send_message(draft["user_id"], "⛔ *Упс!* ⛔\n\nЧерновик уже изменился. Повтори последний шаг! 😅")
+    return updated
+
+def get_riddle(message, draft):
+    user_id = draft["user_id"]
+    if advance_draft(draft, message, riddle_text=message.text, step="photo") is None:
         return
-    riddle_text = message.text
-    markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("⏩ Пропустить", callback_data=f"photo_skip_{chat_id}_{user_id}|{riddle_text}"))
-    markup.add(types.InlineKeyboardButton("❌ Отменить", callback_data="cancel"))
-    bot.send_message(user_id, "📸 *Добавь фото!* 📸\n\nПрикрепи картинку к загадке или нажми 'Пропустить' 👇", reply_markup=markup)
-    bot.register_next_step_handler_by_chat_id(user_id, get_photo, chat_id, user_id, riddle_text)
+    bot.send_message(user_id, "📸 *Добавь фото!* 📸\n\nПрикрепи картинку к загадке или нажми 'Пропустить' 👇",
+                     reply_markup=rendering.PHOTO_SKIP.render(draft["draft_id"]))
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("photo_skip_"))
 def photo_skip(call):
-    try:
-        data = call.data[len("photo_skip_"):].split("|", 1)
-        ids, riddle_text = data[0].split("_"), data[1]
-        chat_id, user_id = int(ids[0]), int(ids[1])
-        get_photo(None, chat_id, user_id, riddle_text)
-    except (IndexError, ValueError) as e:
-        logger.error(f"Ошибка разбора callback_data в photo_skip: {e}, data: {call.data}")
-        bot.send_message(call.from_user.id, "⛔ *Упс!* ⛔\n\nОшибка при пропуске фото. Начни заново! 😅")
-        main_menu(call.from_user.id)
-
-def get_photo(message, chat_id, user_id, riddle_text):
-    if message and message.chat.id != user_id:
-        bot.send_message(user_id, "⛔ *Эй!* ⛔\n\nОтправляй фото в ЛС, а не в чат! 😉")
-        return
+    draft = callback_draft(call, "photo_skip_", "photo")
+    if draft is not None:
+        get_photo(None, draft)
+
+def get_photo(message, draft):
+    user_id = draft["user_id"]
     photo_id = message.photo[-1].file_id if message and message.photo else None
     if message and message.text == "пропустить":
         photo_id = None
     elif message and not photo_id:
+        if redispatch_draft(message, draft):
+            return
         bot.send_message(user_id, "⛔ *Ой!* ⛔\n\nПрикрепи фото или нажми 'Пропустить'! 👇")
         return
-    
-    bot.clear_step_handler_by_chat_id(user_id)
-    
-    markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("❌ Отменить", callback_data="cancel"))
-    bot.send_message(user_id, "🔑 *Какой ответ?* 🔑\n\nНапиши правильный ответ в ЛС 👇", reply_markup=markup)
-    bot.register_next_step_handler_by_chat_id(user_id, get_answer, chat_id, user_id, riddle_text, photo_id)
-
-def get_answer(message, chat_id, user_id, riddle_text, photo_id):
-    if message.chat.id != user_id:
-        bot.send_message(user_id, "⛔ *Эй!* ⛔\n\nПиши ответ в ЛС, а не в чате! 😉")
+    if advance_draft(draft, message, photo_id=photo_id, step="answer") is None:
         return
-    answer = message.text
-    
-    bot.clear_step_handler_by_chat_id(user_id)
-    
-    markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("❌ Отменить", callback_data="cancel"))
-    bot.send_message(user_id, "🎁 *Какой приз?* 🎁\n\nУкажи приз для победителя 👇", reply_markup=markup)
-    bot.register_next_step_handler_by_chat_id(user_id, get_prize, chat_id, user_id, riddle_text, photo_id, answer)
-
-def get_prize(message, chat_id, user_id, riddle_text, photo_id, answer):
-    if message.chat.id != user_id:
-        bot.send_message(user_id, "⛔ *Эй!* ⛔\n\nПиши приз в ЛС, а не в чате! 😉")
+    bot.send_message(user_id, "🔑 *Какой ответ?* 🔑\n\nНапиши правильный ответ в ЛС 👇\n"
+                              f"Несколько вариантов — через `{ANSWER_SEPARATOR}`", reply_markup=rendering.CANCEL)
+
+def get_answer(message, draft):
+    user_id = draft["user_id"]
+    if advance_draft(draft, message, answer=message.text, step="prize") is None:
+        return
+    bot.send_message(user_id, "🎁 *Какой приз?* 🎁\n\nУкажи приз для победителя 👇", reply_markup=rendering.CANCEL)
+
+def get_prize(message, draft):
+    user_id = draft["user_id"]
+    if advance_draft(draft, message, prize=message.text, step="time_choice") is None:
         return
-    prize = message.text
-    cursor.execute("INSERT INTO riddles (chat_id, user_id, riddle_text, answer, prize, photo_id, active) VALUES (?, ?, ?, ?, ?, ?, 0)",
-                   (chat_id, user_id, riddle_text, answer, prize, photo_id))
-    conn.commit()
-    riddle_id = cursor.lastrowid
-    markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("⏳ Задать время", callback_data=f"time_set_{riddle_id}"))
-    markup.add(types.InlineKeyboardButton("⏰ Без таймера", callback_data=f"time_none_{riddle_id}"))
-    markup.add(types.InlineKeyboardButton("❌ Отменить", callback_data="cancel"))
-    bot.send_message(user_id, "⏳ *Нужен таймер?* ⏳\n\nУстановить время или оставить без ограничений? 👇", reply_markup=markup)
+    stats.increment(db, riddles_created=1)
+    bot.send_message(user_id, "⏳ *Нужен таймер?* ⏳\n\nУстановить время или оставить без ограничений? 👇",
+                     reply_markup=rendering.TIMER_CHOICE.render(draft["draft_id"]))
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("time_set_"))
 def get_time_set(call):
-    riddle_id = int(call.data.split("_")[2])
-    cursor.execute("SELECT chat_id, user_id, riddle_text, photo_id, answer, prize FROM riddles WHERE id = ?", (riddle_id,))
-    chat_id, user_id, riddle_text, photo_id, answer, prize = cursor.fetchone()
-    markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("❌ Отменить", callback_data="cancel"))
-    bot.send_message(call.from_user.id, "⏳ *Сколько минут?* ⏳\n\nВведи время (максимум 1440) 👇", reply_markup=markup)
-    bot.register_next_step_handler_by_chat_id(call.from_user.id, get_time, chat_id, call.from_user.id, riddle_text, photo_id, answer, prize, riddle_id)
+    draft = callback_draft(call, "time_set_", "time_choice")
+    if draft is None:
+        return
+    if advance_draft(draft, step="time") is None:
+        return
+    bot.send_message(call.from_user.id, "⏳ *Сколько минут?* ⏳\n\nВведи время (максимум 1440) 👇", reply_markup=rendering.CANCEL)
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("time_none_"))
 def get_time_none(call):
-    riddle_id = int(call.data.split("_")[2])
-    cursor.execute("SELECT chat_id, user_id, riddle_text, photo_id, answer, prize FROM riddles WHERE id = ?", (riddle_id,))
-    chat_id, user_id, riddle_text, photo_id, answer, prize = cursor.fetchone()
-    cursor.execute("UPDATE riddles SET time_limit = NULL WHERE id = ?", (riddle_id,))
-    conn.commit()
-    markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("💡 Добавить подсказку", callback_data=f"hint_add_{riddle_id}"))
-    markup.add(types.InlineKeyboardButton("⏩ Пропустить", callback_data=f"hint_skip_{riddle_id}"))
-    markup.add(types.InlineKeyboardButton("❌ Отменить", callback_data="cancel"))
-    bot.send_message(call.from_user.id, "💡 *Нужна подсказка?* 💡\n\nХочешь добавить подсказку? 👇", reply_markup=markup)
+    draft = callback_draft(call, "time_none_", "time_choice")
+    if draft is None:
+        return
+    if advance_draft(draft, time_limit=None, step="hint_choice") is not None:
+        ask_hint(draft)
+
+def ask_hint(draft):
+    bot.send_message(draft["user_id"], "💡 *Нужна подсказка?* 💡\n\nХочешь добавить подсказку? 👇",
+                     reply_markup=rendering.HINT_CHOICE.render(draft["draft_id"]))
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("hint_add_"))
 def get_hint_add(call):
-    riddle_id = int(call.data.split("_")[2])
-    cursor.execute("SELECT chat_id, user_id, riddle_text, photo_id, answer, prize, time_limit FROM riddles WHERE id = ?", (riddle_id,))
-    chat_id, user_id, riddle_text, photo_id, answer, prize, time_limit = cursor.fetchone()
-    markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("❌ Отменить", callback_data="cancel"))
-    bot.send_message(call.from_user.id, "💡 *Текст подсказки* 💡\n\nНапиши подсказку для участников 👇", reply_markup=markup)
-    bot.register_next_step_handler_by_chat_id(call.from_user.id, get_hint, chat_id, user_id, riddle_text, photo_id, answer, prize, time_limit, riddle_id)
+    draft = callback_draft(call, "hint_add_", "hint_choice")
+    if draft is None:
+        return
+    if advance_draft(draft, step="hint") is None:
+        return
+    bot.send_message(call.from_user.id, "💡 *Текст подсказки* 💡\n\nНапиши подсказку для участников 👇", reply_markup=rendering.CANCEL)
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("hint_skip_"))
 def get_hint_skip(call):
-    riddle_id = int(call.data.split("_")[2])
-    cursor.execute("SELECT chat_id, user_id, riddle_text, photo_id, answer, prize, time_limit FROM riddles WHERE id = ?", (riddle_id,))
-    chat_id, user_id, riddle_text, photo_id, answer, prize, time_limit = cursor.fetchone()
-    get_hint(None, chat_id, user_id, riddle_text, photo_id, answer, prize, time_limit, riddle_id)
-
-def get_time(message, chat_id, user_id, riddle_text, photo_id, answer, prize, riddle_id):
-    if message.chat.id != user_id:
-        bot.send_message(user_id, "⛔ *Эй!* ⛔\n\nПиши время в ЛС, а не в чате! 😉")
-        return
+    draft = callback_draft(call, "hint_skip_", "hint_choice")
+    if draft is not None:
+        get_hint(None, draft)
+
+def get_time(message, draft):
+    user_id = draft["user_id"]
     time_limit = message.text
     if not time_limit.isdigit():
+        if redispatch_draft(message, draft):
+            return
         bot.send_message(user_id, "⛔ *Ой!* ⛔\n\nВведи число в минутах (например, 10)! 👇")
         return
     time_limit = int(time_limit)
     if time_limit > 1440:
         time_limit = 1440
         bot.send_message(user_id, "⚠️ *Максимум!* ⚠️\n\nТаймер ограничен 1440 минутами (24 часа).")
-    markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("💡 Добавить подсказку", callback_data=f"hint_add_{riddle_id}"))
-    markup.add(types.InlineKeyboardButton("⏩ Пропустить", callback_data=f"hint_skip_{riddle_id}"))
-    markup.add(types.InlineKeyboardButton("❌ Отменить", callback_data="cancel"))
-    cursor.execute("UPDATE riddles SET time_limit = ? WHERE id = ?", (time_limit, riddle_id))
-    conn.commit()
-    bot.send_message(user_id, "💡 *Нужна подсказка?* 💡\n\nХочешь добавить подсказку? 👇", reply_markup=markup)
-
-def get_hint(message, chat_id, user_id, riddle_text, photo_id, answer, prize, time_limit, riddle_id):
-    if message and message.chat.id != user_id:
-        bot.send_message(user_id, "⛔ *Эй!* ⛔\n\nПиши подсказку в ЛС, а не в чате! 😉")
-        return
+    if advance_draft(draft, message, time_limit=time_limit, step="hint_choice") is not None:
+        ask_hint(draft)
+
+def get_hint(message, draft):
+    user_id = draft["user_id"]
     hint = message.text if message else None
-    cursor.execute("UPDATE riddles SET hint = ?, time_limit = ? WHERE id = ?", (hint, time_limit, riddle_id))
-    conn.commit()
-    if hint and not time_limit:
-        markup = types.InlineKeyboardMarkup()
-        markup.add(types.InlineKeyboardButton("❌ Отменить", callback_data="cancel"))
-        bot.send_message(user_id, "⏳ *Когда показать подсказку?* ⏳\n\nЧерез сколько минут (или '0' для сразу)? 👇", reply_markup=markup)
-        bot.register_next_step_handler_by_chat_id(user_id, get_hint_delay, chat_id, user_id, riddle_text, photo_id, answer, prize, time_limit, hint, riddle_id)
+    if hint and not draft["time_limit"]:
+        if advance_draft(draft, message, hint=hint, step="hint_delay") is None:
+            return
+        bot.send_message(user_id, "⏳ *Когда показать подсказку?* ⏳\n\nЧерез сколько минут (или '0' для сразу)? 👇",
+                         reply_markup=rendering.CANCEL)
     else:
-        show_riddle_preview(chat_id, user_id, riddle_text, photo_id, answer, prize, time_limit, None, riddle_id)
+        draft = advance_draft(draft, message, hint=hint, hint_delay=None, step="preview")
+        if draft is not None:
+            show_riddle_preview(draft)
 
-def get_hint_delay(message, chat_id, user_id, riddle_text, photo_id, answer, prize, time_limit, hint, riddle_id):
-    if message.chat.id != user_id:
-        bot.send_message(user_id, "⛔ *Эй!* ⛔\n\nПиши время в ЛС, а не в чате! 😉")
-        return
+def get_hint_delay(message, draft):
     hint_delay = message.text
     if not hint_delay.isdigit():
-        bot.send_message(user_id, "⛔ *Ой!* ⛔\n\nВведи число в минутах или '0'! 👇")
+        if redispatch_draft(message, draft):
+            return
+        bot.send_message(draft["user_id"], "⛔ *Ой!* ⛔\n\nВведи число в минутах или '0'! 👇")
         return
-    hint_delay = int(hint_delay)
-    cursor.execute("UPDATE riddles SET hint_delay = ? WHERE id = ?", (hint_delay, riddle_id))
-    conn.commit()
-    show_riddle_preview(chat_id, user_id, riddle_text, photo_id, answer, prize, time_limit, hint_delay, riddle_id)
+    draft = advance_draft(draft, message, hint_delay=int(hint_delay), step="preview")
+    if draft is not None:
+        show_riddle_preview(draft)
 
-def show_riddle_preview(chat_id, user_id, riddle_text, photo_id, answer, prize, time_limit, hint_delay, riddle_id):
-    time_limit = int(time_limit) if time_limit is not None else None
+def show_riddle_preview(draft):
+    time_limit, hint_delay = draft["time_limit"], draft["hint_delay"]
     preview = (
-        f"🚨 *ЗАГАДКА!* 🚨\n\n"
-        f"{riddle_text}\n\n"
-        f"🎁 *ПРИЗ:*\n{prize}\n\n"
+        rendering.riddle_head(rendering.escape_markdown(draft["riddle_text"]), rendering.escape_markdown(draft["prize"])) +
         f"⏰ *Время:* {time_limit if time_limit is not None else 'не ограничено'} мин"
     )
-    cursor.execute("SELECT hint FROM riddles WHERE id = ?", (riddle_id,))
-    hint = cursor.fetchone()[0]
-    if hint:
+    if draft["hint"]:
         if time_limit is not None:
             hint_time = int((time_limit * 60) * 0.8)
             preview += f"\n\n💡 *Подсказка через:* {hint_time} сек"
@@ -507,39 +772,91 @@ def show_riddle_preview(chat_id, user_id, riddle_text, photo_id, answer, prize,
             preview += f"\n\n💡 *Подсказка через:* {hint_delay} мин"
         else:
             preview += f"\n\n💡 *Подсказка сразу!*"
-    markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("✅ Отправить в чат", callback_data=f"send_{riddle_id}"))
-    markup.add(types.InlineKeyboardButton("❌ Отменить", callback_data="cancel"))
-    if photo_id:
-        bot.send_photo(user_id, photo_id, caption=preview, parse_mode="Markdown", reply_markup=markup)
+    markup = rendering.PREVIEW.render(draft["draft_id"])
+    if draft["photo_id"]:
+        bot.send_photo(draft["user_id"], draft["photo_id"], caption=preview, parse_mode="Markdown", reply_markup=markup)
     else:
-        bot.send_message(user_id, preview, parse_mode="Markdown", reply_markup=markup)
+        bot.send_message(draft["user_id"], preview, parse_mode="Markdown", reply_markup=markup)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("send_"))
-def send_riddle(call):
-    riddle_id = int(call.data.split("_")[1])
-    cursor.execute("SELECT chat_id, user_id, riddle_text, photo_id, answer, prize, time_limit, hint, hint_delay FROM riddles WHERE id = ?", (riddle_id,))
-    chat_id, user_id, riddle_text, photo_id, answer, prize, time_limit, hint, hint_delay = cursor.fetchone()
-    time_limit = int(time_limit) if time_limit is not None else None
-    
-    text = (
-        f"🚨 *ЗАГАДКА!* 🚨\n\n"
-        f"{riddle_text}\n\n"
-        f"🎁 *ПРИЗ:*\n{prize}\n\n"
-        f"💬 *Как ответить?* Реплай на это сообщение своим ответом!"
-    )
-    if time_limit:
-        text += f"\n\n⏰ *Время:* {time_limit} мин"
+# Шаги мастера, которые ждут сообщения в ЛС; на остальных шагах ждём нажатия кнопки
+DRAFT_MESSAGE_STEPS = {
+    "riddle": get_riddle,
+    "photo": get_photo,
+    "answer": get_answer,
+    "prize": get_prize,
+    "time": get_time,
+    "hint": get_hint,
+    "hint_delay": get_hint_delay,
+}
+
+@bot.message_handler(content_types=['photo'], chat_types=['private'])
+def handle_photo_private(message):
+    draft = drafts.get(message.from_user.id)
+    if draft is not None and draft["step"] == "photo":
+        get_photo(message, draft)
+    elif draft is not None:
+        redispatch_draft(message, draft)
+
+# Публикация загадки в чат — общая для мастера и очереди паков.
+# riddle — черновик или запись очереди: поля chat_id, riddle_text, answer, prize,
+# photo_id, time_limit, hint, hint_delay. Возвращает id загадки
+PUBLISH_TIMEOUT = int(os.getenv("PUBLISH_TIMEOUT", 120))  # Сколько ждать отправки загадки через очередь исходящих, сек
+
+def publish_riddle(user_id, riddle):
+    chat_id, riddle_text, photo_id, prize = riddle["chat_id"], riddle["riddle_text"], riddle["photo_id"], riddle["prize"]
+    time_limit, hint, hint_delay = riddle["time_limit"], riddle["hint"], riddle["hint_delay"]
+
+    # Пользовательский текст экранируется один раз; дальше таймеры получают готовые строки
+    shown_text, shown_prize = rendering.escape_markdown(riddle_text), rendering.escape_markdown(prize)
+    text = rendering.riddle_message(rendering.riddle_head(shown_text, shown_prize), time_limit)
+    # Здесь нужен message_id. Если запрос простоял в очереди исходящих дольше PUBLISH_TIMEOUT,
+    # он снимается из очереди и публикация считается неудачной. Уже отправленный запрос
+    # не отменить: ждём его ответа, иначе сообщение выйдет в чат без записи загадки
     if photo_id:
-        msg = bot.send_photo(chat_id, photo_id, caption=text, parse_mode="Markdown")
+        future = outbox.send_photo(chat_id, photo_id, caption=text, parse_mode="Markdown")
     else:
-        msg = bot.send_message(chat_id, text, parse_mode="Markdown")
-    
+        future = outbox.send_message(chat_id, text, parse_mode="Markdown")
+    try:
+        msg = future.result(timeout=PUBLISH_TIMEOUT)
+    except TimeoutError:
+        if outbox.cancel(future):
+            raise TimeoutError(f"загадка не ушла из очереди исходящих за {PUBLISH_TIMEOUT} с")
+        logger.warning(f"Загадка в чат {chat_id} отправляется дольше {PUBLISH_TIMEOUT} с, ждём ответа Telegram")
+        msg = future.result()
+
     start_time = int(time.time())
-    cursor.execute("UPDATE riddles SET message_id = ?, start_time = ?, active = 1 WHERE id = ?",
-                   (msg.message_id, start_time, riddle_id))
-    conn.commit()
+    with db.transaction():
+        riddle_id = db.execute("INSERT INTO riddles (chat_id, user_id, riddle_text, answer, prize, time_limit, hint, hint_delay, "
+                               "photo_id, message_id, start_time, active, state) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, 'live')",
+                               (chat_id, user_id, riddle_text, riddle["answer"], prize, time_limit, hint, hint_delay,
+                                photo_id, msg.message_id, start_time)).lastrowid
+        riddle_timer(riddle_id, chat_id, msg.message_id, time_limit, shown_text, shown_prize, hint, hint_delay, photo_id)
+        stats.increment(db, riddles_sent=1)
+    if owns_chat(chat_id):
+        add_active_riddle(riddle_id, chat_id, msg.message_id, riddle["answer"], prize, user_id, start_time)
     logger.info(f"Загадка отправлена в чат {chat_id} пользователем {user_id} с message_id {msg.message_id}")
+    return riddle_id
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("send_"))
+def send_riddle(call):
+    user_id = call.from_user.id
+    draft = callback_draft(call, "send_", "preview")
+    if draft is None:
+        return
+    # Черновик забирает тот, кто первым перевёл его в sending: повторное нажатие не отправит
+    # загадку дважды. Удаляется черновик только после публикации, при ошибке возвращается в превью
+    claimed = drafts.update(draft, step="sending")
+    if claimed is None:
+        return
+    try:
+        publish_riddle(user_id, claimed)
+    except Exception as e:
+        logger.error(f"Ошибка публикации загадки пользователя {user_id} в чат {claimed['chat_id']}: {e}")
+        drafts.update(claimed, step="preview")
+        bot.send_message(user_id, "⛔ *Не получилось отправить загадку!* ⛔\n\nПроверь, что я есть в чате и у меня есть права, "
+                                  "и нажми 'Отправить' ещё раз 👇")
+        return
+    drafts.delete(user_id)
     bot.send_message(call.from_user.id, "✨ *Готово!* ✨\n\nЗагадка отправлена в чат! 🎉")
     
     try:
@@ -547,114 +864,372 @@ def send_riddle(call):
         logger.info(f"Удалено превью загадки в ЛС для пользователя {call.from_user.id}")
     except Exception as e:
         logger.error(f"Ошибка удаления превью в ЛС: {e}")
-    
-    threading.Thread(target=riddle_timer, args=(riddle_id, chat_id, msg.message_id, time_limit, riddle_text, prize, hint, hint_delay), daemon=True).start()
 
 @bot.callback_query_handler(func=lambda call: call.data == "cancel")
 def cancel_riddle(call):
     user_id = call.from_user.id
-    cursor.execute("DELETE FROM riddles WHERE user_id = ? AND active = 0", (user_id,))
-    conn.commit()
+    drafts.delete(user_id)
     bot.send_message(user_id, "❌ *Отменено!* ❌\n\nСоздание загадки остановлено! 😊")
     logger.info(f"Пользователь {user_id} отменил создание загадки")
-    bot.clear_step_handler_by_chat_id(user_id)
     main_menu(user_id)
 
+# Паки загадок: файл .csv, .json или .jsonl в ЛС ставит загадки в очередь публикаций,
+# дальше их по времени post_at публикует post_due_riddles
+PACK_MAX_BYTES = int(os.getenv("PACK_MAX_BYTES", 5 * 1024 * 1024))
+PACK_MAX_RIDDLES = int(os.getenv("PACK_MAX_RIDDLES", 10000))
+QUEUE_POLL_INTERVAL = int(os.getenv("QUEUE_POLL_INTERVAL", 5))  # Как часто проверять очередь, сек
+QUEUE_BATCH = 100  # Максимум публикаций, запускаемых за одну проверку
+queue_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="queue")
+
+@bot.message_handler(content_types=['document'], chat_types=['private'])
+def handle_pack(message):
+    user_id = message.from_user.id
+    document = message.document
+    try:
+        fmt = detect_format(document.file_name)
+    except PackError as e:
+        bot.send_message(user_id, f"⛔ *Ой!* ⛔\n\n{e}")
+        return
+    if document.file_size and document.file_size > PACK_MAX_BYTES:
+        bot.send_message(user_id, f"⛔ *Слишком большой файл!* ⛔\n\nМаксимум {PACK_MAX_BYTES // 1024} КБ — раздели пак на части.")
+        return
+    # Права проверяются до разбора: импорт идёт под транзакцией и не должен ждать Telegram
+    allowed = admin_chats(user_id, [row[0] for row in db.execute("SELECT chat_id FROM chats")])
+    if not allowed:
+        bot.send_message(user_id, "😔 *Упс!* 😔\n\nТы не админ ни в одном чате, где я есть. Добавь меня и дай права! 😉")
+        return
+    try:
+        text = bot.download_file(bot.get_file(document.file_id).file_path).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        bot.send_message(user_id, "⛔ *Ой!* ⛔\n\nФайл должен быть в кодировке UTF-8.")
+        return
+    count, errors = import_pack(db, user_id, io.StringIO(text, newline=""), fmt, allowed.__contains__,
+                                max_riddles=PACK_MAX_RIDDLES)
+    if errors:
+        bot.send_message(user_id, "⛔ *Пак не принят* ⛔\n\nИсправь ошибки и пришли файл заново:\n" + "\n".join(errors))
+        return
+    bot.send_message(user_id, f"📦 *Пак принят!* 📦\n\nЗагадок в очереди: {count}. Они выйдут в чатах по расписанию.\n"
+                              "Очередь — /queue, отменить — /queue_clear")
+
+# Наступившие публикации своих чатов уходят в отдельный пул: публикация ждёт
+# ответа Telegram и не должна держать поток планировщика. В каждый чат — по одной
+# загадке за раз, чтобы чат с длинной очередью не занимал весь пул
+queue_posting = set()  # Чаты, в которые сейчас идёт публикация из очереди
+
+def post_due_riddles():
+    try:
+        due = {}
+        for queue_id, chat_id in riddle_queue.due():
+            if chat_id not in queue_posting and owns_chat(chat_id):
+                due.setdefault(chat_id, queue_id)
+        for chat_id, queue_id in list(due.items())[:QUEUE_BATCH]:
+            queue_posting.add(chat_id)
+            queue_pool.submit(post_queued_riddle, queue_id, chat_id)
+    except Exception as e:
+        logger.error(f"Ошибка проверки очереди публикаций: {e}")
+    scheduler.schedule("queue", "poll", time.time() + QUEUE_POLL_INTERVAL, post_due_riddles)
+
+def post_queued_riddle(queue_id, chat_id):
+    try:
+        riddle = riddle_queue.claim(queue_id)
+        if riddle is None:
+            return  # Запись отменили, пока она ждала в пуле
+        riddle_id = publish_riddle(riddle["user_id"], riddle)
+    except Exception as e:
+        logger.error(f"Ошибка публикации загадки {queue_id} из очереди в чат {chat_id}: {e}")
+        riddle_queue.failed(queue_id, e)
+        return
+    finally:
+        queue_posting.discard(chat_id)
+    riddle_queue.posted(queue_id, riddle_id)
+
+def start_queue_poster():
+    stale = riddle_queue.recover(owns_chat)
+    if stale:
+        logger.warning(f"Публикаций из очереди, прерванных перезапуском: {stale}")
+    scheduler.schedule("queue", "poll", time.time(), post_due_riddles)
+
 @bot.callback_query_handler(func=lambda call: call.data in ["stats_global", "stats_chats_users"])
 def show_stats(call):
     user_id = call.from_user.id
     if call.data == "stats_global":
-        cursor.execute("SELECT COUNT(*) FROM riddles")
-        total_riddles = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM riddles WHERE active = 0")
-        solved_riddles = cursor.fetchone()[0]
-        cursor.execute("SELECT AVG(end_time - start_time) / 60 FROM riddles WHERE active = 0 AND end_time IS NOT NULL")
-        avg_time = cursor.fetchone()[0] or 0
+        counters = stats.snapshot(db)
+        sent_riddles = counters["riddles_sent"]
+        solved_riddles = counters["riddles_solved"]
+        solved_share = solved_riddles / sent_riddles * 100 if sent_riddles else 0
+        avg_time = counters["solve_time_total"] / solved_riddles / 60 if solved_riddles else 0
         text = (
             f"📈 *Общая статистика* 📈\n\n"
-            f"✨ Создано загадок: {total_riddles}\n"
-            f"✅ Отгадано: {solved_riddles} ({solved_riddles/total_riddles*100:.1f}%)\n"
+            f"✨ Создано загадок: {counters['riddles_created']}\n"
+            f"📨 Опубликовано: {sent_riddles}\n"
+            f"🧩 Активных сейчас: {counters['riddles_live']}\n"
+            f"✅ Отгадано: {solved_riddles} ({solved_share:.1f}%)\n"
+            f"⏰ Истекло: {counters['riddles_expired']}\n"
             f"⏱ Среднее время отгадки: {avg_time:.1f} мин"
         )
         bot.send_message(user_id, text, parse_mode="Markdown")
     elif call.data == "stats_chats_users":
-        cursor.execute("SELECT COUNT(*) FROM chats")
-        total_chats = cursor.fetchone()[0]
-        cursor.execute("SELECT chat_id, members_count FROM chats")
-        chats = cursor.fetchall()
-        total_members = sum(members_count for _, members_count in chats)
+        counters = stats.snapshot(db)
         text = (
             f"👥 *Чаты и участники* 👥\n\n"
-            f"💬 Чатов с ботом: {total_chats}\n"
-            f"👤 Всего участников: {total_members}"
+            f"💬 Чатов с ботом: {counters['chats_total']}\n"
+            f"👤 Всего участников: {counters['members_total']}"
         )
         bot.send_message(user_id, text, parse_mode="Markdown")
 
 # Обработка ответов
-incorrect_messages = {}
 
-@bot.message_handler(content_types=['text'], chat_types=['group', 'supergroup'])
-def check_answer(message):
-    global incorrect_messages
+# Фильтр групповых сообщений до вызова обработчика: дальше проходят только
+# реплаи на живые загадки. Остальной трафик групп отбрасывается по одному
+# поиску в индексе active_riddles
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.01))  # Доля сообщений групп, попадающих в DEBUG-лог
+GROUP_CHAT_TYPES = ('group', 'supergroup')
+update_filter_stats = {"processed": 0, "dropped": 0}
+update_filter_lock = threading.Lock()
+
+def count_filtered(passed):
+    with update_filter_lock:
+        update_filter_stats["processed" if passed else "dropped"] += 1
+    return passed
+
+def should_log_message():
+    return logger.isEnabledFor(logging.DEBUG) and random.random() < LOG_SAMPLE_RATE
+
+def is_riddle_reply(message):
+    reply = message.reply_to_message
+    passed = reply is not None and (message.chat.id, reply.message_id) in active_riddles
+    if not passed and should_log_message():
+        logger.debug(f"Сообщение в чате {message.chat.id} от {message.from_user.id} отброшено: не ответ на загадку")
+    return count_filtered(passed)
+
+# То же для сырого JSON обновления в режиме вебхука и в шардах: лишний трафик
+# групп отбрасывается ещё до разбора и постановки в очередь
+def wants_raw_update(raw):
+    message = raw.get("message")
+    if not message or message.get("chat", {}).get("type") not in GROUP_CHAT_TYPES:
+        return True
+    text = message.get("text")
+    if text is None or text.startswith("/"):
+        return True
+    reply = message.get("reply_to_message")
+    if reply is not None and (message["chat"]["id"], reply.get("message_id")) in active_riddles:
+        return True  # Пройденные считает фильтр обработчика
+    return count_filtered(False)
+
+# Сводка неверных ответов по загадке: одно сообщение-реплай на загадку, которое
+# потом правится. Таймер сводки входит в группу загадки и снимается вместе с ней
+def send_guess_feedback(riddle_id, chat_id, riddle_message_id):
+    if (chat_id, riddle_message_id) not in active_riddles:
+        guess_limiter.forget(riddle_id)  # Догадка успела до завершения загадки, а сводка уже не нужна
+        return
+    feedback = guess_limiter.feedback(riddle_id, chat_id)
+    if feedback is None:
+        return
+    delay, wrong, message_id = feedback
+    if delay:
+        scheduler.schedule(riddle_id, "feedback", time.time() + delay, send_guess_feedback, riddle_id, chat_id, riddle_message_id)
+        return
+    text = rendering.wrong_guesses_message(wrong)
+    if message_id is None:
+        future = outbox.send_message(chat_id, text, parse_mode="Markdown",
+                                     reply_parameters=types.ReplyParameters(riddle_message_id, allow_sending_without_reply=True))
+        future.add_done_callback(lambda done: remember_feedback_message(done, riddle_id, chat_id))
+    else:
+        outbox.edit_message_text(chat_id, message_id, text, parse_mode="Markdown")
+
+# Запоминаем сводку, чтобы удалить её после завершения загадки; если загадка
+# завершилась, пока сводка отправлялась, удаляем сразу
+def remember_feedback_message(future, riddle_id, chat_id):
+    message = future.result() if future.exception() is None else None
+    message_id = message.message_id if message is not None else None
+    if guess_limiter.feedback_sent(riddle_id, message_id):
+        if message_id is not None:
+            replies.add(riddle_id, chat_id, message_id)
+    elif message_id is not None:
+        outbox.delete_message(chat_id, message_id)
+
+# Проверка догадки без обращений к базе: всё нужное лежит в active_riddles.
+# Неверная догадка попадает в сводку загадки, догадки сверх лимита игрока
+# не проверяются; возвращается загадка, если ответ верный, иначе None
+def judge_guess(message):
     chat_id = message.chat.id
     user_id = message.from_user.id
     
-    if not message.reply_to_message:
-        logger.info(f"Сообщение в чате {chat_id} от {user_id}: '{message.text}' - не ответ")
-        return
-    
     reply_to_id = message.reply_to_message.message_id
-    logger.info(f"Получен ответ в чате {chat_id} на сообщение {reply_to_id} от пользователя {user_id}: '{message.text}'")
+    if should_log_message():
+        logger.debug(f"Получен ответ в чате {chat_id} на сообщение {reply_to_id} от пользователя {user_id}: '{message.text}'")
 
-    cursor.execute("SELECT id, answer, prize, user_id, message_id FROM riddles WHERE chat_id = ? AND message_id = ? AND active = 1",
-                   (chat_id, reply_to_id))
-    riddle = cursor.fetchone()
+    riddle = active_riddles.get((chat_id, reply_to_id))
+    if not riddle:
+        logger.debug(f"Сообщение {reply_to_id} в чате {chat_id} не связано с активной загадкой")
+        return None
+
+    riddle_id, matcher = riddle["id"], riddle["matcher"]
+    if not guess_limiter.allow(riddle_id, user_id):
+        if should_log_message():
+            logger.debug(f"Догадка пользователя {user_id} к загадке {riddle_id} отброшена лимитом")
+        return None
+    user_answer = message.text
+    if should_log_message():
+        logger.debug(f"Проверка ответа на загадку {riddle_id}: '{user_answer}' vs {matcher}")
+    if matcher.matches(user_answer):
+        return riddle
+    delay = guess_limiter.wrong(riddle_id)
+    if delay is not None:
+        scheduler.schedule(riddle_id, "feedback", time.time() + delay, send_guess_feedback, riddle_id, chat_id, riddle["message_id"])
+    if should_log_message():
+        logger.debug(f"Неправильный ответ '{user_answer}' на загадку {riddle_id}")
+    return None
+
+# Загадку забирает первый верный ответ. Сначала захват в памяти процесса: setdefault
+# на записи индекса атомарен, и опоздавшие отсеиваются без запросов к базе.
+# Решает условный UPDATE ... AND active = 1: через него же завершает загадку таймер
+# (expire_riddle) и другие шарды, поэтому победитель ровно один. Общей блокировки нет:
+# загадки разных чатов не ждут друг друга
+def claim_riddle(riddle, user_id):
+    return riddle.setdefault("winner", user_id) == user_id
+
+# Возвращает очки победителя в чате после записи или None, если загадку уже завершили
+def solve_riddle(riddle, user_id, chat_id, username):
+    with db.transaction():
+        solved_at = int(time.time())
+        if db.execute("UPDATE riddles SET active = 0, state = 'solved', end_time = ? WHERE id = ? AND active = 1",
+                      (solved_at, riddle["id"])).rowcount == 0:
+            return None
+        stats.increment(db, riddles_solved=1, solve_time_total=solved_at - (riddle["start_time"] or solved_at))
+        db.execute("INSERT OR IGNORE INTO scores (user_id, chat_id, points) VALUES (?, ?, 0)", (user_id, chat_id))
+        points = db.execute("UPDATE scores SET points = points + 1 WHERE user_id = ? AND chat_id = ? RETURNING points",
+                            (user_id, chat_id)).fetchone()[0]
+        db.execute("INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)", (user_id, username or "NoUsername"))
+    return points
+
+# Засчитывание победы: запись в базу и сообщения победителю и в чат.
+# Возвращает False, если загадку уже забрал другой ответ или таймер
+def award_win(message, riddle):
+    chat_id = message.chat.id
+    user_id = message.from_user.id
+    riddle_id, prize = riddle["id"], riddle["prize"]
+    creator_id, riddle_message_id = riddle["creator_id"], riddle["message_id"]
+
+    points = None
+    if claim_riddle(riddle, user_id):
+        try:
+            points = solve_riddle(riddle, user_id, chat_id, message.from_user.username)
+        except Exception:
+            riddle.pop("winner", None)  # Запись не прошла: загадка снова свободна
+            raise
+    if points is None:
+        outbox.reply_to(message, "⌛ *Опоздал!* ⌛\n\nЭту загадку уже отгадали или её время вышло.")
+        logger.info(f"Загадка {riddle_id} уже завершена, ответ пользователя {user_id} опоздал")
+        return False
+    outbox.reply_to(message, f"🎉 *Ура! Загадка разгадана!* 🎉\n\nПоздравляем, @{message.from_user.username}! 🏆", priority=HIGH)
+    leaderboard.record_win(user_id, chat_id, points, message.from_user.username)
+    scheduler.cancel_group(riddle_id)
+    remove_active_riddle(chat_id, riddle_message_id)
+    logger.info(f"Загадка {riddle_id} разгадана пользователем {user_id}")
     
-    if riddle:
-        riddle_id, correct_answer, prize, creator_id, riddle_message_id = riddle
-        user_answer = message.text.lower().strip()
-        correct_answer = correct_answer.lower().strip()
-        logger.info(f"Проверка ответа на загадку {riddle_id}: '{user_answer}' vs '{correct_answer}'")
-        
-        if user_answer == correct_answer:
-            winner_message = bot.reply_to(message, f"🎉 *Ура! Загадка разгадана!* 🎉\n\nПоздравляем, @{message.from_user.username}! 🏆")
-            cursor.execute("UPDATE riddles SET active = 0, end_time = ? WHERE id = ?", (int(time.time()), riddle_id))
-            cursor.execute("INSERT OR IGNORE INTO scores (user_id, chat_id, points) VALUES (?, ?, 0)", (user_id, chat_id))
-            cursor.execute("UPDATE scores SET points = points + 1 WHERE user_id = ? AND chat_id = ?", (user_id, chat_id))
-            conn.commit()
-            logger.info(f"Загадка {riddle_id} разгадана пользователем {user_id}")
-            
-            try:
-                bot.delete_message(chat_id, riddle_message_id)
-                logger.info(f"Удалено сообщение загадки {riddle_message_id} в чате {chat_id}")
-            except Exception as e:
-                logger.error(f"Ошибка удаления сообщения {riddle_message_id}: {e}")
-            
-            if chat_id not in incorrect_messages:
-                incorrect_messages[chat_id] = []
-            for msg_id in incorrect_messages[chat_id]:
-                try:
-                    bot.delete_message(chat_id, msg_id)
-                    logger.info(f"Удалено сообщение с неправильным ответом {msg_id} в чате {chat_id}")
-                except Exception as e:
-                    logger.error(f"Ошибка удаления сообщения {msg_id}: {e}")
-            incorrect_messages[chat_id] = []
-            
-            if prize:
-                bot.send_message(user_id, f"🥳 *Победа!* 🥳\n\nТы отгадал загадку! 🎉\nТвой приз: *{prize}*")
-            else:
-                creator = cursor.execute("SELECT username FROM users WHERE user_id = ?", (creator_id,)).fetchone()[0]
-                bot.send_message(user_id, f"🥳 *Победа!* 🥳\n\nТы отгадал загадку! 🎉\nСвяжитесь с @{creator} за призом!")
-        else:
-            incorrect_msg = bot.reply_to(message, "❌ *Не угадал!* ❌\n\nПопробуй ещё раз! 😉")
-            if chat_id not in incorrect_messages:
-                incorrect_messages[chat_id] = []
-            incorrect_messages[chat_id].append(incorrect_msg.message_id)
-            logger.info(f"Неправильный ответ '{user_answer}' на загадку {riddle_id}, message_id {incorrect_msg.message_id}")
+    outbox.delete_message(chat_id, riddle_message_id, priority=HIGH)
+    logger.info(f"Удаление сообщения загадки {riddle_message_id} в чате {chat_id} поставлено в очередь")
+    
+    scheduler.schedule(("replies", riddle_id), "cleanup", time.time(), replies.cleanup, riddle_id)
+    
+    if prize:
+        outbox.send_message(user_id, f"🥳 *Победа!* 🥳\n\nТы отгадал загадку! 🎉\nТвой приз: *{prize}*", priority=HIGH)
     else:
-        logger.info(f"Сообщение {reply_to_id} в чате {chat_id} не связано с активной загадкой")
+        # Автора пака, импортированного из командной строки, может не быть в users
+        row = db.execute("SELECT username FROM users WHERE user_id = ?", (creator_id,)).fetchone()
+        creator = f"@{row[0]}" if row else f"автором загадки (id {creator_id})"
+        outbox.send_message(user_id, f"🥳 *Победа!* 🥳\n\nТы отгадал загадку! 🎉\nСвяжитесь с {creator} за призом!", priority=HIGH)
+    return True
+
+@bot.message_handler(content_types=['text'], chat_types=['group', 'supergroup'], func=is_riddle_reply)
+def check_answer(message):
+    riddle = judge_guess(message)
+    if riddle is not None:
+        award_win(message, riddle)
+
+# Метрики в формате Prometheus и профайлер: только если задан METRICS_PORT.
+# Шард с номером i слушает METRICS_PORT + i
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+PROFILER_INTERVAL = float(os.getenv("PROFILER_INTERVAL", 0.005))  # Период выборки стеков в /profile, сек
+
+def start_metrics(port):
+    metrics = Metrics()
+    metrics.instrument_bot(bot)
+    metrics.instrument_database(db)
+    metrics.instrument_telegram()
+    metrics.gauge("active_riddles", "Живые загадки в индексе процесса", lambda: len(active_riddles))
+    metrics.gauge("pending_timers", "Запланированные таймеры", scheduler.pending)
+    metrics.gauge("outbox_queue_depth", "Запросы в очереди исходящих", outbox.depth)
+    metrics.counter("outbox_sent", "Отправлено через очередь исходящих", lambda: outbox.sent)
+    metrics.counter("outbox_failed", "Ошибки очереди исходящих", lambda: outbox.failed)
+    metrics.counter("outbox_coalesced", "Правки, схлопнутые в очереди исходящих", lambda: outbox.coalesced)
+    metrics.gauge("member_cache_size", "Записей в кэше статусов участников", lambda: len(member_cache))
+    metrics.counter("updates_processed", "Сообщения групп, пропущенные фильтром", lambda: update_filter_stats["processed"])
+    metrics.counter("updates_dropped", "Сообщения групп, отброшенные фильтром", lambda: update_filter_stats["dropped"])
+    metrics.counter("guesses_throttled", "Догадки, отброшенные лимитом игрока", lambda: guess_limiter.throttled)
+    metrics.counter("guesses_wrong", "Неверные догадки", lambda: guess_limiter.wrong_total)
+    MetricsServer(metrics, METRICS_HOST, port, profiler=SamplingProfiler(PROFILER_INTERVAL)).start()
+    return metrics
 
 # Запуск бота
-if __name__ == "__main__":
-    logger.info("Бот запущен")
-    bot.polling(none_stop=True)
\ No newline at end of file
+# Точка входа процесса-шарда: свои таймеры, свои чаты, обновления из очереди фронта
+def run_shard(index, shards, inbox, processed):
+    global SHARD_INDEX
+    SHARD_INDEX = index
+    logger.info(f"Шард {index} из {shards} запущен как @{bot.user.username}")
+    if METRICS_PORT:
+        start_metrics(METRICS_PORT + index)
+    restore_timers()
+    scheduler.start()
+    scheduler.schedule("adopt", "poll", time.time() + RIDDLE_ADOPT_INTERVAL, adopt_new_riddles)
+    start_queue_poster()
+    threading.Thread(target=chat_refresh_worker, name="chat-refresh", daemon=True).start()
+    if index == 0:
+        threading.Thread(target=retention_worker, name="retention", daemon=True).start()
+    serve_shard(bot, index, inbox, processed, workers=SHARD_WORKERS, prefilter=wants_raw_update)
+
+def run_sharded():
+    dispatcher = ShardDispatcher(run_shard, SHARDS, queue_size=WEBHOOK_QUEUE_SIZE)
+    dispatcher.start()
+    try:
+        if RUN_MODE == "webhook":
+            from webhook import WebhookServer
+            if WEBHOOK_URL:
+                bot.set_webhook(url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                                allowed_updates=telebot.util.update_types)
+            WebhookServer(bot, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET,
+                          dispatcher=dispatcher).run()
+        else:
+            bot.remove_webhook()
+            dispatcher.poll(TOKEN, allowed_updates=telebot.util.update_types)
+    finally:
+        dispatcher.stop()
+
+if __name__ == "__main__" and SHARDS > 1:
+    logger.info(f"Бот запущен в многопроцессном режиме, шардов: {SHARDS}")
+    enable_incremental_vacuum(db)
+    run_sharded()
+elif __name__ == "__main__":
+    logger.info(f"Бот @{bot.user.username} запущен")
+    metrics = start_metrics(METRICS_PORT) if METRICS_PORT else None
+    enable_incremental_vacuum(db)
+    restore_timers()
+    scheduler.start()
+    start_queue_poster()
+    threading.Thread(target=chat_refresh_worker, name="chat-refresh", daemon=True).start()
+    threading.Thread(target=retention_worker, name="retention", daemon=True).start()
+    if RUN_MODE == "webhook":
+        from webhook import WebhookServer
+        if WEBHOOK_URL:
+            bot.set_webhook(url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                            allowed_updates=telebot.util.update_types)
+        server = WebhookServer(bot, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET,
+                               workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE, prefilter=wants_raw_update)
+        if metrics is not None:
+            metrics.gauge("webhook_queue_depth", "Обновления в очереди вебхука", server.queue.qsize)
+        server.run()
+    else:
+        bot.remove_webhook()
+        bot.polling(none_stop=True, allowed_updates=telebot.util.update_types)
\ No newline at end of file
@@ -0,0 +1,94 @@
+import threading
+import time
+
+from cache import TTLCache
+
+# Поля черновика, которые заполняются по шагам мастера создания загадки
+FIELDS = ("chat_id", "step", "riddle_text", "photo_id", "answer", "prize", "time_limit", "hint", "hint_delay")
+
+
+def create_table(db):
+    db.execute('''CREATE TABLE IF NOT EXISTS drafts (
+                    draft_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER UNIQUE,
+                    chat_id INTEGER,
+                    step TEXT,
+                    riddle_text TEXT,
+                    photo_id TEXT,
+                    answer TEXT,
+                    prize TEXT,
+                    time_limit INTEGER,
+                    hint TEXT,
+                    hint_delay INTEGER,
+                    updated_at INTEGER)''')
+
+
+# Черновики загадок: одна строка на пользователя в SQLite и кэш в памяти
+# со сквозной записью. Каждый шаг мастера обновляет только свои поля,
+# а кнопки несут лишь короткий draft_id. Запись условная: шаг применяется,
+# только если в базе тот же черновик (draft_id) на том же шаге, что был прочитан.
+# Так устаревший кэш (запись из другого процесса) или два одновременных шага
+# не перезапишут более новое состояние: проигравший получает None
+class DraftStore:
+    def __init__(self, db, cache_size=10000, cache_ttl=600):
+        self.db = db
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._lock = threading.Lock()
+
+    def start(self, user_id, chat_id, step):
+        now = int(time.time())
+        with self.db.transaction(), self._lock:
+            self.db.execute("DELETE FROM drafts WHERE user_id = ?", (user_id,))
+            draft_id = self.db.execute("INSERT INTO drafts (user_id, chat_id, step, updated_at) VALUES (?, ?, ?, ?)",
+                                       (user_id, chat_id, step, now)).lastrowid
+            draft = dict.fromkeys(FIELDS)
+            draft.update(draft_id=draft_id, user_id=user_id, chat_id=chat_id, step=step)
+            self._cache.set(user_id, draft)
+        return dict(draft)
+
+    # fresh=True — мимо кэша: когда есть подозрение, что шаг прошёл в другом процессе
+    def get(self, user_id, fresh=False):
+        draft = None if fresh else self._cache.get(user_id)
+        if draft is None:
+            # Чтение под блокировкой: иначе прочитанная старая строка может лечь в кэш поверх новой
+            with self._lock:
+                row = self.db.execute(f"SELECT draft_id, {', '.join(FIELDS)} FROM drafts WHERE user_id = ?", (user_id,)).fetchone()
+                if row is None:
+                    self._cache.invalidate(user_id)
+                    return None
+                draft = dict(zip(("draft_id",) + FIELDS, row), user_id=user_id)
+                self._cache.set(user_id, draft)
+        return dict(draft)
+
+    # Черновик по id из кнопки; устаревшая кнопка от прошлого черновика даёт None
+    def get_by_id(self, user_id, draft_id, fresh=False):
+        draft = self.get(user_id, fresh)
+        if draft is None or draft["draft_id"] != draft_id:
+            return None
+        return draft
+
+    # Шаг мастера над прочитанным черновиком draft. Возвращает новый черновик
+    # или None, если черновик в базе уже другой (удалён, пересоздан или сдвинут)
+    def update(self, draft, **fields):
+        unknown = set(fields) - set(FIELDS)
+        if unknown:
+            raise ValueError(f"Неизвестные поля черновика: {unknown}")
+        user_id = draft["user_id"]
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        # Сначала блокировка записи SQLite, потом своя: порядок один во всех потоках.
+        # Внешняя транзакция вызывающего сюда не допускается — кэш должен видеть только закоммиченное
+        with self.db.transaction(), self._lock:
+            updated = self.db.execute(f"UPDATE drafts SET {assignments}, updated_at = ? "
+                                      f"WHERE user_id = ? AND draft_id = ? AND step IS ?",
+                                      (*fields.values(), int(time.time()), user_id, draft["draft_id"], draft["step"])).rowcount
+            if not updated:
+                self._cache.invalidate(user_id)
+                return None
+            draft = dict(draft, **fields)
+            self._cache.set(user_id, draft)
+        return dict(draft)
+
+    def delete(self, user_id):
+        with self.db.transaction(), self._lock:
+            self._cache.invalidate(user_id)
+            return self.db.execute("DELETE FROM drafts WHERE user_id = ?", (user_id,)).rowcount
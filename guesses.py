@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+_SENDING = object()  # Сообщение-сводка отправляется, message_id ещё неизвестен
+
+
+# Скользящее окно: не больше limit событий за последние window секунд.
+# Хранит не больше limit отметок времени
+class SlidingWindow:
+    __slots__ = ("limit", "window", "_events")
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self._events = deque(maxlen=limit)
+
+    def _expire(self, now):
+        while self._events and self._events[0] <= now - self.window:
+            self._events.popleft()
+
+    def allow(self, now):
+        self._expire(now)
+        if len(self._events) >= self.limit:
+            return False
+        self._events.append(now)
+        return True
+
+    # Через сколько секунд окно пропустит следующее событие
+    def wait(self, now):
+        self._expire(now)
+        if len(self._events) < self.limit:
+            return 0
+        return self._events[0] + self.window - now
+
+
+class _RiddleGuesses:
+    __slots__ = ("users", "wrong", "reported", "scheduled", "next_at", "message_id")
+
+    def __init__(self):
+        self.users = OrderedDict()  # user_id -> SlidingWindow, самые давние в начале
+        self.wrong = 0
+        self.reported = 0
+        self.scheduled = False
+        self.next_at = 0
+        self.message_id = None
+
+
+# Ограничение догадок и сводка неверных ответов. Догадки игрока сверх user_limit
+# за user_window секунд по одной загадке отбрасываются без проверки. Вместо ответа
+# на каждую неверную догадку в чате живёт одно сообщение-сводка на загадку: его
+# отправляют и потом правят не чаще раза в feedback_interval секунд, а все сводки
+# одного чата вместе — не больше chat_limit раз за chat_window секунд.
+# Память: окна не больше max_users игроков на загадку и max_chats чатов;
+# состояние загадки удаляется в forget() при её завершении. user_limit = 0 — без лимита
+class GuessLimiter:
+    def __init__(self, user_limit=6, user_window=30, feedback_interval=10, chat_limit=6, chat_window=60,
+                 max_users=1000, max_chats=10000, clock=time.monotonic):
+        self.user_limit = user_limit
+        self.user_window = user_window
+        self.feedback_interval = feedback_interval
+        self.chat_limit = chat_limit
+        self.chat_window = chat_window
+        self.max_users = max_users
+        self.max_chats = max_chats
+        self._clock = clock
+        self._riddles = {}  # riddle_id -> _RiddleGuesses
+        self._chats = OrderedDict()  # chat_id -> SlidingWindow сводок
+        self._lock = threading.Lock()
+        self.throttled = 0
+        self.wrong_total = 0
+
+    def _state(self, riddle_id):
+        state = self._riddles.get(riddle_id)
+        if state is None:
+            state = self._riddles[riddle_id] = _RiddleGuesses()
+        return state
+
+    # Можно ли проверять догадку; лишние догадки игрока отбрасываются молча
+    def allow(self, riddle_id, user_id):
+        if not self.user_limit:
+            return True
+        with self._lock:
+            users = self._state(riddle_id).users
+            window = users.get(user_id)
+            if window is None:
+                window = users[user_id] = SlidingWindow(self.user_limit, self.user_window)
+                if len(users) > self.max_users:
+                    users.popitem(last=False)
+            else:
+                users.move_to_end(user_id)
+            if window.allow(self._clock()):
+                return True
+            self.throttled += 1
+            return False
+
+    # Учёт неверной догадки. Возвращает задержку, через которую нужно вызвать
+    # feedback(), или None, если сводка уже запланирована
+    def wrong(self, riddle_id):
+        with self._lock:
+            state = self._state(riddle_id)
+            state.wrong += 1
+            self.wrong_total += 1
+            if state.scheduled:
+                return None
+            state.scheduled = True
+            return max(0, state.next_at - self._clock())
+
+    # Что сделать со сводкой: None — ничего (загадка завершена или новых ошибок нет),
+    # (задержка, None, None) — повторить позже, (0, число неверных, message_id) —
+    # отправить сводку (message_id None) или поправить уже отправленную
+    def feedback(self, riddle_id, chat_id):
+        with self._lock:
+            state = self._riddles.get(riddle_id)
+            if state is None:
+                return None
+            now = self._clock()
+            if state.wrong == state.reported:
+                state.scheduled = False
+                return None
+            if state.message_id is _SENDING:
+                return self.feedback_interval, None, None
+            if self.chat_limit:
+                window = self._chats.get(chat_id)
+                if window is None:
+                    window = self._chats[chat_id] = SlidingWindow(self.chat_limit, self.chat_window)
+                    if len(self._chats) > self.max_chats:
+                        self._chats.popitem(last=False)
+                else:
+                    self._chats.move_to_end(chat_id)
+                if not window.allow(now):
+                    return max(window.wait(now), 0.1), None, None
+            message_id = state.message_id
+            if message_id is None:
+                state.message_id = _SENDING
+            state.reported = state.wrong
+            state.scheduled = False
+            state.next_at = now + self.feedback_interval
+            return 0, state.wrong, message_id
+
+    # Сводка отправлена (message_id None — не удалось, следующая уйдёт новым сообщением).
+    # False — загадка уже завершилась, и сообщение нужно убрать
+    def feedback_sent(self, riddle_id, message_id):
+        with self._lock:
+            state = self._riddles.get(riddle_id)
+            if state is None:
+                return False
+            state.message_id = message_id
+            if message_id is None:
+                state.reported = 0
+            return True
+
+    def forget(self, riddle_id):
+        with self._lock:
+            self._riddles.pop(riddle_id, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._riddles)
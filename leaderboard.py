@@ -0,0 +1,85 @@
+import heapq
+import threading
+import time
+
+
+# Рейтинги отгадчиков в памяти: очки по чатам и общие суммы обновляются
+# при каждой победе, а таблица scores читается один раз при первом запросе.
+# max_age — перечитывать scores не реже этого (сек): нужно, когда победы
+# записывают и другие процессы, например соседние шарды
+class Leaderboard:
+    def __init__(self, db, size=10, max_age=None, clock=time.monotonic):
+        self.db = db
+        self.size = size
+        self.max_age = max_age
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._loaded_at = 0
+        self._chat_points = {}  # chat_id -> {user_id: points}
+        self._total_points = {}  # user_id -> сумма очков по всем чатам
+        self._names = {}  # user_id -> username
+        self._top_cache = {}  # chat_id (None для общего топа) -> готовый список
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            if self.max_age is None or self._clock() - self._loaded_at < self.max_age:
+                return
+            self._chat_points, self._total_points, self._top_cache = {}, {}, {}
+        rows = self.db.execute("SELECT s.user_id, s.chat_id, s.points, u.username "
+                               "FROM scores s LEFT JOIN users u ON u.user_id = s.user_id").fetchall()
+        for user_id, chat_id, points, username in rows:
+            self._chat_points.setdefault(chat_id, {})[user_id] = points
+            self._total_points[user_id] = self._total_points.get(user_id, 0) + points
+            if username:
+                self._names[user_id] = username
+        self._loaded = True
+        self._loaded_at = self._clock()
+
+    # Учёт победы; points — очки игрока в чате после победы, как их вернула база.
+    # Значение ставится, а не прибавляется: если таблицу успели перечитать после
+    # записи победы (здесь или в другом потоке), победа не засчитается дважды.
+    # Очки только растут, поэтому запоздавшее меньшее значение игнорируется
+    def record_win(self, user_id, chat_id, points, username=None):
+        with self._lock:
+            self._ensure_loaded()
+            chat = self._chat_points.setdefault(chat_id, {})
+            gained = points - chat.get(user_id, 0)
+            if gained > 0:
+                chat[user_id] = points
+                self._total_points[user_id] = self._total_points.get(user_id, 0) + gained
+            if username:
+                self._names[user_id] = username
+            self._top_cache.pop(chat_id, None)
+            self._top_cache.pop(None, None)
+
+    def set_username(self, user_id, username):
+        with self._lock:
+            if username and self._names.get(user_id) != username:
+                self._names[user_id] = username
+                self._top_cache.clear()
+
+    # Сумма всех очков в памяти; должна совпадать с SUM(points) в scores
+    def total_points(self):
+        with self._lock:
+            self._ensure_loaded()
+            return sum(self._total_points.values())
+
+    # Топ чата: список (username, points)
+    def top_chat(self, chat_id):
+        with self._lock:
+            self._ensure_loaded()
+            return self._top(chat_id, self._chat_points.get(chat_id, {}))
+
+    def top_all(self):
+        with self._lock:
+            self._ensure_loaded()
+            return self._top(None, self._total_points)
+
+    def _top(self, key, points):
+        top = self._top_cache.get(key)
+        if top is None:
+            best = heapq.nlargest(self.size, points.items(), key=lambda item: item[1])
+            top = [(self._names.get(user_id, "NoUsername"), user_points) for user_id, user_points in best]
+            self._top_cache[key] = top
+        return top
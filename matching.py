@@ -0,0 +1,112 @@
+import os
+import re
+import unicodedata
+
+# Несколько правильных ответов в одном поле разделяются этим символом
+ANSWER_SEPARATOR = "|"
+# Допустимые опечатки: None — по длине ответа (см. allowed_distance), 0 — только точное совпадение
+ANSWER_MAX_DISTANCE = os.getenv("ANSWER_MAX_DISTANCE")
+ANSWER_MAX_DISTANCE = int(ANSWER_MAX_DISTANCE) if ANSWER_MAX_DISTANCE else None
+
+_SPACES = re.compile(r"\s+")
+# Знаки препинания, которые срезаются с краёв слов: кавычки, скобки, тире и
+# обычная пунктуация предложения. Остальное (# + % & @ эмодзи) — часть ответа:
+# "C#", "C++" и "c" — разные ответы
+_EDGE_CATEGORIES = {"Pi", "Pf", "Ps", "Pe", "Pd"}
+_EDGE_PUNCTUATION = set(".,!?;:…\"'¡¿")
+
+
+def _is_edge(ch):
+    return ch in _EDGE_PUNCTUATION or unicodedata.category(ch) in _EDGE_CATEGORIES
+
+
+def _strip_edges(word):
+    start, end = 0, len(word)
+    while start < end and _is_edge(word[start]):
+        start += 1
+    while end > start and _is_edge(word[end - 1]):
+        end -= 1
+    return word[start:end]
+
+
+# Текст без изменений, кроме регистра и пробелов: NFKC, casefold, пробелы и
+# управляющие символы схлопываются
+def fold(text):
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    text = "".join(" " if unicodedata.category(ch)[0] in "ZC" else ch for ch in text)
+    return _SPACES.sub(" ", text).strip()
+
+
+# Приведение текста к каноническому виду: fold, ё -> е и пунктуация по краям
+# слов ("Москва!", «кот») срезается; внутри слова ("санкт-петербург") остаётся
+def normalize(text):
+    words = (_strip_edges(word) for word in fold(text).replace("ё", "е").split(" "))
+    return " ".join(word for word in words if word)
+
+
+def allowed_distance(variant):
+    if ANSWER_MAX_DISTANCE is not None:
+        return ANSWER_MAX_DISTANCE
+    # Числа и короткие слова — только точно, иначе "кот" засчитает "кит"
+    if any(ch.isdigit() for ch in variant) or len(variant) < 5:
+        return 0
+    return 1 if len(variant) < 10 else 2
+
+
+# Расстояние Левенштейна с порогом: возвращает True, если не больше limit.
+# Считаются только клетки в полосе шириной limit, и перебор обрывается,
+# как только минимум строки превысил порог
+def within_distance(a, b, limit):
+    if abs(len(a) - len(b)) > limit:
+        return False
+    if limit == 0:
+        return a == b
+    if len(a) > len(b):
+        a, b = b, a
+    infinity = limit + 1
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [infinity] * (len(b) + 1)
+        if i <= limit:
+            current[0] = i
+        low, high = max(1, i - limit), min(len(b), i + limit)
+        row_min = current[0]
+        ch = a[i - 1]
+        for j in range(low, high + 1):
+            cost = 0 if ch == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            current[j] = value if value < infinity else infinity
+            if value < row_min:
+                row_min = value
+        if row_min > limit:
+            return False
+        previous = current
+    return previous[len(b)] <= limit
+
+
+# Правильные ответы загадки, нормализованные один раз при публикации
+# Ответ из одной пунктуации ("?", "...") после нормализации пуст: такие варианты
+# сравниваются только точно, по fold
+class AnswerMatcher:
+    __slots__ = ("variants", "_exact", "_folded")
+
+    def __init__(self, answer):
+        parts = [part for part in (answer or "").split(ANSWER_SEPARATOR) if fold(part)]
+        variants = {normalize(part) for part in parts}
+        variants.discard("")
+        self.variants = tuple((variant, allowed_distance(variant)) for variant in sorted(variants))
+        self._exact = frozenset(variants)
+        self._folded = frozenset(fold(part) for part in parts)
+
+    def matches(self, guess):
+        if fold(guess) in self._folded:
+            return True
+        guess = normalize(guess)
+        if not guess:
+            return False
+        if guess in self._exact:
+            return True
+        return any(distance and within_distance(guess, variant, distance) for variant, distance in self.variants)
+
+    def __repr__(self):
+        return f"AnswerMatcher({[variant for variant, _ in self.variants] or sorted(self._folded)!r})"
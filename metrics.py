@@ -0,0 +1,258 @@
+import bisect
+import functools
+import logging
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from telebot import apihelper
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек, сек
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_SPACES = re.compile(r"\s+")
+_PLACEHOLDERS = re.compile(r"\?(\s*,\s*\?)+")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._series = {}  # значения меток -> [счётчики корзин, сумма, количество]
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(BUCKETS, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(BUCKETS), 0.0, 0]
+            if index < len(BUCKETS):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(buckets), total, count) for key, (buckets, total, count) in self._series.items()}
+        for label_values, (buckets, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, hits in zip(BUCKETS, buckets):
+                cumulative += hits
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), label_values + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), label_values + ('+Inf',))} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, label_values)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, label_values)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *label_values, value=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + value
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(self.labels, key)} {value}" for key, value in sorted(values.items())]
+        return lines
+
+
+# Значение, которое снимается в момент запроса метрик: fn() -> число.
+# kind="counter" — накопительный итог, который только растёт
+class Gauge:
+    def __init__(self, name, help_text, fn, kind="gauge"):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.kind = kind
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            logger.error(f"Ошибка чтения метрики {self.name}: {e}")
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", f"{self.name} {value}"]
+
+
+# Набор метрик бота и обёртки, которые их собирают
+class Metrics:
+    def __init__(self, prefix="riddle"):
+        self.prefix = prefix
+        self.handler_seconds = Histogram(f"{prefix}_handler_seconds", "Время обработчиков обновлений", ("handler",))
+        self.handler_errors = Counter(f"{prefix}_handler_errors_total", "Исключения в обработчиках", ("handler", "exception"))
+        self.db_seconds = Histogram(f"{prefix}_db_query_seconds", "Время запросов к SQLite", ("query",))
+        self.db_errors = Counter(f"{prefix}_db_errors_total", "Ошибки запросов к SQLite", ("query", "exception"))
+        self.api_seconds = Histogram(f"{prefix}_telegram_request_seconds", "Время запросов к Bot API", ("method",))
+        self.api_errors = Counter(f"{prefix}_telegram_errors_total", "Ошибки запросов к Bot API", ("method", "exception"))
+        self._metrics = [self.handler_seconds, self.handler_errors, self.db_seconds, self.db_errors,
+                         self.api_seconds, self.api_errors]
+
+    def gauge(self, name, help_text, fn):
+        self._metrics.append(Gauge(f"{self.prefix}_{name}", help_text, fn))
+
+    # Накопительный счётчик, который ведёт сам компонент: fn() -> итог с запуска
+    def counter(self, name, help_text, fn):
+        self._metrics.append(Gauge(f"{self.prefix}_{name}_total", help_text, fn, kind="counter"))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+    def _timed(self, fn, histogram, errors, label):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                errors.inc(label, type(e).__name__)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - started, label)
+        return wrapper
+
+    # Обёртка обработчиков, уже зарегистрированных декораторами bot.*_handler
+    def instrument_bot(self, bot):
+        count = 0
+        for name, handlers in vars(bot).items():
+            if not name.endswith("_handlers") or not isinstance(handlers, list):
+                continue
+            for handler in handlers:
+                fn = handler.get("function") if isinstance(handler, dict) else None
+                if fn is None or getattr(fn, "__wrapped__", None) is not None:
+                    continue
+                handler["function"] = self._timed(fn, self.handler_seconds, self.handler_errors, fn.__name__)
+                count += 1
+        logger.info(f"Метрики: обёрнуто обработчиков {count}")
+
+    def instrument_database(self, db):
+        db.execute = self._timed_query(db.execute)
+        db.executemany = self._timed_query(db.executemany)
+
+    def _timed_query(self, fn):
+        @functools.wraps(fn)
+        def wrapper(sql, *args):
+            label = query_label(sql)
+            started = time.perf_counter()
+            try:
+                return fn(sql, *args)
+            except Exception as e:
+                self.db_errors.inc(label, type(e).__name__)
+                raise
+            finally:
+                self.db_seconds.observe(time.perf_counter() - started, label)
+        return wrapper
+
+    # Все методы Bot API в telebot проходят через apihelper._make_request
+    def instrument_telegram(self):
+        make_request = apihelper._make_request
+        if getattr(make_request, "__wrapped__", None) is not None:
+            return
+
+        @functools.wraps(make_request)
+        def wrapper(token, method_name, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return make_request(token, method_name, *args, **kwargs)
+            except apihelper.ApiTelegramException as e:
+                self.api_errors.inc(method_name, f"ApiTelegramException:{e.error_code}")
+                raise
+            except Exception as e:
+                self.api_errors.inc(method_name, type(e).__name__)
+                raise
+            finally:
+                self.api_seconds.observe(time.perf_counter() - started, method_name)
+
+        apihelper._make_request = wrapper
+
+
+# Метка запроса: текст SQL без лишних пробелов, списки ?,?,? схлопнуты, длина ограничена
+def query_label(sql, limit=200):
+    sql = _PLACEHOLDERS.sub("?...", _SPACES.sub(" ", sql).strip())
+    return sql if len(sql) <= limit else sql[:limit] + "…"
+
+
+PROFILE_USAGE = "usage: /profile?seconds=N&top=M (seconds 0.1..300, top 1..500)\n"
+
+
+# Локальный HTTP-сервер: /metrics в формате Prometheus, /profile?seconds=N — горячие стеки
+class MetricsServer:
+    def __init__(self, metrics, host="127.0.0.1", port=9100, profiler=None):
+        self.metrics = metrics
+        self.profiler = profiler
+        self.host = host
+        self.port = port
+        self._server = None
+
+    def start(self):
+        metrics, profiler = self.metrics, self.profiler
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == "/metrics":
+                    self._reply(200, metrics.render(), "text/plain; version=0.0.4; charset=utf-8")
+                elif url.path == "/profile" and profiler is not None:
+                    query = parse_qs(url.query)
+                    try:
+                        seconds = float(query.get("seconds", ["10"])[0])
+                        top = int(query.get("top", ["30"])[0])
+                    except ValueError:
+                        self._reply(400, PROFILE_USAGE, "text/plain")
+                        return
+                    if not 0 < seconds < float("inf") or top < 1:
+                        self._reply(400, PROFILE_USAGE, "text/plain")
+                        return
+                    seconds, top = min(max(seconds, 0.1), 300), min(top, 500)
+                    self._reply(200, profiler.profile(seconds, top), "text/plain; charset=utf-8")
+                else:
+                    self._reply(404, "not found\n", "text/plain")
+
+            def _reply(self, status, body, content_type):
+                body = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        logger.info(f"Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
@@ -0,0 +1,297 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from telebot.apihelper import ApiTelegramException
+from urllib3.exceptions import NewConnectionError
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньше — важнее
+HIGH = 0  # объявления о победе
+NORMAL = 1
+LOW = 2  # обновления обратного отсчёта
+
+# Правки и удаления можно безопасно повторить после любой сетевой ошибки.
+# Отправку — нет: запрос мог дойти, и повтор продублирует сообщение
+IDEMPOTENT_PREFIXES = ("edit_", "delete_")
+
+
+# Ошибка, при которой запрос точно не ушёл в Telegram: не удалось установить соединение
+def _not_sent(error):
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], "reason", error.args[0]), NewConnectionError)
+    return False
+
+
+# Классическое ведро токенов: rate токенов в секунду, не больше capacity
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+        self.blocked_until = 0
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    # Через сколько секунд можно будет взять токен
+    def delay(self, now=None):
+        now = self._clock() if now is None else now
+        self._refill(now)
+        wait = 0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self, now=None):
+        now = self._clock() if now is None else now
+        self._refill(now)
+        self._tokens -= 1
+
+    def idle(self, now):
+        self._refill(now)
+        return self._tokens >= self.capacity and self.blocked_until <= now
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "chat_id", "method", "args", "kwargs", "coalesce_key", "futures", "attempts", "not_before", "cancelled")
+
+    def __init__(self, priority, seq, chat_id, method, args, kwargs, coalesce_key):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.coalesce_key = coalesce_key
+        self.futures = [Future()]
+        self.attempts = 0
+        self.not_before = 0
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+# Очередь исходящих запросов к Telegram: общий и початовые лимиты, приоритеты,
+# повторы с учётом retry_after и схлопывание правок одного сообщения.
+# Методы возвращают Future сразу; ждать результата нужно только там, где он нужен
+class Outbox:
+    def __init__(self, bot, global_rate=25, group_rate=20 / 60, group_burst=3, private_rate=1, private_burst=3,
+                 workers=8, max_retries=3, clock=time.monotonic):
+        self.bot = bot
+        self.max_retries = max_retries
+        self._clock = clock
+        self._global = TokenBucket(global_rate, global_rate, clock)
+        self._group_limits = (group_rate, group_burst)
+        self._private_limits = (private_rate, private_burst)
+        self._buckets = {}
+        self._queue = []
+        self._pending = {}  # coalesce_key -> ещё не отправленная задача
+        self._busy = set()  # чаты, по которым сейчас выполняется запрос
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="outbox")
+        self._thread = None
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+            self._thread.start()
+
+    def depth(self):
+        with self._cond:
+            return len(self._queue)
+
+    def submit(self, chat_id, method, args=(), kwargs=None, priority=NORMAL, coalesce_key=None):
+        kwargs = kwargs or {}
+        with self._cond:
+            job = self._pending.get(coalesce_key) if coalesce_key is not None else None
+            if job is not None:
+                # Запрос ещё в очереди: просто подменяем текст на самый свежий
+                job.method, job.args, job.kwargs = method, args, kwargs
+                future = Future()
+                job.futures.append(future)
+                self.coalesced += 1
+                if priority < job.priority:
+                    job.cancelled = True
+                    job = self._requeue(job, priority)
+                return future
+            job = _Job(priority, next(self._seq), chat_id, method, args, kwargs, coalesce_key)
+            heapq.heappush(self._queue, job)
+            if coalesce_key is not None:
+                self._pending[coalesce_key] = job
+            self._cond.notify()
+        self.start()
+        return job.futures[0]
+
+    def _requeue(self, job, priority):
+        new_job = _Job(priority, next(self._seq), job.chat_id, job.method, job.args, job.kwargs, job.coalesce_key)
+        new_job.futures = job.futures
+        heapq.heappush(self._queue, new_job)
+        if job.coalesce_key is not None:
+            self._pending[job.coalesce_key] = new_job
+        self._cond.notify()
+        return new_job
+
+    # Отмена неотправленных правок сообщения (например, перед его удалением)
+    def drop(self, coalesce_key):
+        with self._cond:
+            job = self._pending.pop(coalesce_key, None)
+            if job is not None:
+                job.cancelled = True
+                for future in job.futures:
+                    future.set_result(None)
+
+    # Отмена запроса, который ещё ждёт в очереди. False — запрос уже выполняется
+    # или выполнен, и его Future получит результат как обычно
+    def cancel(self, future):
+        with self._cond:
+            for job in self._queue:
+                if job.cancelled or future not in job.futures:
+                    continue
+                job.futures.remove(future)
+                if not job.futures:
+                    job.cancelled = True
+                    if job.coalesce_key is not None and self._pending.get(job.coalesce_key) is job:
+                        del self._pending[job.coalesce_key]
+                future.cancel()
+                return True
+            return False
+
+    def send_message(self, chat_id, text, priority=NORMAL, **kwargs):
+        return self.submit(chat_id, "send_message", (chat_id, text), kwargs, priority)
+
+    def send_photo(self, chat_id, photo, priority=NORMAL, **kwargs):
+        return self.submit(chat_id, "send_photo", (chat_id, photo), kwargs, priority)
+
+    def reply_to(self, message, text, priority=NORMAL, **kwargs):
+        return self.submit(message.chat.id, "reply_to", (message, text), kwargs, priority)
+
+    def edit_message_text(self, chat_id, message_id, text, priority=NORMAL, **kwargs):
+        return self.submit(chat_id, "edit_message_text", (text,), dict(kwargs, chat_id=chat_id, message_id=message_id),
+                           priority, coalesce_key=(chat_id, message_id))
+
+    def edit_message_caption(self, chat_id, message_id, caption, priority=NORMAL, **kwargs):
+        return self.submit(chat_id, "edit_message_caption", (caption,), dict(kwargs, chat_id=chat_id, message_id=message_id),
+                           priority, coalesce_key=(chat_id, message_id))
+
+    def delete_message(self, chat_id, message_id, priority=NORMAL):
+        self.drop((chat_id, message_id))
+        return self.submit(chat_id, "delete_message", (chat_id, message_id), priority=priority)
+
+    def delete_messages(self, chat_id, message_ids, priority=NORMAL):
+        return self.submit(chat_id, "delete_messages", (chat_id, list(message_ids)), priority=priority)
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                now = self._clock()
+                for key in [key for key, old in self._buckets.items() if old.idle(now)]:
+                    del self._buckets[key]
+            rate, burst = self._group_limits if chat_id < 0 else self._private_limits
+            bucket = self._buckets[chat_id] = TokenBucket(rate, burst, self._clock)
+        return bucket
+
+    # Выбор самой приоритетной задачи, чат которой свободен и не упёрся в лимит
+    def _next_job(self, now):
+        skipped = []
+        wait = None
+        job = None
+        while self._queue:
+            candidate = heapq.heappop(self._queue)
+            if candidate.cancelled:
+                continue
+            if candidate.chat_id in self._busy:
+                skipped.append(candidate)
+                continue
+            delay = max(candidate.not_before - now, self._bucket(candidate.chat_id).delay(now))
+            if delay > 0:
+                skipped.append(candidate)
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            job = candidate
+            break
+        for candidate in skipped:
+            heapq.heappush(self._queue, candidate)
+        return job, wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                now = self._clock()
+                global_delay = self._global.delay(now)
+                if global_delay > 0:
+                    self._cond.wait(global_delay)
+                    continue
+                job, wait = self._next_job(now)
+                if job is None:
+                    self._cond.wait(wait)
+                    continue
+                self._global.take(now)
+                self._bucket(job.chat_id).take(now)
+                self._busy.add(job.chat_id)
+                if job.coalesce_key is not None and self._pending.get(job.coalesce_key) is job:
+                    del self._pending[job.coalesce_key]
+            self._pool.submit(self._execute, job)
+
+    def _execute(self, job):
+        retry_after = None
+        try:
+            result = getattr(self.bot, job.method)(*job.args, **job.kwargs)
+        except ApiTelegramException as e:
+            if e.error_code == 429 and job.attempts < self.max_retries:
+                retry_after = (e.result_json.get("parameters") or {}).get("retry_after", 1)
+            else:
+                self._finish(job, error=e)
+        except Exception as e:
+            retryable = job.method.startswith(IDEMPOTENT_PREFIXES) or _not_sent(e)
+            if job.attempts < self.max_retries and retryable and not isinstance(e, (ValueError, TypeError)):
+                retry_after = 2 ** job.attempts
+            else:
+                self._finish(job, error=e)
+        else:
+            self._finish(job, result=result)
+        with self._cond:
+            self._busy.discard(job.chat_id)
+            if retry_after is not None:
+                logger.warning(f"Повтор {job.method} в чате {job.chat_id} через {retry_after} сек")
+                job.attempts += 1
+                job.not_before = self._clock() + retry_after
+                self._bucket(job.chat_id).blocked_until = job.not_before
+                if job.coalesce_key is not None and job.coalesce_key in self._pending:
+                    # За время запроса пришла более свежая правка, старую не повторяем
+                    self._pending[job.coalesce_key].futures.extend(job.futures)
+                else:
+                    heapq.heappush(self._queue, job)
+                    if job.coalesce_key is not None:
+                        self._pending[job.coalesce_key] = job
+            self._cond.notify()
+
+    def _finish(self, job, result=None, error=None):
+        if error is None:
+            self.sent += 1
+        else:
+            self.failed += 1
+            logger.error(f"Ошибка {job.method} в чате {job.chat_id}: {error}")
+        for future in job.futures:
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
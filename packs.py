@@ -0,0 +1,275 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+import stats
+
+logger = logging.getLogger(__name__)
+
+# Поля загадки в паке: заголовки CSV и ключи объектов JSON
+FIELDS = ("chat_id", "riddle_text", "answer", "prize", "photo_id", "time_limit", "hint", "hint_delay", "post_at")
+REQUIRED = ("chat_id", "riddle_text", "answer")
+FORMATS = ("csv", "json", "jsonl")
+MAX_TIME_LIMIT = 1440
+MAX_TEXT = 3500  # Текст и приз вместе, с запасом до лимита сообщения 4096
+MAX_CAPTION = 900  # То же для загадки с фото: лимит подписи 1024
+INSERT_CHUNK = 500
+MAX_ERRORS = 20
+
+
+class PackError(ValueError):
+    pass
+
+
+def create_table(db):
+    db.execute('''CREATE TABLE IF NOT EXISTS riddle_queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    chat_id INTEGER,
+                    riddle_text TEXT,
+                    answer TEXT,
+                    prize TEXT,
+                    photo_id TEXT,
+                    time_limit INTEGER,
+                    hint TEXT,
+                    hint_delay INTEGER,
+                    post_at INTEGER,
+                    status TEXT DEFAULT 'pending',
+                    riddle_id INTEGER,
+                    error TEXT,
+                    created_at INTEGER)''')
+    # Планировщик публикаций выбирает только ждущие записи по времени
+    db.execute("CREATE INDEX IF NOT EXISTS idx_riddle_queue_due ON riddle_queue (post_at) WHERE status = 'pending'")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_riddle_queue_user ON riddle_queue (user_id, status)")
+
+
+def detect_format(filename):
+    extension = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    if extension not in FORMATS:
+        raise PackError(f"Неизвестный формат файла: нужен {', '.join('.' + fmt for fmt in FORMATS)}")
+    return extension
+
+
+# Строки пака по одной: (номер строки или записи, словарь полей).
+# CSV и JSON Lines читаются потоково; JSON — массив или {"riddles": [...]}
+def read_pack(stream, fmt):
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == "jsonl":
+        for number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                yield number, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield number, PackError(f"некорректный JSON: {e.msg}")
+    elif fmt == "json":
+        try:
+            document = json.load(stream)
+        except json.JSONDecodeError as e:
+            raise PackError(f"Некорректный JSON (строка {e.lineno}): {e.msg}")
+        riddles = document.get("riddles") if isinstance(document, dict) else document
+        if not isinstance(riddles, list):
+            raise PackError("Ожидается массив загадок или объект с ключом \"riddles\"")
+        yield from enumerate(riddles, 1)
+    else:
+        raise PackError(f"Неизвестный формат пака: {fmt}")
+
+
+def _text(row, name):
+    value = row.get(name)
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _integer(row, name, minimum=None, maximum=None):
+    value = _text(row, name)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        raise PackError(f"{name}: ожидается целое число, получено {value!r}")
+    if minimum is not None and value < minimum or maximum is not None and value > maximum:
+        raise PackError(f"{name}: допустимо от {minimum} до {maximum}, получено {value}")
+    return value
+
+
+# Время публикации: unix-время или дата "ГГГГ-ММ-ДД ЧЧ:ММ" по местному времени сервера;
+# пустое значение — опубликовать сразу
+def _post_at(row, now):
+    value = _text(row, "post_at")
+    if value is None:
+        return now
+    if value.isdigit():
+        return int(value)
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except ValueError:
+        raise PackError(f"post_at: ожидается unix-время или ГГГГ-ММ-ДД ЧЧ:ММ, получено {value!r}")
+
+
+# Проверка и приведение одной загадки пака; ошибки — PackError с описанием
+def validate(row, now):
+    if isinstance(row, PackError):
+        raise row
+    if not isinstance(row, dict):
+        raise PackError("запись должна быть объектом")
+    unknown = set(row) - set(FIELDS)
+    if unknown:
+        raise PackError(f"неизвестные поля: {', '.join(sorted(map(str, unknown)))}")
+    missing = [name for name in REQUIRED if _text(row, name) is None]
+    if missing:
+        raise PackError(f"не заполнены поля: {', '.join(missing)}")
+    riddle = {
+        "chat_id": _integer(row, "chat_id"),
+        "riddle_text": _text(row, "riddle_text"),
+        "answer": _text(row, "answer"),
+        "prize": _text(row, "prize"),
+        "photo_id": _text(row, "photo_id"),
+        "time_limit": _integer(row, "time_limit", 1, MAX_TIME_LIMIT),
+        "hint": _text(row, "hint"),
+        "hint_delay": _integer(row, "hint_delay", 0, MAX_TIME_LIMIT),
+        "post_at": _post_at(row, now),
+    }
+    limit = MAX_CAPTION if riddle["photo_id"] else MAX_TEXT
+    if len(riddle["riddle_text"]) + len(riddle["prize"] or "") > limit:
+        raise PackError(f"текст загадки с призом длиннее {limit} символов")
+    return riddle
+
+
+# Импорт пака одной транзакцией: строки вставляются пачками по мере разбора,
+# при любой ошибке вся транзакция откатывается. can_post(chat_id) решает,
+# можно ли автору публиковать в чат; вызывается под открытой транзакцией,
+# поэтому права собираются заранее. Возвращает (число загадок, ошибки)
+def import_pack(db, user_id, stream, fmt, can_post, now=None, max_riddles=None):
+    now = int(now if now is not None else time.time())
+    errors = []
+    count = 0
+    allowed = {}
+    chunk = []
+
+    def flush():
+        db.executemany("INSERT INTO riddle_queue (user_id, chat_id, riddle_text, answer, prize, photo_id, time_limit, hint, "
+                       "hint_delay, post_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", chunk)
+        chunk.clear()
+
+    try:
+        with db.transaction():
+            for number, row in read_pack(stream, fmt):
+                try:
+                    riddle = validate(row, now)
+                    chat_id = riddle["chat_id"]
+                    if chat_id not in allowed:
+                        allowed[chat_id] = can_post(chat_id)
+                    if not allowed[chat_id]:
+                        raise PackError(f"нет прав на публикацию в чат {chat_id}")
+                except PackError as e:
+                    errors.append(f"{number}: {e}")
+                    if len(errors) >= MAX_ERRORS:
+                        break
+                    continue
+                count += 1
+                if max_riddles is not None and count > max_riddles:
+                    errors.append(f"в паке больше {max_riddles} загадок")
+                    break
+                if not errors:
+                    chunk.append((user_id, *(riddle[name] for name in FIELDS), now))
+                    if len(chunk) >= INSERT_CHUNK:
+                        flush()
+            if errors:
+                raise PackError("пак отклонён")
+            if chunk:
+                flush()
+            stats.increment(db, riddles_created=count)
+    except PackError as e:
+        if not errors:
+            errors.append(str(e))
+        return 0, errors
+    logger.info(f"Пользователь {user_id} импортировал пак из {count} загадок")
+    return count, errors
+
+
+# Очередь запланированных публикаций. Запись проходит статусы
+# pending -> posting -> posted (или failed); захват — UPDATE по статусу,
+# поэтому одну запись не опубликуют два процесса
+class RiddleQueue:
+    def __init__(self, db):
+        self.db = db
+
+    # Наступившие публикации: (id, chat_id) в порядке времени
+    def due(self, now=None):
+        now = int(now if now is not None else time.time())
+        return self.db.execute("SELECT id, chat_id FROM riddle_queue WHERE status = 'pending' AND post_at <= ? "
+                               "ORDER BY post_at, id", (now,)).fetchall()
+
+    def claim(self, queue_id):
+        if not self.db.execute("UPDATE riddle_queue SET status = 'posting' WHERE id = ? AND status = 'pending'",
+                               (queue_id,)).rowcount:
+            return None
+        row = self.db.execute(f"SELECT user_id, {', '.join(FIELDS)} FROM riddle_queue WHERE id = ?", (queue_id,)).fetchone()
+        return dict(zip(("user_id",) + FIELDS, row))
+
+    def posted(self, queue_id, riddle_id):
+        self.db.execute("UPDATE riddle_queue SET status = 'posted', riddle_id = ? WHERE id = ?", (riddle_id, queue_id))
+
+    def failed(self, queue_id, error):
+        self.db.execute("UPDATE riddle_queue SET status = 'failed', error = ? WHERE id = ?", (str(error)[:500], queue_id))
+
+    # Записи, захваченные до перезапуска: сообщение могло уйти, поэтому повторно
+    # не публикуем, а помечаем ошибкой. owns_chat ограничивает их своими чатами
+    def recover(self, owns_chat=None):
+        rows = self.db.execute("SELECT id, chat_id FROM riddle_queue WHERE status = 'posting'").fetchall()
+        stale = [(queue_id,) for queue_id, chat_id in rows if owns_chat is None or owns_chat(chat_id)]
+        self.db.executemany("UPDATE riddle_queue SET status = 'failed', error = 'прервано перезапуском' "
+                            "WHERE id = ? AND status = 'posting'", stale)
+        return len(stale)
+
+    # Сводка очереди автора: {статус: (число, ближайшее время публикации)}
+    def summary(self, user_id):
+        rows = self.db.execute("SELECT status, COUNT(*), MIN(post_at) FROM riddle_queue WHERE user_id = ? GROUP BY status",
+                               (user_id,)).fetchall()
+        return {status: (count, first) for status, count, first in rows}
+
+    def cancel(self, user_id):
+        return self.db.execute("DELETE FROM riddle_queue WHERE user_id = ? AND status = 'pending'", (user_id,)).rowcount
+
+
+# Импорт из командной строки в базу бота; запущенный бот подхватит очередь сам.
+# Права не проверяются, только то, что бот есть в чате
+def main():
+    parser = argparse.ArgumentParser(description="Импорт пака загадок в очередь публикаций")
+    parser.add_argument("path", help="файл .csv, .json или .jsonl")
+    parser.add_argument("--user", type=int, required=True, help="user_id автора загадок")
+    parser.add_argument("--db", default=os.getenv("DB_PATH", "riddle_bot.db"))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    import schema
+    from storage import Database
+
+    db = Database(args.db)
+    schema.migrate(db)
+    known = {row[0] for row in db.execute("SELECT chat_id FROM chats")}
+    try:
+        fmt = detect_format(args.path)
+    except PackError as e:
+        parser.error(str(e))
+    with open(args.path, encoding="utf-8-sig", newline="") as stream:
+        count, errors = import_pack(db, args.user, stream, fmt, known.__contains__)
+    for error in errors:
+        print(error)
+    print(f"Поставлено в очередь загадок: {count}")
+    raise SystemExit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
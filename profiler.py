@@ -0,0 +1,93 @@
+import collections
+import logging
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# Модули, в которых поток стоит в ожидании (очередь, блокировка, сокет), а не работает
+IDLE_FILES = ("threading.py", "queue.py", "selectors.py", "socket.py", "socketserver.py", "ssl.py")
+
+
+# Выборочный профайлер: раз в interval секунд снимает стеки всех потоков
+# через sys._current_frames() и считает одинаковые. Пока не запущен, ничего не стоит.
+# Простаивающие потоки пропускаются, доли считаются от рабочих выборок.
+# Результат — "свёрнутые" стеки (кадры через ;), их понимает flamegraph.pl
+class SamplingProfiler:
+    def __init__(self, interval=0.005, max_depth=40):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._stacks = collections.Counter()
+        self._samples = 0
+        self._lock = threading.Lock()
+        self._stop = None
+        self._thread = None
+        self._busy = 0
+        self._ignored = set()  # потоки, которые не профилируем (тот, что ждёт результата)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._stacks.clear()
+            self._samples = 0
+            self._busy = 0
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop,), name="profiler", daemon=True)
+            self._thread.start()
+        logger.info("Профайлер запущен")
+        return True
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return
+            self._stop.set()
+        thread.join()
+        logger.info("Профайлер остановлен")
+
+    def _run(self, stop):
+        own = threading.get_ident()
+        while not stop.wait(self.interval):
+            frames = sys._current_frames()
+            stacks = []
+            for thread_id, frame in frames.items():
+                if thread_id == own or thread_id in self._ignored:
+                    continue
+                if frame.f_code.co_filename.endswith(IDLE_FILES):
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stacks.append(";".join(reversed(stack)))
+            with self._lock:
+                self._stacks.update(stacks)
+                self._samples += 1
+                self._busy += len(stacks)
+
+    # Самые частые стеки: число попаданий, доля среди рабочих стеков и свёрнутый стек
+    def dump(self, top=30):
+        with self._lock:
+            samples, busy = self._samples, self._busy
+            common = self._stacks.most_common(top)
+        lines = [f"# выборок: {samples}, рабочих стеков: {busy}, интервал {self.interval * 1000:.1f} мс"]
+        lines += [f"{count} {count / busy:.1%} {stack}" for stack, count in common] if busy else []
+        return "\n".join(lines) + "\n"
+
+    # Профилирование на seconds секунд с возвратом горячих стеков
+    def profile(self, seconds, top=30):
+        if not self.start():
+            return "# профайлер уже запущен\n"
+        caller = threading.get_ident()
+        self._ignored.add(caller)
+        try:
+            time.sleep(seconds)
+        finally:
+            self._ignored.discard(caller)
+            self.stop()
+        return self.dump(top)
@@ -0,0 +1,133 @@
+import functools
+import re
+
+from telebot import types
+
+# Готовые клавиатуры и тексты интерфейса. Статические клавиатуры сериализуются
+# в JSON один раз при импорте; клавиатуры, которые отличаются только draft_id,
+# собираются из одного шаблона подстановкой id в готовую строку
+
+_MARKDOWN_SPECIAL = re.compile(r"([_*`\[])")
+_ID = "__DRAFT_ID__"  # Метка на месте id в шаблоне; в JSON не экранируется
+
+
+# Экранирование пользовательского текста для parse_mode="Markdown" (старый вариант
+# разметки: спецсимволы только _ * ` [). Без него "_" в тексте ломает всё сообщение
+def escape_markdown(text):
+    return _MARKDOWN_SPECIAL.sub(r"\\\1", text or "")
+
+
+# Разметка, уже сериализованная в JSON; telebot отправляет её как есть
+class PreparedMarkup(types.JsonSerializable):
+    __slots__ = ("_json",)
+
+    def __init__(self, json_text):
+        self._json = json_text
+
+    def to_json(self):
+        return self._json
+
+
+def _inline(*rows):
+    markup = types.InlineKeyboardMarkup()
+    for text, data in rows:
+        markup.add(types.InlineKeyboardButton(text, callback_data=data))
+    return markup
+
+
+# Клавиатура, в callback_data которой меняется только id черновика
+class MarkupTemplate:
+    __slots__ = ("_json",)
+
+    def __init__(self, *rows):
+        self._json = _inline(*rows).to_json()
+
+    def render(self, draft_id):
+        return PreparedMarkup(self._json.replace(_ID, str(int(draft_id))))
+
+
+def _reply_keyboard():
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    markup.add(MENU_ADD_TO_CHAT, MENU_CHATS)
+    markup.add(MENU_STATS, MENU_HELP)
+    return markup
+
+
+MENU_ADD_TO_CHAT = "➕ Добавить в чат"
+MENU_CHATS = "📜 Список чатов"
+MENU_STATS = "📊 Статистика бота"
+MENU_HELP = "ℹ️ Как пользоваться"
+MENU_BUTTONS = frozenset((MENU_ADD_TO_CHAT, MENU_CHATS, MENU_STATS, MENU_HELP))
+
+CANCEL_BUTTON = ("❌ Отменить", "cancel")
+
+MAIN_MENU = PreparedMarkup(_reply_keyboard().to_json())
+CANCEL = PreparedMarkup(_inline(CANCEL_BUTTON).to_json())
+CANCEL_CREATION = PreparedMarkup(_inline(("❌ Отменить создание", "cancel")).to_json())
+STATS_MENU = PreparedMarkup(_inline(("📈 Общая статистика", "stats_global"),
+                                    ("👥 Чаты и участники", "stats_chats_users")).to_json())
+
+PHOTO_SKIP = MarkupTemplate(("⏩ Пропустить", f"photo_skip_{_ID}"), CANCEL_BUTTON)
+TIMER_CHOICE = MarkupTemplate(("⏳ Задать время", f"time_set_{_ID}"), ("⏰ Без таймера", f"time_none_{_ID}"), CANCEL_BUTTON)
+HINT_CHOICE = MarkupTemplate(("💡 Добавить подсказку", f"hint_add_{_ID}"), ("⏩ Пропустить", f"hint_skip_{_ID}"), CANCEL_BUTTON)
+PREVIEW = MarkupTemplate(("✅ Отправить в чат", f"send_{_ID}"), CANCEL_BUTTON)
+
+
+# Кнопка приглашения в группу; имя бота известно только после getMe
+@functools.lru_cache(maxsize=1)
+def add_to_chat_markup(bot_username):
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("✨ Добавить в группу", url=f"https://t.me/{bot_username}?startgroup=true"))
+    return PreparedMarkup(markup.to_json())
+
+
+INSTRUCTION = (
+    "✨ *Как пользоваться ботом-загадочником?* ✨\n\n"
+    "👇 *Простая инструкция:*\n"
+    "  1. *Добавь меня в чат* ➕ Нажми 'Добавить в чат', выбери группу и дай мне права админа.\n"
+    "  2. *Создай загадку* 🧩 В ЛС выбери 'Список чатов', затем чат, введи текст, ответ и приз.\n"
+    "  3. *Настрой время и подсказку* ⏳ Укажи таймер (или пропусти) и добавь подсказку (по желанию).\n"
+    "  4. *Жди отгадок* 🎉 Участники будут отвечать, а ты узнаешь, кто победил!\n\n"
+    "🎯 *Команды в чате:*\n"
+    "  - `/riddlekings` — топ отгадчиков здесь\n\n"
+    "🏆 *Рейтинг и статистика:*\n"
+    "  - В ЛС: `/top_all` — общий топ\n"
+    "  - '📊 Статистика бота' — все успехи!\n\n"
+    "📦 *Много загадок сразу:* пришли мне в ЛС файл .csv, .json или .jsonl с полями "
+    "`chat_id`, `riddle_text`, `answer` и по желанию `prize`, `time_limit`, `hint`, `hint_delay`, `photo_id`, "
+    "`post_at` (когда опубликовать: `2026-01-31 09:00`). Очередь — `/queue`, отмена — `/queue_clear`\n\n"
+    "💡 *Подсказки:* появляются через 80% времени (если таймер есть) или через заданную задержку (если таймера нет).\n\n"
+    "🎉 Готово! Загадывай и отгадывай! Если что-то неясно, пиши мне в ЛС! 🚀"
+)
+
+
+# Тексты сообщений загадки. riddle_text и prize сюда приходят уже экранированными:
+# их экранируют один раз при публикации или восстановлении загадки
+# Загадки из паков могут быть без приза: тогда блока приза нет
+def riddle_head(riddle_text, prize):
+    if not prize:
+        return f"🚨 *ЗАГАДКА!* 🚨\n\n{riddle_text}\n\n"
+    return f"🚨 *ЗАГАДКА!* 🚨\n\n{riddle_text}\n\n🎁 *ПРИЗ:*\n{prize}\n\n"
+
+
+def riddle_message(head, time_limit):
+    text = head + "💬 *Как ответить?* Реплай на это сообщение своим ответом!"
+    if time_limit:
+        text += f"\n\n⏰ *Время:* {time_limit} мин"
+    return text
+
+
+def countdown_message(head, label):
+    return f"{head}⏰ *Осталось:* {label}\n\n💬 *Как ответить?* Реплай на это сообщение своим ответом!"
+
+
+def expired_message(riddle_text):
+    return f"⏰ *Время вышло!* ⏰\n\n{riddle_text}\n\n*К сожалению, никто не угадал...* 😔\nЗагадка завершена."
+
+
+def wrong_guesses_message(count):
+    return f"❌ *Пока мимо!* ❌\n\nНеверных ответов: {count}. Пробуйте ещё! 😉"
+
+
+def top_lines(top_users):
+    return "".join(f"{i}. @{escape_markdown(username)} — {points} очков 🌟\n" for i, (username, points) in enumerate(top_users, 1))
@@ -0,0 +1,74 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DELETE_CHUNK = 100  # Максимум сообщений в одном deleteMessages
+
+
+def create_table(db):
+    db.execute('''CREATE TABLE IF NOT EXISTS riddle_replies (
+                    riddle_id INTEGER,
+                    chat_id INTEGER,
+                    message_id INTEGER,
+                    PRIMARY KEY (riddle_id, message_id))''')
+
+
+# Ответы бота на неверные догадки, сгруппированные по загадкам.
+# Хранятся в SQLite, чтобы пережить перезапуск; на одну загадку держим не больше
+# max_per_riddle записей — при переполнении старая половина удаляется из чата сразу
+class ReplyStore:
+    def __init__(self, db, outbox, max_per_riddle=200):
+        self.db = db
+        self.outbox = outbox
+        self.max_per_riddle = max_per_riddle
+        self._counts = {}  # riddle_id -> число сохранённых ответов (только для живых загадок)
+        self._lock = threading.Lock()
+
+    def add(self, riddle_id, chat_id, message_id):
+        self.db.execute("INSERT OR IGNORE INTO riddle_replies (riddle_id, chat_id, message_id) VALUES (?, ?, ?)",
+                        (riddle_id, chat_id, message_id))
+        with self._lock:
+            count = self._counts.get(riddle_id)
+            if count is None:
+                count = self.db.execute("SELECT COUNT(*) FROM riddle_replies WHERE riddle_id = ?", (riddle_id,)).fetchone()[0]
+            else:
+                count += 1
+            self._counts[riddle_id] = count
+            overflow = count > self.max_per_riddle
+        if overflow:
+            self._flush(riddle_id, limit=self.max_per_riddle // 2)
+
+    # Удаление всех сохранённых ответов загадки из чата и из базы
+    def cleanup(self, riddle_id):
+        with self._lock:
+            self._counts.pop(riddle_id, None)
+        self._flush(riddle_id)
+
+    # Загадки, которые завершились, пока бот был выключен, но их ответы остались.
+    # owns_chat(chat_id) ограничивает уборку чатами своего шарда
+    def cleanup_finished(self, owns_chat=None):
+        rows = self.db.execute("SELECT DISTINCT riddle_id, chat_id FROM riddle_replies WHERE riddle_id NOT IN "
+                               "(SELECT id FROM riddles WHERE active = 1)").fetchall()
+        for riddle_id, chat_id in rows:
+            if owns_chat is None or owns_chat(chat_id):
+                self.cleanup(riddle_id)
+
+    def _flush(self, riddle_id, limit=-1):
+        with self.db.transaction():
+            rows = self.db.execute("SELECT chat_id, message_id FROM riddle_replies WHERE riddle_id = ? "
+                                   "ORDER BY message_id LIMIT ?", (riddle_id, limit)).fetchall()
+            self.db.executemany("DELETE FROM riddle_replies WHERE riddle_id = ? AND message_id = ?",
+                                [(riddle_id, message_id) for _, message_id in rows])
+        if limit >= 0:
+            with self._lock:
+                if riddle_id in self._counts:
+                    self._counts[riddle_id] -= len(rows)
+        by_chat = {}
+        for chat_id, message_id in rows:
+            by_chat.setdefault(chat_id, []).append(message_id)
+        for chat_id, message_ids in by_chat.items():
+            for i in range(0, len(message_ids), DELETE_CHUNK):
+                self.outbox.delete_messages(chat_id, message_ids[i:i + DELETE_CHUNK])
+        if rows:
+            logger.info(f"Удаление {len(rows)} ответов на неверные догадки к загадке {riddle_id} поставлено в очередь")
@@ -0,0 +1,134 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Состояния загадки в riddles.state. active = 1 ровно у состояния live:
+# горячие запросы по-прежнему идут по частичному индексу WHERE active = 1
+DRAFT, LIVE, SOLVED, EXPIRED, DROPPED = "draft", "live", "solved", "expired", "dropped"
+
+# Столбцы, переносимые в архив
+COLUMNS = ("id", "chat_id", "user_id", "riddle_text", "answer", "prize", "time_limit", "message_id", "end_time",
+           "hint", "hint_delay", "start_time", "photo_id", "state")
+
+
+def create_table(db):
+    if "state" not in {row[1] for row in db.execute("PRAGMA table_info(riddles)")}:
+        db.execute(f"ALTER TABLE riddles ADD COLUMN state TEXT DEFAULT '{LIVE}'")
+    db.execute('''CREATE TABLE IF NOT EXISTS riddles_archive (
+                    id INTEGER PRIMARY KEY,
+                    chat_id INTEGER,
+                    user_id INTEGER,
+                    riddle_text TEXT,
+                    answer TEXT,
+                    prize TEXT,
+                    time_limit INTEGER,
+                    message_id INTEGER,
+                    end_time INTEGER,
+                    hint TEXT,
+                    hint_delay INTEGER,
+                    start_time INTEGER,
+                    photo_id TEXT,
+                    state TEXT,
+                    archived_at INTEGER)''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_riddles_archive_archived ON riddles_archive (archived_at)")
+    # Переносчик выбирает завершённые загадки по времени окончания
+    db.execute("CREATE INDEX IF NOT EXISTS idx_riddles_finished ON riddles (end_time) WHERE active = 0")
+    # Загадки больше не ищутся по автору: черновики живут в таблице drafts
+    db.execute("DROP INDEX IF EXISTS idx_riddles_user_active")
+
+
+# Состояние уже накопленных загадок. Строки без message_id — черновики старого
+# мастера: продолжить их нельзя, они уходят в архив вместе с завершёнными.
+# Истёкшая загадка отличается от отгаданной так же, как в stats.rebuild
+def backfill_state(db):
+    db.execute(f'''UPDATE riddles SET state = CASE
+                       WHEN message_id IS NULL THEN '{DRAFT}'
+                       WHEN active = 1 THEN '{LIVE}'
+                       WHEN time_limit IS NOT NULL AND end_time >= start_time + time_limit * 60 THEN '{EXPIRED}'
+                       ELSE '{SOLVED}' END''')
+    db.execute(f"UPDATE riddles SET active = 0 WHERE state = '{DRAFT}'")
+
+
+# Перевод базы на auto_vacuum = INCREMENTAL. Режим меняется только полным VACUUM,
+# поэтому это делается один раз при запуске, до рабочих потоков
+def enable_incremental_vacuum(db):
+    if db.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return False
+    started = time.monotonic()
+    db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    db.execute("VACUUM")
+    logger.info(f"База переведена на инкрементальный VACUUM за {time.monotonic() - started:.1f} с")
+    return True
+
+
+# Фоновое обслуживание базы: завершённые загадки переезжают в riddles_archive
+# небольшими транзакциями, старый архив, брошенные черновики и отработанная
+# очередь публикаций удаляются, освободившиеся страницы возвращаются системе.
+# keep_archive_days = 0 — архив не чистится
+class Retention:
+    def __init__(self, db, archive_after=3600, keep_archive_days=365, draft_ttl=7 * 86400, batch_size=500,
+                 pause=0.05, vacuum_pages=2000, clock=time.time):
+        self.db = db
+        self.archive_after = archive_after
+        self.keep_archive_days = keep_archive_days
+        self.draft_ttl = draft_ttl
+        self.batch_size = batch_size
+        self.pause = pause  # Пауза между пачками, чтобы не занимать блокировку записи подряд
+        self.vacuum_pages = vacuum_pages
+        self.clock = clock
+
+    def run(self):
+        archived = self.archive_finished()
+        pruned = self.prune()
+        freed = self.vacuum()
+        if archived or pruned or freed:
+            logger.info(f"Обслуживание базы: в архив {archived}, удалено {pruned}, освобождено страниц {freed}")
+        return archived, pruned, freed
+
+    def archive_finished(self):
+        cutoff = int(self.clock()) - self.archive_after
+        columns = ", ".join(COLUMNS)
+        total = 0
+        while True:
+            with self.db.transaction():
+                ids = [row[0] for row in self.db.execute("SELECT id FROM riddles WHERE active = 0 AND (end_time IS NULL OR end_time < ?) "
+                                                         "LIMIT ?", (cutoff, self.batch_size))]
+                if not ids:
+                    return total
+                placeholders = ",".join("?" * len(ids))
+                self.db.execute(f"INSERT OR REPLACE INTO riddles_archive ({columns}, archived_at) "
+                                f"SELECT {columns}, ? FROM riddles WHERE id IN ({placeholders})", (int(self.clock()), *ids))
+                self.db.execute(f"DELETE FROM riddles WHERE id IN ({placeholders})", ids)
+            total += len(ids)
+            time.sleep(self.pause)
+
+    def prune(self):
+        now = int(self.clock())
+        total = 0
+        if self.keep_archive_days:
+            total += self._delete_batches("riddles_archive", "archived_at < ?", now - self.keep_archive_days * 86400)
+        total += self._delete_batches("drafts", "updated_at < ?", now - self.draft_ttl)
+        total += self._delete_batches("riddle_queue", "status IN ('posted', 'failed') AND post_at < ?", now - self.draft_ttl)
+        return total
+
+    def _delete_batches(self, table, condition, *params):
+        total = 0
+        while True:
+            deleted = self.db.execute(f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE {condition} LIMIT ?)",
+                                      (*params, self.batch_size)).rowcount
+            total += deleted
+            if deleted < self.batch_size:
+                return total
+            time.sleep(self.pause)
+
+    # Возврат свободных страниц файлу: не больше vacuum_pages за проход
+    def vacuum(self):
+        if self.db.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        free = self.db.execute("PRAGMA freelist_count").fetchone()[0]
+        if not free:
+            return 0
+        # execute() делает один шаг прагмы и освобождает одну страницу; executescript доводит до конца
+        self.db.connection().executescript(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)})")
+        return free - self.db.execute("PRAGMA freelist_count").fetchone()[0]
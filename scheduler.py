@@ -0,0 +1,111 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# Общий планировщик таймеров: одна куча по дедлайнам и один рабочий поток
+# на все загадки вместо отдельного потока на каждую
+class TimerScheduler:
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._heap = []
+        self._entries = {}  # (group, kind) -> запись в куче
+        self._groups = {}  # group -> множество kind
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    # Запуск рабочего потока (повторный вызов ничего не делает)
+    def start(self):
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name="timer-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    # Запланировать callback(*args) на момент when; запись с тем же (group, kind) заменяется
+    def schedule(self, group, kind, when, callback, *args):
+        with self._cond:
+            self._discard(group, kind)
+            entry = [when, next(self._counter), group, kind, callback, args, True]
+            heapq.heappush(self._heap, entry)
+            self._entries[(group, kind)] = entry
+            self._groups.setdefault(group, set()).add(kind)
+            # Будим поток, только если новая запись стала ближайшей
+            if self._heap[0] is entry:
+                self._cond.notify()
+        self.start()
+
+    def cancel(self, group, kind):
+        with self._cond:
+            return self._discard(group, kind)
+
+    # Отмена всех таймеров группы (например, всех таймеров одной загадки)
+    def cancel_group(self, group):
+        with self._cond:
+            kinds = list(self._groups.get(group, ()))
+            for kind in kinds:
+                self._discard(group, kind)
+            return len(kinds)
+
+    def pending(self, group=None):
+        with self._cond:
+            if group is None:
+                return len(self._entries)
+            return len(self._groups.get(group, ()))
+
+    def _discard(self, group, kind):
+        entry = self._entries.pop((group, kind), None)
+        if entry is None:
+            return False
+        # Ленивое удаление: запись остаётся в куче, но помечается отменённой
+        entry[-1] = False
+        kinds = self._groups.get(group)
+        if kinds is not None:
+            kinds.discard(kind)
+            if not kinds:
+                del self._groups[group]
+        return True
+
+    def _pop_due(self):
+        with self._cond:
+            while True:
+                if self._stopped:
+                    return None
+                while self._heap and not self._heap[0][-1]:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                delay = self._heap[0][0] - self._clock()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                entry = heapq.heappop(self._heap)
+                self._discard(entry[2], entry[3])
+                return entry
+
+    def _run(self):
+        while True:
+            entry = self._pop_due()
+            if entry is None:
+                return
+            _, _, group, kind, callback, args, _ = entry
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.error(f"Ошибка таймера {kind} для {group}: {e}")
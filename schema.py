@@ -0,0 +1,127 @@
+import logging
+
+import drafts
+import packs
+import replies
+import retention
+import stats
+
+logger = logging.getLogger(__name__)
+
+
+def _columns(db, table):
+    return {row[1] for row in db.execute(f"PRAGMA table_info({table})")}
+
+
+# v1: базовые таблицы; для баз, созданных старыми версиями бота,
+# дописываем недостающие столбцы
+def _v1_base_tables(db):
+    db.execute('''CREATE TABLE IF NOT EXISTS users (
+                    user_id INTEGER PRIMARY KEY,
+                    username TEXT)''')
+    db.execute('''CREATE TABLE IF NOT EXISTS chats (
+                    chat_id INTEGER PRIMARY KEY,
+                    title TEXT,
+                    members_count INTEGER,
+                    updated_at INTEGER)''')
+    db.execute('''CREATE TABLE IF NOT EXISTS riddles (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chat_id INTEGER,
+                    user_id INTEGER,
+                    riddle_text TEXT,
+                    answer TEXT,
+                    prize TEXT,
+                    time_limit INTEGER,
+                    message_id INTEGER,
+                    active INTEGER DEFAULT 1,
+                    end_time INTEGER,
+                    hint TEXT,
+                    hint_delay INTEGER,
+                    start_time INTEGER,
+                    photo_id TEXT)''')
+    db.execute('''CREATE TABLE IF NOT EXISTS scores (
+                    user_id INTEGER,
+                    chat_id INTEGER,
+                    points INTEGER DEFAULT 0,
+                    PRIMARY KEY (user_id, chat_id))''')
+
+    legacy_columns = {
+        "riddles": [("end_time", "INTEGER"), ("hint", "TEXT"), ("hint_delay", "INTEGER"),
+                    ("start_time", "INTEGER"), ("photo_id", "TEXT")],
+        "chats": [("updated_at", "INTEGER")],
+    }
+    for table, columns in legacy_columns.items():
+        existing = _columns(db, table)
+        for name, column_type in columns:
+            if name not in existing:
+                db.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+                logger.info(f"Столбец {name} добавлен в таблицу {table}")
+
+
+# v2: индексы под горячие запросы
+def _v2_indexes(db):
+    db.execute("DROP INDEX IF EXISTS idx_riddles_active")
+    # check_answer, подсчёт активных загадок по чатам и восстановление таймеров
+    db.execute("CREATE INDEX IF NOT EXISTS idx_riddles_live ON riddles (chat_id, message_id) WHERE active = 1")
+    # cancel_riddle: черновики пользователя
+    db.execute("CREATE INDEX IF NOT EXISTS idx_riddles_user_active ON riddles (user_id, active)")
+    # top_chat: топ чата без сортировки всей таблицы
+    db.execute("CREATE INDEX IF NOT EXISTS idx_scores_chat_points ON scores (chat_id, points DESC, user_id)")
+
+
+# v3: таблица счётчиков статистики, заполненная по уже накопленной истории
+def _v3_stats(db):
+    stats.create_table(db)
+    stats.rebuild(db)
+
+
+# v4: ответы бота на неверные догадки, привязанные к загадке
+def _v4_riddle_replies(db):
+    replies.create_table(db)
+
+
+# v5: черновики мастера создания загадок (раньше жили в памяти процесса)
+def _v5_drafts(db):
+    drafts.create_table(db)
+
+
+# v6: очередь публикаций загадок из импортированных паков
+def _v6_riddle_queue(db):
+    packs.create_table(db)
+
+
+# v7: явное состояние загадки и архив завершённых
+def _v7_retention(db):
+    retention.create_table(db)
+    retention.backfill_state(db)
+
+
+# v8: подхват новых загадок шардами (adopt_riddles) идёт по id
+# среди живых опубликованных, без сканирования всей таблицы
+def _v8_adopt_index(db):
+    db.execute("CREATE INDEX IF NOT EXISTS idx_riddles_adopt ON riddles (id) WHERE active = 1 AND message_id IS NOT NULL")
+
+
+# Порядок важен: номер версии схемы = позиция шага в списке
+MIGRATIONS = [
+    _v1_base_tables,
+    _v2_indexes,
+    _v3_stats,
+    _v4_riddle_replies,
+    _v5_drafts,
+    _v6_riddle_queue,
+    _v7_retention,
+    _v8_adopt_index,
+]
+
+
+# Применение недостающих миграций по PRAGMA user_version
+def migrate(db):
+    version = db.execute("PRAGMA user_version").fetchone()[0]
+    for target, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        with db.transaction():
+            step(db)
+            db.execute(f"PRAGMA user_version = {target}")
+        logger.info(f"Схема базы обновлена до версии {target}")
+    db.execute("PRAGMA optimize")
+    return len(MIGRATIONS)
@@ -0,0 +1,134 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+import zlib
+
+from telebot import apihelper, types
+
+logger = logging.getLogger(__name__)
+
+# Обновления, привязанные к чату: всё состояние загадок живёт у шарда этого чата
+_CHAT_UPDATES = ("message", "edited_message", "channel_post", "edited_channel_post",
+                 "my_chat_member", "chat_join_request")
+
+
+# Ключ маршрутизации сырого обновления: id чата для сообщений и событий бота в чате,
+# id пользователя для нажатий кнопок (мастер создания загадок работает в ЛС).
+# chat_member — тоже по пользователю: он только сбрасывает кэш ролей участника,
+# а кэш читают проверки прав в ЛС, то есть шард пользователя
+def shard_key(raw):
+    member = raw.get("chat_member")
+    if member is not None:
+        return ((member.get("new_chat_member") or {}).get("user") or {}).get("id", 0)
+    for name in _CHAT_UPDATES:
+        update = raw.get(name)
+        if update is not None:
+            return (update.get("chat") or {}).get("id", 0)
+    for update in raw.values():
+        if isinstance(update, dict) and "from" in update:
+            return update["from"].get("id", 0)
+    return 0
+
+
+# Номер шарда по ключу; crc32 вместо hash(), чтобы он совпадал во всех процессах
+def shard_for(key, shards):
+    if shards <= 1:
+        return 0
+    return zlib.crc32(int(key).to_bytes(8, "little", signed=True)) % shards
+
+
+# Фронт многопроцессного режима: запускает по процессу на шард и раскладывает
+# сырые обновления по их очередям. Разбор обновлений и обработчики выполняются
+# уже в процессах-шардах, фронт смотрит только на id чата или пользователя
+class ShardDispatcher:
+    def __init__(self, target, shards, queue_size=1000):
+        self.shards = shards
+        context = multiprocessing.get_context("spawn")
+        self.queues = [context.Queue(maxsize=queue_size) for _ in range(shards)]
+        self.processed = context.Array("q", shards)  # шарды увеличивают свой счётчик сами
+        self.processes = [context.Process(target=target, args=(index, shards, self.queues[index], self.processed),
+                                          name=f"shard-{index}")
+                          for index in range(shards)]
+        self._lock = threading.Lock()
+        self._routed = [0] * shards
+        self._rejected = [0] * shards
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+        logger.info(f"Запущено шардов: {self.shards}")
+
+    def stop(self, timeout=30):
+        for inbox in self.queues:
+            inbox.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+    # False — очередь шарда переполнена, обновление не принято
+    def dispatch(self, raw, block=False):
+        index = shard_for(shard_key(raw), self.shards)
+        try:
+            self.queues[index].put(raw, block=block)
+        except queue.Full:
+            with self._lock:
+                self._rejected[index] += 1
+            return False
+        with self._lock:
+            self._routed[index] += 1
+        return True
+
+    def metrics(self):
+        with self._lock:
+            routed, rejected = list(self._routed), list(self._rejected)
+        shards = []
+        for index, process in enumerate(self.processes):
+            try:
+                depth = self.queues[index].qsize()
+            except NotImplementedError:  # macOS
+                depth = None
+            shards.append({"routed": routed[index], "rejected": rejected[index], "processed": self.processed[index],
+                           "queue_depth": depth, "alive": process.is_alive()})
+        return {"shards": shards}
+
+    # Long polling на фронте: getUpdates отдаёт сырые словари, их не нужно разбирать
+    def poll(self, token, allowed_updates=None, timeout=20, limit=100):
+        offset = None
+        while True:
+            try:
+                updates = apihelper.get_updates(token, offset, limit, timeout, allowed_updates, timeout)
+            except Exception as e:
+                logger.error(f"Ошибка getUpdates: {e}")
+                time.sleep(3)
+                continue
+            for raw in updates:
+                # При переполненной очереди ждём шард: Telegram хранит обновления сам
+                self.dispatch(raw, block=True)
+                offset = raw["update_id"] + 1
+
+
+# Цикл процесса-шарда: несколько потоков разбирают обновления из своей очереди
+# и отдают их обработчикам бота. None в очереди — сигнал остановки
+def serve_shard(bot, index, inbox, processed, workers=8, prefilter=None):
+    def worker():
+        while True:
+            raw = inbox.get()
+            if raw is None:
+                inbox.put(None)  # остановка для соседних потоков
+                return
+            try:
+                if prefilter is None or prefilter(raw):
+                    bot.process_new_updates([types.Update.de_json(raw)])
+            except Exception as e:
+                logger.error(f"Шард {index}: ошибка обработки обновления {raw.get('update_id')}: {e}")
+            with processed.get_lock():
+                processed[index] += 1
+
+    threads = [threading.Thread(target=worker, name=f"shard-{index}-worker-{i}", daemon=True) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
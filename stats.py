@@ -0,0 +1,56 @@
+# Счётчики статистики бота в таблице stats: обновляются в тех же транзакциях,
+# что и сами события, поэтому запрос статистики не трогает историю загадок
+COUNTERS = (
+    "riddles_created",  # черновики, дошедшие до выбора таймера
+    "riddles_sent",  # загадки, опубликованные в чатах
+    "riddles_solved",
+    "riddles_expired",
+    "riddles_dropped",  # активные загадки, удалённые вместе с недоступным чатом
+    "solve_time_total",  # суммарное время отгадывания, сек
+    "chats_total",
+    "members_total",
+)
+
+
+def create_table(db):
+    db.execute('''CREATE TABLE IF NOT EXISTS stats (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL DEFAULT 0)''')
+    db.executemany("INSERT OR IGNORE INTO stats (key, value) VALUES (?, 0)", [(key,) for key in COUNTERS])
+
+
+# Пересчёт счётчиков по существующим данным (один раз при миграции).
+# Завершённая загадка с таймером считается истёкшей, если end_time не раньше
+# конца таймера: при отгадке end_time перезаписывается моментом победы
+def rebuild(db):
+    sent, solved, expired, solve_time = db.execute('''
+        SELECT COUNT(*),
+               COALESCE(SUM(is_expired = 0), 0),
+               COALESCE(SUM(is_expired = 1), 0),
+               COALESCE(SUM(CASE WHEN is_expired = 0 THEN end_time - start_time END), 0)
+        FROM (SELECT end_time, start_time,
+                     CASE WHEN active = 1 THEN NULL
+                          WHEN time_limit IS NOT NULL AND end_time >= start_time + time_limit * 60 THEN 1
+                          ELSE 0 END AS is_expired
+              FROM riddles WHERE message_id IS NOT NULL)''').fetchone()
+    created = db.execute("SELECT COUNT(*) FROM riddles").fetchone()[0]
+    chats_total, members_total = db.execute("SELECT COUNT(*), COALESCE(SUM(members_count), 0) FROM chats").fetchone()
+    set_values(db, riddles_created=created, riddles_sent=sent, riddles_solved=solved, riddles_expired=expired,
+               riddles_dropped=0, solve_time_total=solve_time, chats_total=chats_total, members_total=members_total)
+
+
+def increment(db, **deltas):
+    db.executemany("UPDATE stats SET value = value + ? WHERE key = ?",
+                   [(delta, key) for key, delta in deltas.items() if delta])
+
+
+def set_values(db, **values):
+    db.executemany("UPDATE stats SET value = ? WHERE key = ?", [(value, key) for key, value in values.items()])
+
+
+def snapshot(db):
+    values = dict.fromkeys(COUNTERS, 0)
+    values.update(db.execute("SELECT key, value FROM stats"))
+    values["riddles_live"] = max(0, values["riddles_sent"] - values["riddles_solved"]
+                                 - values["riddles_expired"] - values["riddles_dropped"])
+    return values
@@ -0,0 +1,69 @@
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",  # В режиме WAL безопасно и без fsync на каждый коммит
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",  # ~16 МБ кэша страниц на соединение
+)
+
+
+# Доступ к SQLite: своё соединение у каждого потока, WAL и явные транзакции.
+# Вне transaction() каждый запрос выполняется в режиме автокоммита.
+class Database:
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute(f"PRAGMA busy_timeout = {int(self.timeout * 1000)}")
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    def execute(self, sql, params=()):
+        return self.connection().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.connection().executemany(sql, seq_of_params)
+
+    # Все записи внутри блока уходят одним коммитом; вложенные блоки
+    # присоединяются к внешней транзакции
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        self._local.depth = 1
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+        finally:
+            self._local.depth = 0
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+
+from aiohttp import web
+from telebot import types
+
+logger = logging.getLogger(__name__)
+
+
+# Приём обновлений через вебхук: asyncio-сервер только принимает и кладёт
+# обновления в ограниченную очередь, обработчики бота выполняет пул потоков.
+# Переполненная очередь отвечает 503, и Telegram (или балансировщик) повторит запрос.
+# С dispatcher сервер работает фронтом многопроцессного режима: обновления
+# уходят в очереди шардов (см. sharding.ShardDispatcher), собственный пул не нужен
+class WebhookServer:
+    def __init__(self, bot, host="0.0.0.0", port=8080, path="/webhook", secret=None, workers=8, queue_size=1000,
+                 prefilter=None, dispatcher=None):
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self.workers = workers
+        self.prefilter = prefilter  # prefilter(raw) -> False: обновление отбрасывается без разбора
+        self.dispatcher = dispatcher
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._counters = {"received": 0, "processed": 0, "rejected": 0, "failed": 0, "filtered": 0}
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        self._threads = []
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_updates)
+        app.router.add_get("/metrics", self.handle_metrics)
+        return app
+
+    async def handle_updates(self, request):
+        if self.secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != self.secret:
+            return web.Response(status=403)
+        try:
+            payload = await request.json(loads=json.loads)
+        except ValueError:
+            return web.Response(status=400, text="invalid json")
+        # Telegram присылает по одному обновлению; списком можно отправить пачку
+        batch = payload if isinstance(payload, list) else [payload]
+        if self.prefilter is not None:
+            kept = [raw for raw in batch if self.prefilter(raw)]
+            self._count("filtered", len(batch) - len(kept))
+            if not kept:
+                return web.json_response({"accepted": 0})
+            batch = kept
+        if self.dispatcher is not None:
+            return self._dispatch(batch)
+        if self.queue.maxsize - self.queue.qsize() < len(batch):
+            self._count("rejected", len(batch))
+            return web.json_response({"accepted": 0, "queue_depth": self.queue.qsize()}, status=503,
+                                     headers={"Retry-After": "1"})
+        now = time.monotonic()
+        accepted = 0
+        for raw in batch:
+            try:
+                self.queue.put_nowait((now, types.Update.de_json(raw)))
+                accepted += 1
+            except queue.Full:
+                self._count("rejected", len(batch) - accepted)
+                break
+            except Exception as e:
+                logger.error(f"Некорректное обновление в вебхуке: {e}")
+                self._count("failed")
+        self._count("received", accepted)
+        return web.json_response({"accepted": accepted})
+
+    # Пачка раскладывается по шардам до первого переполненного; в ответе 503
+    # accepted — длина принятого начала пачки, повторять нужно только хвост
+    def _dispatch(self, batch):
+        accepted = 0
+        for raw in batch:
+            if not self.dispatcher.dispatch(raw):
+                break
+            accepted += 1
+        self._count("received", accepted)
+        if accepted < len(batch):
+            self._count("rejected", len(batch) - accepted)
+            return web.json_response({"accepted": accepted}, status=503, headers={"Retry-After": "1"})
+        return web.json_response({"accepted": accepted})
+
+    async def handle_metrics(self, request):
+        return web.json_response(self.metrics())
+
+    def metrics(self):
+        if self.dispatcher is not None:
+            with self._lock:
+                return dict(self._counters, **self.dispatcher.metrics())
+        with self._lock:
+            processed = self._counters["processed"]
+            return dict(self._counters,
+                        queue_depth=self.queue.qsize(),
+                        queue_capacity=self.queue.maxsize,
+                        in_flight=self._in_flight,
+                        workers=self.workers,
+                        latency_avg_ms=round(self._latency_total / processed * 1000, 2) if processed else 0.0,
+                        latency_max_ms=round(self._latency_max * 1000, 2))
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            received_at, update = item
+            with self._lock:
+                self._in_flight += 1
+            failed = False
+            try:
+                self.bot.process_new_updates([update])
+            except Exception as e:
+                failed = True
+                logger.error(f"Ошибка обработки обновления {update.update_id}: {e}")
+            finally:
+                latency = time.monotonic() - received_at
+                with self._lock:
+                    self._in_flight -= 1
+                    self._counters["failed" if failed else "processed"] += 1
+                    if not failed:
+                        self._latency_total += latency
+                        self._latency_max = max(self._latency_max, latency)
+                self.queue.task_done()
+
+    def start_workers(self):
+        if self.dispatcher is not None:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"webhook-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop_workers(self):
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    async def serve(self):
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        await web.TCPSite(runner, self.host, self.port).start()
+        logger.info(f"Вебхук слушает {self.host}:{self.port}{self.path}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    def run(self):
+        self.start_workers()
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self.stop_workers()